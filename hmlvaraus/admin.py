@@ -1,5 +1,5 @@
 from helusers.admin import *
-from hmlvaraus.models import hml_reservation, berth, sms_message, purchase
+from hmlvaraus.models import hml_reservation, berth, sms_message, purchase, notification, berth_lease, import_job
 
 
 class HMLReservationAdmin(admin.ModelAdmin):
@@ -14,6 +14,15 @@ class BerthPriceAdmin(admin.ModelAdmin):
 class SMSMessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'created_at', 'success', 'to_phone_number')
 
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'notification_type', 'channel', 'success', 'recipient')
+
+class BerthLeaseAdmin(admin.ModelAdmin):
+    list_display = ('berth', 'acquired_at', 'holder')
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'state', 'rows_total', 'rows_processed', 'rows_failed')
+
 class PurchaseAdmin(admin.ModelAdmin):
     list_display = ('id', 'product_name', 'reserver_name', 'purchase_process_started', 'finished')
 
@@ -21,4 +30,7 @@ admin.site.register(hml_reservation.HMLReservation, HMLReservationAdmin)
 admin.site.register(berth.Berth, BerthAdmin)
 admin.site.register(berth.GroundBerthPrice, BerthPriceAdmin)
 admin.site.register(sms_message.SMSMessage, SMSMessageAdmin)
+admin.site.register(notification.Notification, NotificationAdmin)
+admin.site.register(berth_lease.BerthLease, BerthLeaseAdmin)
+admin.site.register(import_job.ImportJob, ImportJobAdmin)
 admin.site.register(purchase.Purchase, PurchaseAdmin)
\ No newline at end of file
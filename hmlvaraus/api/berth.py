@@ -1,5 +1,7 @@
 import arrow
 import django_filters
+import operator
+from functools import reduce
 from arrow.parser import ParserError
 from django.core.exceptions import PermissionDenied
 from rest_framework import viewsets, serializers, filters, exceptions, permissions, status, pagination
@@ -10,16 +12,54 @@ from resources.models import Reservation, Resource, Unit
 from hmlvaraus.api.resource import ResourceSerializer
 from hmlvaraus.models.berth import Berth, GroundBerthPrice
 from hmlvaraus.models.hml_reservation import HMLReservation
+from hmlvaraus.leases import get_leased_berth_ids
+from hmlvaraus.search import search_berth_ids
+from resources.pagination import KeysetPaginationMixin
 from resources.api.base import TranslatedModelSerializer, register_view
 from hmlvaraus.utils.utils import RelatedOrderingFilter
 from django.utils.translation import ugettext_lazy as _
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from rest_framework.views import APIView
 import six
 
 
+CURRENT_RESERVATION_FIELDS = ('id', 'is_paid', 'reserver_ssn', 'reservation', 'state_updated_at', 'is_paid_at', 'key_returned', 'key_returned_at', 'reservation__reserver_name', 'reservation__begin', 'reservation__end', 'reservation__comments', 'reservation__state',)
+
+BERTH_SELECT_RELATED = ('resource', 'resource__unit', 'resource__type', 'resource__generic_terms', 'resource__reservation_metadata_set')
+BERTH_PREFETCH_RELATED = ('resource__purposes', 'resource__images', 'resource__periods__days', 'resource__unit__periods__days')
+
+
+def prefetch_berth_listing(queryset, prefix='', current_reservation=True):
+    """
+    Load everything BerthSerializer needs in a fixed number of queries.
+
+    Prefix is the lookup path to the berth when the queryset isn't a berth queryset,
+    e.g. 'berth__' for HML reservations. The confirmed reservation of each berth is
+    only loaded with current_reservation, as it's shown to staff only.
+    """
+    queryset = queryset.select_related(*[prefix + lookup for lookup in BERTH_SELECT_RELATED])\
+        .prefetch_related(*[prefix + lookup for lookup in BERTH_PREFETCH_RELATED])
+    if current_reservation:
+        confirmed_reservations = HMLReservation.objects.filter(reservation__state=Reservation.CONFIRMED).select_related('reservation').order_by('id')
+        queryset = queryset.prefetch_related(Prefetch(prefix + 'hml_reservations', queryset=confirmed_reservations, to_attr='confirmed_reservations'))
+    return queryset
+
+
+def serialize_current_reservation(hml_reservation):
+    """
+    Returns the same dict as .values(*CURRENT_RESERVATION_FIELDS) for a fetched HML reservation.
+    """
+    data = {}
+    for field in CURRENT_RESERVATION_FIELDS:
+        if field == 'reservation':
+            data[field] = hml_reservation.reservation_id
+        elif field.startswith('reservation__'):
+            data[field] = getattr(hml_reservation.reservation, field[len('reservation__'):])
+        else:
+            data[field] = getattr(hml_reservation, field)
+    return data
+
+
 class BerthSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
     resource = ResourceSerializer(required=True)
     width_cm = serializers.IntegerField(required=True)
@@ -35,7 +75,11 @@ class BerthSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer)
 
     def get_current_reservation(self, berth):
         if self.context['request'].user.is_staff:
-            return berth.hml_reservations.filter(reservation__state='confirmed').values('id', 'is_paid', 'reserver_ssn', 'reservation', 'state_updated_at', 'is_paid_at', 'key_returned', 'key_returned_at', 'reservation__reserver_name', 'reservation__begin', 'reservation__end', 'reservation__comments', 'reservation__state',).first()
+            if hasattr(berth, 'confirmed_reservations'):
+                if not berth.confirmed_reservations:
+                    return None
+                return serialize_current_reservation(berth.confirmed_reservations[0])
+            return berth.hml_reservations.filter(reservation__state='confirmed').values(*CURRENT_RESERVATION_FIELDS).first()
         else:
             return {}
 
@@ -179,11 +223,42 @@ class BerthFilterBackend(filters.BaseFilterBackend):
 
         return queryset
 
-class BerthPagination(pagination.PageNumberPagination):
+class BerthSearchFilter(filters.SearchFilter):
+    """
+    Search berths by their own fields and, for staff, by the details of their reservers.
+
+    Reserver details are looked up from the search index of HML reservations
+    instead of joining the reservations to the berths.
+    """
+    def filter_queryset(self, request, queryset, view):
+        search_fields = getattr(view, 'search_fields', None)
+        search_terms = self.get_search_terms(request)
+
+        if not search_fields or not search_terms:
+            return queryset
+
+        berth_lookups = [self.construct_search(six.text_type(search_field)) for search_field in search_fields]
+
+        for search_term in search_terms:
+            queries = [Q(**{lookup: search_term}) for lookup in berth_lookups]
+            if request.user.is_staff:
+                queries.append(Q(id__in=search_berth_ids(search_term)))
+            queryset = queryset.filter(reduce(operator.or_, queries))
+
+        return queryset
+
+class BerthPagination(KeysetPaginationMixin, pagination.PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 5000
     def get_paginated_response(self, data):
+        if self.keyset:
+            return Response({
+                'next': self.next_cursor or '',
+                'previous': '',
+                'count': None,
+                'results': data
+            })
         next_page = ''
         previous_page = ''
         if self.page.has_next():
@@ -219,21 +294,22 @@ class BerthViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
 
     filter_class = BerthFilter
     permission_classes = [StaffWriteOnly]
-    filter_backends = (DjangoFilterBackend,filters.SearchFilter,RelatedOrderingFilter, BerthFilterBackend)
+    filter_backends = (DjangoFilterBackend,BerthSearchFilter,RelatedOrderingFilter, BerthFilterBackend)
     filter_fields = ['type']
-    search_fields = ['type', 'resource__name', 'resource__name_fi', 'resource__unit__name', 'resource__unit__name_fi', 'hml_reservations__reservation__reserver_name', 'hml_reservations__reservation__reserver_email_address', 'hml_reservations__reservation__reserver_phone_number']
+    search_fields = ['type', 'resource__name', 'resource__name_fi', 'resource__unit__name', 'resource__unit__name_fi']
     ordering_fields = ('__all__')
     pagination_class = BerthPagination
 
     def get_queryset(self):
         user = self.request.user
         qs = Berth.objects.filter(is_deleted=False).select_related('resource', 'resource__unit');
+        if self.request.method in permissions.SAFE_METHODS:
+            qs = prefetch_berth_listing(qs, current_reservation=user.is_staff)
         if user.is_staff:
             return qs
         else:
             #Only fetch berth if nobody has been reserving it for two minutes
-            two_minutes_ago = timezone.now() - timedelta(minutes=2)
-            return qs.filter(Q(reserving__lte=two_minutes_ago) | Q(reserving__isnull=True)).exclude(Q(type=Berth.GROUND) | Q(is_disabled=True)).distinct()
+            return qs.exclude(id__in=get_leased_berth_ids()).exclude(Q(type=Berth.GROUND) | Q(is_disabled=True))
 
     def destroy(self, request, *args, **kwargs):
         berth = self.get_object()
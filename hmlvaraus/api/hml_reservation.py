@@ -12,9 +12,11 @@ from django_filters.rest_framework import DjangoFilterBackend
 from munigeo import api as munigeo_api
 from resources.models import Reservation
 from hmlvaraus.api.reservation import ReservationSerializer
-from hmlvaraus.api.berth import BerthSerializer
+from hmlvaraus.api.berth import BerthSerializer, prefetch_berth_listing
 from hmlvaraus.models.hml_reservation import HMLReservation
 from hmlvaraus.models.purchase import Purchase
+from hmlvaraus.search import search_hml_reservations
+from resources.pagination import KeysetPaginationMixin
 from resources.api.base import TranslatedModelSerializer, register_view
 from hmlvaraus.utils.utils import RelatedOrderingFilter
 from django.utils.translation import ugettext_lazy as _
@@ -26,10 +28,12 @@ from rest_framework.views import APIView
 from django.conf import settings
 from django.http import HttpResponseRedirect
 from datetime import timedelta
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 from rest_framework.exceptions import ParseError
 from hmlvaraus import tasks
 from hmlvaraus.models.sms_message import SMSMessage
+from hmlvaraus.overlap import has_overlapping_reservation
+from hmlvaraus.leases import acquire_lease, check_lease_code, is_berth_leased
 
 LOG = logging.getLogger(__name__)
 
@@ -59,6 +63,8 @@ class HMLReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSe
         return obj.reservation.end < timezone.now()
 
     def get_is_renewed(self, obj):
+        if hasattr(obj, 'confirmed_children'):
+            return len(obj.confirmed_children) > 0
         return obj.child.filter(reservation__state=Reservation.CONFIRMED).exists()
 
     def validate(self, data):
@@ -69,11 +75,10 @@ class HMLReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSe
         if reservation_data != None:
             resource = reservation_data.get('resource')
             if resource:
-                overlaps_existing = False
+                reservation_id = None
                 if hml_reservation_id:
-                    overlaps_existing = HMLReservation.objects.filter(reservation__begin__lt=reservation_data.get('end'), reservation__end__gt=reservation_data.get('begin'), berth=resource.berth, reservation__state=Reservation.CONFIRMED).exclude(pk=hml_reservation_id).exists()
-                else:
-                    overlaps_existing = HMLReservation.objects.filter(reservation__begin__lt=reservation_data.get('end'), reservation__end__gt=reservation_data.get('begin'), berth=resource.berth, reservation__state=Reservation.CONFIRMED).exists()
+                    reservation_id = HMLReservation.objects.filter(pk=hml_reservation_id).values_list('reservation_id', flat=True).first()
+                overlaps_existing = has_overlapping_reservation(resource.berth, reservation_data.get('begin'), reservation_data.get('end'), exclude_reservation_id=reservation_id)
 
                 if overlaps_existing:
                     raise serializers.ValidationError(_('New reservation overlaps existing reservation'))
@@ -190,10 +195,9 @@ class HMLReservationGroundBerthSerializer(HMLReservationSerializer):
         request_user = self.context['request'].user
 
         if data['berth']['type'] != Berth.GROUND and request_user.is_staff and data.get('reservation'):
-            two_minutes_ago = timezone.now() - timedelta(minutes=2)
             reservation_data = data.get('reservation')
             resource = reservation_data['resource']
-            if resource.berth.reserving and resource.berth.reserving > two_minutes_ago:
+            if is_berth_leased(resource.berth):
                 raise serializers.ValidationError(_('Someone is reserving the berth at the moment'))
 
         return data
@@ -338,11 +342,19 @@ class HMLReservationFilterBackend(filters.BaseFilterBackend):
 
         return queryset
 
-class HMLReservationPagination(pagination.PageNumberPagination):
+class HMLReservationPagination(KeysetPaginationMixin, pagination.PageNumberPagination):
+    keyset_ordering = ('reservation__begin', 'reservation__id')
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 5000
     def get_paginated_response(self, data):
+        if self.keyset:
+            return Response({
+                'next': self.next_cursor or '',
+                'previous': '',
+                'count': None,
+                'results': data
+            })
         next_page = ''
         previous_page = ''
         if self.page.has_next():
@@ -360,6 +372,26 @@ class StaffWriteOnly(permissions.BasePermission):
      def has_permission(self, request, view):
         return request.method in permissions.SAFE_METHODS or request.user.is_staff
 
+def prefetch_hml_reservation_listing(queryset):
+    """
+    Load everything HMLReservationSerializer needs, so that serializing a page
+    costs a fixed number of queries regardless of the page size.
+    """
+    confirmed_children = HMLReservation.objects.filter(reservation__state=Reservation.CONFIRMED).only('id', 'parent_id')
+    queryset = queryset.select_related('purchase')\
+        .prefetch_related(Prefetch('child', queryset=confirmed_children, to_attr='confirmed_children'))
+    return prefetch_berth_listing(queryset, prefix='berth__')
+
+class HMLReservationSearchFilter(filters.SearchFilter):
+    """
+    Search reservations by the ssn, name, email address, billing street or phone number of the reserver.
+    """
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '')
+        if not text.strip():
+            return queryset
+        return search_hml_reservations(text, queryset)
+
 class HMLReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
     queryset = HMLReservation.objects.all().select_related('reservation', 'reservation__user', 'reservation__resource', 'reservation__resource__unit')
     serializer_class = HMLReservationSerializer
@@ -367,12 +399,17 @@ class HMLReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
     permission_classes = [StaffWriteOnly, permissions.IsAuthenticated]
     filter_class = HMLReservationFilter
 
-    filter_backends = (DjangoFilterBackend,filters.SearchFilter,RelatedOrderingFilter,HMLReservationFilterBackend)
+    filter_backends = (DjangoFilterBackend,HMLReservationSearchFilter,RelatedOrderingFilter,HMLReservationFilterBackend)
     filter_fields = ('reserver_ssn')
-    search_fields = ['reserver_ssn', 'reservation__billing_address_street', 'reservation__reserver_email_address', 'reservation__reserver_name', 'reservation__reserver_phone_number']
     ordering_fields = ('__all__')
     pagination_class = HMLReservationPagination
 
+    def get_queryset(self):
+        queryset = super(HMLReservationViewSet, self).get_queryset()
+        if self.request.method in permissions.SAFE_METHODS:
+            queryset = prefetch_hml_reservation_listing(queryset)
+        return queryset
+
     def get_serializer_class(self):
         if self.request.method == 'POST' and self.request.data.get('berth'):
             if self.request.data.get('berth').get('type') == Berth.GROUND and not self.request.data.get('berth').get('id'):
@@ -387,7 +424,7 @@ class HMLReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
             code = request.data.pop('code')
             berth = Berth.objects.get(pk=request.data['berth']['id'], is_deleted=False)
 
-            if code != hashlib.sha1(str(berth.reserving).encode('utf-8')).hexdigest():
+            if not check_lease_code(berth, code):
                 raise ValidationError(_('Invalid meta data'))
         hml_reservation = serializer.save()
         tasks.send_confirmation.delay(hml_reservation.pk)
@@ -409,7 +446,7 @@ class PurchaseView(APIView):
             code = request.data.pop('code')
             berth = Berth.objects.get(pk=request.data['berth']['id'], is_deleted=False)
 
-            if code != hashlib.sha1(str(berth.reserving).encode('utf-8')).hexdigest():
+            if not check_lease_code(berth, code):
                 raise ValidationError(_('Invalid meta data'))
 
             serializer = HMLReservationSerializer(data=request.data, context={'request': request})
@@ -592,18 +629,11 @@ class PurchaseView(APIView):
             return Response({}, status=status.HTTP_200_OK)
 
         if body.get('resource', None):
-            time = timezone.now()
             berth = Berth.objects.get(resource_id=body.get('resource', None), is_deleted=False)
-            if not berth.reserving or (time - berth.reserving).total_seconds() > 59 or berth.reserving_staff_member == request.user:
-                berth.reserving = time
-                if request.user and request.user.is_staff:
-                    berth.reserving_staff_member = request.user
-                else:
-                    berth.reserving_staff_member = None
-                berth.save()
-            else:
+            code = acquire_lease(berth, request.user)
+            if not code:
                 return Response(None, status=status.HTTP_404_NOT_FOUND)
-            return Response({'code': hashlib.sha1(str(berth.reserving).encode('utf-8')).hexdigest()}, status=status.HTTP_200_OK)
+            return Response({'code': code}, status=status.HTTP_200_OK)
 
         return Response(None, status=status.HTTP_404_NOT_FOUND)
 
@@ -636,7 +666,7 @@ class RenewalView(APIView):
             new_reservation.begin = new_start
             new_reservation.end = new_end
 
-            overlaps_existing = HMLReservation.objects.filter(reservation__begin__lt=new_end, reservation__end__gt=new_start, berth=new_hml_reservation.berth, reservation__state=Reservation.CONFIRMED).exists()
+            overlaps_existing = has_overlapping_reservation(new_hml_reservation.berth, new_start, new_end)
             if overlaps_existing:
                 raise serializers.ValidationError(_('New reservation overlaps existing reservation'))
 
@@ -765,7 +795,7 @@ class RenewalView(APIView):
             new_reservation.begin = new_start
             new_reservation.end = new_end
 
-            overlaps_existing = HMLReservation.objects.filter(reservation__begin__lt=new_end, reservation__end__gt=new_start, berth=new_hml_reservation.berth, reservation__state=Reservation.CONFIRMED).exists()
+            overlaps_existing = has_overlapping_reservation(new_hml_reservation.berth, new_start, new_end)
             if overlaps_existing:
                 raise serializers.ValidationError(_('New reservation overlaps existing reservation'))
 
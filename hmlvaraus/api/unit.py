@@ -7,14 +7,14 @@ from django_filters.rest_framework import DjangoFilterBackend
 from munigeo import api as munigeo_api
 from resources.models import Resource, Unit, Reservation
 from hmlvaraus.models.berth import Berth
-from hmlvaraus.models.hml_reservation import HMLReservation
 from resources.api.unit import UnitSerializer
 from django.contrib.gis.geos import GEOSGeometry
+from resources.pagination import KeysetPaginationMixin
 from resources.api.base import register_view
 from hmlvaraus.utils.utils import RelatedOrderingFilter
 from resources.api.base import TranslatedModelSerializer
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Q, Count, Case, When, IntegerField
 from django.utils.translation import ugettext_lazy as _
 
 class SimpleResourceSerializer(TranslatedModelSerializer):
@@ -24,6 +24,52 @@ class SimpleResourceSerializer(TranslatedModelSerializer):
         model = Resource
         fields = ['name', 'reservable']
 
+UNIT_STATISTICS_DEFAULTS = {
+    'resources_total': 0,
+    'resources_count': 0,
+    'resources_reservable_count': 0,
+    'reservation_count': 0,
+}
+
+
+def get_unit_statistics(unit_ids):
+    """
+    Returns a dict of unit id -> berth statistics for the given units,
+    computed with one grouped aggregate query over their resources.
+
+    Every count is a distinct count, so joining the reservations of the
+    berths doesn't inflate the resource counts.
+    """
+    now = timezone.now()
+    not_deleted = Q(berth__isnull=True) | Q(berth__is_deleted=False)
+    reservable = Q(reservable=True) & (Q(berth__isnull=True) | (Q(berth__is_disabled=False, berth__is_deleted=False) & ~Q(berth__type=Berth.GROUND)))
+    ongoing_reservation = Q(
+        berth__hml_reservations__reservation__begin__lte=now,
+        berth__hml_reservations__reservation__end__gte=now,
+        berth__hml_reservations__reservation__state=Reservation.CONFIRMED
+    )
+
+    rows = Resource.objects.filter(unit_id__in=unit_ids).order_by().values('unit_id').annotate(
+        resources_total=Count('id', distinct=True),
+        resources_count=Count(Case(When(not_deleted, then='id'), output_field=IntegerField()), distinct=True),
+        resources_reservable_count=Count(Case(When(reservable, then='id'), output_field=IntegerField()), distinct=True),
+        reservation_count=Count(Case(When(ongoing_reservation, then='berth__hml_reservations__id'), output_field=IntegerField()), distinct=True),
+    )
+
+    statistics = {unit_id: dict(UNIT_STATISTICS_DEFAULTS) for unit_id in unit_ids}
+    for row in rows:
+        statistics[row.pop('unit_id')] = row
+    return statistics
+
+
+class UnitListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Compute the statistics of the whole page at once instead of per unit
+        units = list(data.all() if hasattr(data, 'all') else data)
+        self.child.unit_statistics = get_unit_statistics([unit.pk for unit in units])
+        return super(UnitListSerializer, self).to_representation(units)
+
+
 class UnitSerializer(UnitSerializer):
     name = serializers.CharField(required=True)
     resources = SimpleResourceSerializer(read_only=True, many=True)
@@ -32,17 +78,28 @@ class UnitSerializer(UnitSerializer):
     reservation_count = serializers.SerializerMethodField()
     is_deleted = serializers.SerializerMethodField()
 
+    class Meta(UnitSerializer.Meta):
+        list_serializer_class = UnitListSerializer
+
+    def get_statistics(self, obj):
+        unit_statistics = getattr(self, 'unit_statistics', None)
+        if unit_statistics is None or obj.pk not in unit_statistics:
+            unit_statistics = get_unit_statistics([obj.pk])
+            self.unit_statistics = unit_statistics
+        return unit_statistics[obj.pk]
+
     def get_is_deleted(self, obj):
-        return obj.resources.exclude(Q(berth__is_deleted=True)).count() == 0 and obj.resources.count() > 0
+        statistics = self.get_statistics(obj)
+        return statistics['resources_count'] == 0 and statistics['resources_total'] > 0
 
     def get_resources_count(self, obj):
-        return obj.resources.exclude(Q(berth__is_deleted=True)).count()
+        return self.get_statistics(obj)['resources_count']
 
     def get_resources_reservable_count(self, obj):
-        return obj.resources.filter(reservable=True).exclude(Q(berth__type=Berth.GROUND) | Q(berth__is_disabled=True) | Q(berth__is_deleted=True)).count()
+        return self.get_statistics(obj)['resources_reservable_count']
 
     def get_reservation_count(self, obj):
-        return HMLReservation.objects.filter(berth__resource__in=obj.resources.all(), reservation__begin__lte=timezone.now(), reservation__end__gte=timezone.now(), reservation__state=Reservation.CONFIRMED).count()
+        return self.get_statistics(obj)['reservation_count']
 
     def validate(self, data):
         request_user = self.context['request'].user
@@ -77,11 +134,18 @@ class UnitFilter(django_filters.FilterSet):
         model = Unit
         fields = []
 
-class UnitPagination(pagination.PageNumberPagination):
+class UnitPagination(KeysetPaginationMixin, pagination.PageNumberPagination):
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 5000
     def get_paginated_response(self, data):
+        if self.keyset:
+            return Response({
+                'next': self.next_cursor or '',
+                'previous': '',
+                'count': None,
+                'results': data
+            })
         next_page = ''
         previous_page = ''
         if self.page.has_next():
@@ -113,6 +177,9 @@ class UnitViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save()
 
+    def perform_update(self, serializer):
+        serializer.save(modified_at=timezone.now())
+
     def destroy(self, request, *args, **kwargs):
         unit = self.get_object()
         berths = Berth.objects.filter(resource__unit=unit)
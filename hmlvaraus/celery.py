@@ -36,4 +36,8 @@ app.conf.beat_schedule = {
         'task': 'hmlvaraus.tasks.check_reservability',
         'schedule': crontab(minute=0, hour='*/1')
     },
+    'refresh_opening_hours': {
+        'task': 'hmlvaraus.tasks.refresh_opening_hours',
+        'schedule': crontab(minute=30, hour='3')
+    },
 }
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+"""Bulk import of units, berths and reservations from semicolon separated files"""
+
+import codecs
+import csv
+import datetime
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import pytz
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext as _
+from psycopg2.extras import DateTimeTZRange
+
+from hmlvaraus.models.berth import Berth
+from hmlvaraus.models.hml_reservation import HMLReservation
+from resources.models import Unit, Reservation, Resource, ResourceType
+from resources.models.resource import generate_access_code
+from resources.models.search import update_search_documents
+from resources.models.typeahead import invalidate_typeahead
+from resources.models.utils import generate_id
+
+LOG = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# Row errors stored on an import job, the rest are only counted
+MAX_JOB_ERRORS = 1000
+
+UNIT_FILE = '1'
+BERTH_FILE = '2'
+RESERVATION_FILE = '3'
+
+BERTH_TYPE_MAPPING = {
+    'numero': Berth.NUMBER,
+    'laituri': Berth.DOCK,
+    'poletti': Berth.GROUND,
+}
+
+IMPORT_TIME_ZONE = pytz.timezone('Europe/Helsinki')
+
+
+class ImportFileError(Exception):
+    pass
+
+
+def generate_ids(count):
+    """
+    Generate primary keys for objects created with bulk_create, which bypasses
+    AutoIdentifiedModel.save(). generate_id() is time based, so ids generated
+    within the same microsecond are skipped.
+    """
+    ids = []
+    seen = set()
+    while len(ids) < count:
+        new_id = generate_id()
+        if new_id not in seen:
+            seen.add(new_id)
+            ids.append(new_id)
+    return ids
+
+
+def read_rows(uploaded_file):
+    """
+    Yields (line_number, fields) tuples of a file without reading it in memory at once.
+    Empty rows are skipped.
+    """
+    reader = csv.reader(codecs.iterdecode(uploaded_file, 'utf-8'), delimiter=';')
+    for fields in reader:
+        if not any(field.strip() for field in fields):
+            continue
+        yield reader.line_num, fields
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_int(value):
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(_('Invalid number: %s') % value)
+
+
+def parse_date(value):
+    date = parse_datetime(value + ' 00:00:00')
+    if date is None:
+        raise ValueError(_('Invalid date: %s') % value)
+    return IMPORT_TIME_ZONE.localize(date, is_dst=None)
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.datetime.strptime(value, '%d.%m.%Y %H:%M')
+    except ValueError:
+        raise ValueError(_('Invalid time: %s') % value)
+
+
+class BaseImporter(object):
+    """
+    Imports the rows of one file type in chunks.
+
+    Lookup maps of the existing objects are built once in prepare() and kept up
+    to date with the objects created by process_chunk(), so each chunk costs a
+    fixed number of queries. Rows that can't be imported are skipped and reported
+    in errors.
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.processed = 0
+        self.errors = []
+
+    def prepare(self):
+        pass
+
+    def parse_row(self, fields):
+        """
+        Returns the objects to create for a row, raises ValueError if it's invalid.
+        """
+        raise NotImplementedError()
+
+    def create_objects(self, rows):
+        raise NotImplementedError()
+
+    def process_chunk(self, chunk):
+        rows = []
+        for line_number, fields in chunk:
+            self.processed += 1
+            try:
+                row = self.parse_row(fields)
+            except ValueError as e:
+                self.add_error(line_number, str(e))
+                continue
+            if row is not None:
+                rows.append(row)
+        if rows:
+            self.create_objects(rows)
+
+    def add_error(self, line_number, message):
+        self.errors.append({'row': line_number, 'error': message})
+
+    def get_result(self):
+        return {
+            'processed': self.processed,
+            'created': self.created,
+            'failed': len(self.errors),
+            'errors': self.errors,
+        }
+
+
+class UnitImporter(BaseImporter):
+    def get_key(self, unit):
+        location = unit.location.wkt if unit.location else None
+        return (unit.name, unit.street_address, unit.address_zip, unit.email, unit.phone, location, unit.description)
+
+    def prepare(self):
+        self.existing = {self.get_key(unit) for unit in Unit.objects.all()}
+
+    def parse_location(self, value):
+        if not value:
+            return None
+        coordinates = []
+        try:
+            for coord in value.split(','):
+                coordinates = [float(coord.strip())] + coordinates
+        except ValueError:
+            raise ValueError(_('Invalid location: %s') % value)
+        return GEOSGeometry(json.dumps({'type': 'Point', 'coordinates': coordinates}))
+
+    def parse_row(self, fields):
+        if len(fields) < 7:
+            raise ValueError(_('Missing fields'))
+
+        unit = Unit(name=fields[0], street_address=fields[1], address_zip=fields[2], email=fields[3], phone=fields[4], location=self.parse_location(fields[5].strip()), description=fields[6])
+        key = self.get_key(unit)
+        if key in self.existing:
+            return None
+        self.existing.add(key)
+        return unit
+
+    def create_objects(self, units):
+        for unit, unit_id in zip(units, generate_ids(len(units))):
+            unit.pk = unit_id
+        Unit.objects.bulk_create(units)
+        # bulk_create skips the post_save receiver that rebuilds the typeahead indexes
+        invalidate_typeahead(Unit)
+        self.created += len(units)
+
+
+class BerthImporter(BaseImporter):
+    def prepare(self):
+        self.units = {}
+        for unit in Unit.objects.all():
+            # None marks an ambiguous unit name
+            self.units[unit.name] = None if unit.name in self.units else unit
+
+        self.resource_type = None
+        for resource_type in ResourceType.objects.all():
+            if 'vene' in resource_type.name.lower() or 'boat' in resource_type.name.lower():
+                self.resource_type = resource_type
+        if self.resource_type is None:
+            raise ImportFileError(_('Boat resource type is missing'))
+
+        self.resources = {}
+        for resource in Resource.objects.filter(reservable=True, type=self.resource_type):
+            self.resources[(resource.unit_id, resource.name, resource.description)] = resource
+
+        self.berths = {}
+        for berth in Berth.objects.all():
+            self.berths[berth.resource_id] = self.get_berth_values(berth)
+        # Berths of the current chunk by resource key, as new resources have no id yet
+        self.pending_berths = {}
+
+    def get_berth_values(self, berth):
+        return (berth.is_disabled, berth.price, berth.length_cm, berth.width_cm, berth.depth_cm, berth.type)
+
+    def parse_row(self, fields):
+        if len(fields) < 9:
+            raise ValueError(_('Missing fields'))
+
+        unit = self.units.get(fields[0])
+        if unit is None:
+            raise ValueError(_('Unit not found: %s') % fields[0])
+
+        price = Decimal(0)
+        if fields[4]:
+            try:
+                price = Decimal(fields[4].replace(',', '.'))
+            except InvalidOperation:
+                raise ValueError(_('Invalid price: %s') % fields[4])
+
+        berth_type = BERTH_TYPE_MAPPING.get(fields[8].strip().lower(), None)
+        if berth_type is None:
+            raise ValueError(_('Invalid berth type: %s') % fields[8])
+
+        new_resource = None
+        key = (unit.pk, fields[1], fields[2])
+        resource = self.resources.get(key)
+        if resource is None:
+            resource = new_resource = Resource(unit=unit, name=fields[1], description=fields[2], type=self.resource_type, reservable=True)
+            self.resources[key] = resource
+
+        berth = Berth(resource=resource, is_disabled=fields[3] == 'kyllä', price=price, length_cm=parse_int(fields[5]), width_cm=parse_int(fields[6]), depth_cm=parse_int(fields[7]), type=berth_type)
+        values = self.get_berth_values(berth)
+        existing_values = self.pending_berths.get(key)
+        if existing_values is None and resource.pk is not None:
+            existing_values = self.berths.get(resource.pk)
+        if existing_values is not None:
+            if existing_values != values:
+                raise ValueError(_('Berth %s already exists with different values') % fields[1])
+            return None
+        self.pending_berths[key] = values
+        return new_resource, berth
+
+    def create_objects(self, rows):
+        resources = [resource for resource, berth in rows if resource is not None]
+        for resource, resource_id in zip(resources, generate_ids(len(resources))):
+            resource.pk = resource_id
+        Resource.objects.bulk_create(resources)
+        if resources:
+            # bulk_create skips the post_save receivers that build the search documents and typeahead indexes
+            update_search_documents(resource_ids=[resource.pk for resource in resources])
+            invalidate_typeahead(Resource)
+
+        berths = []
+        for resource, berth in rows:
+            # New resources got their primary key only after the berth was built
+            berth.resource_id = berth.resource.pk
+            self.berths[berth.resource.pk] = self.get_berth_values(berth)
+            berths.append(berth)
+        Berth.objects.bulk_create(berths)
+        self.pending_berths = {}
+        self.created += len(berths)
+
+
+class ReservationImporter(BaseImporter):
+    def prepare(self):
+        self.resources = {}
+        for resource in Resource.objects.filter(berth__isnull=False).select_related('unit', 'berth'):
+            key = (resource.unit.name if resource.unit else None, resource.name, resource.description)
+            # None marks an ambiguous resource
+            self.resources[key] = None if key in self.resources else resource
+
+    def parse_row(self, fields):
+        if len(fields) < 13:
+            raise ValueError(_('Missing fields'))
+
+        resource = self.resources.get((fields[1], fields[0], fields[4]))
+        if resource is None:
+            raise ValueError(_('Berth not found: %s') % fields[0])
+
+        begin = parse_date(fields[2])
+        end = parse_date(fields[3])
+
+        state = Reservation.CONFIRMED
+        state_updated_at = timezone.now()
+        is_paid = False
+        is_paid_at = None
+        if fields[5].strip():
+            state_updated_at = parse_timestamp(fields[5])
+            state = Reservation.CANCELLED
+
+        if fields[6].strip():
+            is_paid_at = parse_timestamp(fields[6])
+            is_paid = True
+
+        # bulk_create bypasses Reservation.save(), so fill in what it would
+        access_code = ''
+        if resource.is_access_code_enabled():
+            access_code = generate_access_code(resource.access_code_type)
+
+        reservation = Reservation(
+            resource=resource,
+            begin=begin,
+            end=end,
+            duration=DateTimeTZRange(begin, end, '[)'),
+            access_code=access_code,
+            event_description=fields[4] or '',
+            state=state,
+            reserver_name=fields[7] or '',
+            reserver_email_address=fields[8] or '',
+            reserver_phone_number=fields[9] or '',
+            reserver_address_street=fields[10] or '',
+            reserver_address_city=fields[11] or '',
+            reserver_address_zip=fields[12] or '',
+        )
+        hml_reservation = HMLReservation(berth=resource.berth, state_updated_at=state_updated_at, is_paid_at=is_paid_at, is_paid=is_paid)
+        return reservation, hml_reservation
+
+    def create_objects(self, rows):
+        reservations = Reservation.objects.bulk_create([reservation for reservation, hml_reservation in rows])
+
+        hml_reservations = []
+        for reservation, (unused, hml_reservation) in zip(reservations, rows):
+            hml_reservation.reservation = reservation
+            # bulk_create skips the pre_save signal that sets this
+            hml_reservation.search_text = hml_reservation.get_search_text()
+            hml_reservations.append(hml_reservation)
+        HMLReservation.objects.bulk_create(hml_reservations)
+
+        Resource.objects.filter(pk__in={reservation.resource_id for reservation in reservations}).update(reservable=False)
+        self.created += len(hml_reservations)
+
+
+IMPORTERS = {
+    UNIT_FILE: UnitImporter,
+    BERTH_FILE: BerthImporter,
+    RESERVATION_FILE: ReservationImporter,
+}
+
+
+def open_import(uploaded_file):
+    """
+    Returns an importer for the file and an iterator of its data rows.
+
+    The first character of the first row tells the type of the file and
+    the second row has the column headers.
+    """
+    rows = read_rows(uploaded_file)
+    line_number, fields = next(rows, (None, None))
+    importer_class = None
+    if fields and fields[0]:
+        importer_class = IMPORTERS.get(fields[0].strip()[:1])
+    if importer_class is None:
+        raise ImportFileError(_('Unknown file type'))
+    next(rows, None)
+    return importer_class(), rows
+
+
+def run_import(uploaded_file, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Import a whole file in one transaction. With dry_run the transaction is
+    rolled back, so the result only reports what would have been imported.
+
+    :rtype: dict
+    """
+    importer, rows = open_import(uploaded_file)
+
+    with transaction.atomic():
+        importer.prepare()
+        for chunk in chunked(rows, batch_size):
+            importer.process_chunk(chunk)
+        if dry_run:
+            transaction.set_rollback(True)
+
+    result = importer.get_result()
+    result['dry_run'] = dry_run
+    LOG.info('Imported %s rows, %s failed' % (result['created'], result['failed']))
+    return result
+
+
+def count_rows(uploaded_file):
+    # The type and header rows aren't data
+    return max(sum(1 for row in read_rows(uploaded_file)) - 2, 0)
+
+
+def run_import_job(job, batch_size=BATCH_SIZE):
+    """
+    Import the file of an ImportJob committing one chunk at a time.
+
+    The progress is saved in the same transaction as each chunk, so a job that
+    was interrupted continues from the row after its last committed chunk when
+    it's run again. The first MAX_JOB_ERRORS row errors are stored in the job.
+
+    :type job: hmlvaraus.models.import_job.ImportJob
+    """
+    from hmlvaraus.models.import_job import ImportJob
+
+    job.state = ImportJob.RUNNING
+    job.error = ''
+    job.modified_at = timezone.now()
+    job.save(update_fields=['state', 'error', 'modified_at'])
+
+    try:
+        job.file.open('rb')
+        if job.rows_total is None:
+            job.rows_total = count_rows(job.file)
+            job.save(update_fields=['rows_total'])
+            job.file.seek(0)
+
+        importer, rows = open_import(job.file)
+        importer.prepare()
+        rows = (row for row in rows if row[0] > job.last_line)
+
+        errors = json.loads(job.errors)
+        for chunk in chunked(rows, batch_size):
+            importer.processed = importer.created = 0
+            importer.errors = []
+            update_fields = ['rows_processed', 'rows_created', 'rows_failed', 'last_line', 'modified_at']
+            with transaction.atomic():
+                importer.process_chunk(chunk)
+                job.rows_processed += importer.processed
+                job.rows_created += importer.created
+                job.rows_failed += len(importer.errors)
+                job.last_line = chunk[-1][0]
+                # The errors are rewritten only while there's room for more, so they cost nothing once full
+                new_errors = importer.errors[:MAX_JOB_ERRORS - len(errors)]
+                if new_errors:
+                    errors.extend(new_errors)
+                    job.errors = json.dumps(errors)
+                    update_fields.append('errors')
+                job.modified_at = timezone.now()
+                job.save(update_fields=update_fields)
+    except Exception as e:
+        LOG.exception('Import job %s failed' % job.pk)
+        job.state = ImportJob.FAILED
+        job.error = str(e)
+        job.modified_at = timezone.now()
+        job.save(update_fields=['state', 'error', 'modified_at'])
+        return job
+    finally:
+        job.file.close()
+
+    job.state = ImportJob.FINISHED
+    job.modified_at = timezone.now()
+    job.save(update_fields=['state', 'modified_at'])
+    LOG.info('Import job %s finished: %s rows created, %s failed' % (job.pk, job.rows_created, job.rows_failed))
+    return job
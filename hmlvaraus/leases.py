@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Short leases that keep a berth for the citizen or staff member reserving it"""
+
+import hashlib
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from hmlvaraus.models.berth_lease import BerthLease
+
+# A lease can be taken over by someone else after this
+LEASE_DURATION = timedelta(seconds=59)
+# Leased berths are hidden from public listings for this long
+LEASE_LISTING_DURATION = timedelta(minutes=2)
+
+
+def get_lease_code(acquired_at):
+    return hashlib.sha1(str(acquired_at).encode('utf-8')).hexdigest()
+
+
+def acquire_lease(berth, user=None):
+    """
+    Take the lease of a berth if it's free, expired or already held by the same staff member.
+
+    The lease is taken with a single conditional UPDATE, or an INSERT if the berth
+    has never been leased, so two concurrent requests can't both get it.
+
+    Returns the lease code, or None if someone else holds the lease.
+
+    :type berth: hmlvaraus.models.berth.Berth
+    :rtype: str | None
+    """
+    now = timezone.now()
+    holder = user if user and user.is_staff else None
+    code = get_lease_code(now)
+
+    available = Q(acquired_at__lte=now - LEASE_DURATION)
+    if holder:
+        available |= Q(holder=holder)
+
+    if BerthLease.objects.filter(available, berth=berth).update(code=code, holder=holder, acquired_at=now):
+        return code
+
+    try:
+        with transaction.atomic():
+            BerthLease.objects.create(berth=berth, code=code, holder=holder, acquired_at=now)
+    except IntegrityError:
+        # The lease exists and is held by someone else
+        return None
+    return code
+
+
+def check_lease_code(berth, code):
+    return bool(code) and BerthLease.objects.filter(berth=berth, code=code).exists()
+
+
+def get_leased_berth_ids(now=None):
+    """
+    Subquery of berths that have been leased recently enough to be hidden from listings.
+    """
+    if now is None:
+        now = timezone.now()
+    return BerthLease.objects.filter(acquired_at__gt=now - LEASE_LISTING_DURATION).values('berth_id')
+
+
+def is_berth_leased(berth):
+    return get_leased_berth_ids().filter(berth=berth).exists()
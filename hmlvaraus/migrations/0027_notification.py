@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 09:00
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hmlvaraus', '0026_auto_20180427_0925'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time of creation')),
+                ('modified_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time of modification')),
+                ('notification_type', models.CharField(choices=[('renewal', 'renewal'), ('renewal_month', 'renewal month before end'), ('renewal_week', 'renewal week before end'), ('renewal_day', 'renewal day before end'), ('end', 'end'), ('key', 'key return'), ('confirmation', 'confirmation'), ('cancel', 'cancel')], max_length=20, verbose_name='Notification type')),
+                ('channel', models.CharField(choices=[('email', 'email'), ('sms', 'sms')], max_length=10, verbose_name='Channel')),
+                ('recipient', models.CharField(blank=True, max_length=254, verbose_name='Recipient')),
+                ('success', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notification_created', to=settings.AUTH_USER_MODEL, verbose_name='Created by')),
+                ('hml_reservation', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='hmlvaraus.HMLReservation', verbose_name='Reservation')),
+                ('modified_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notification_modified', to=settings.AUTH_USER_MODEL, verbose_name='Modified by')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
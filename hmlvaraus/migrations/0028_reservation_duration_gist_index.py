@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0051_auto_20170509_0758'),
+        ('hmlvaraus', '0027_notification'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE EXTENSION IF NOT EXISTS btree_gist;",
+            migrations.RunSQL.noop
+        ),
+        # Rows updated without Reservation.save() may lack the duration the overlap checks use
+        migrations.RunSQL(
+            "UPDATE resources_reservation SET duration = tstzrange(\"begin\", \"end\", '[)') WHERE duration IS NULL;",
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX resources_reservation_confirmed_duration_gist ON resources_reservation "
+            "USING gist (resource_id, duration) WHERE state = 'confirmed';",
+            "DROP INDEX resources_reservation_confirmed_duration_gist;"
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hmlvaraus', '0028_reservation_duration_gist_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BerthLease',
+            fields=[
+                ('berth', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lease', serialize=False, to='hmlvaraus.Berth', verbose_name='Berth')),
+                ('code', models.CharField(max_length=40, verbose_name='Code')),
+                ('acquired_at', models.DateTimeField(db_index=True, verbose_name='Acquired at')),
+                ('holder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Holder')),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='berth',
+            name='reserving',
+        ),
+        migrations.RemoveField(
+            model_name='berth',
+            name='reserving_staff_member',
+        ),
+    ]
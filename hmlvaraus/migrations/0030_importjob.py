@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hmlvaraus', '0029_berth_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time of creation')),
+                ('modified_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time of modification')),
+                ('file', models.FileField(upload_to='imports/', verbose_name='File')),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('finished', 'finished'), ('failed', 'failed')], default='pending', max_length=16, verbose_name='State')),
+                ('rows_total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Rows total')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='Rows processed')),
+                ('rows_created', models.PositiveIntegerField(default=0, verbose_name='Rows created')),
+                ('rows_failed', models.PositiveIntegerField(default=0, verbose_name='Rows failed')),
+                ('last_line', models.PositiveIntegerField(default=0, verbose_name='Last committed line')),
+                ('errors', models.TextField(default='[]', verbose_name='Row errors')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='importjob_created', to=settings.AUTH_USER_MODEL, verbose_name='Created by')),
+                ('modified_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='importjob_modified', to=settings.AUTH_USER_MODEL, verbose_name='Modified by')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
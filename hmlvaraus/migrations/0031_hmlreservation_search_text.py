@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+# Copies of the normalization in hmlvaraus.models.hml_reservation as it was when this
+# migration was written, so that later changes to the model don't change this migration
+
+def normalize_search_text(value):
+    return ' '.join((value or '').lower().split())
+
+
+def normalize_phone_number(value):
+    return re.sub(r'[^0-9]', '', value or '')
+
+
+def build_search_text(reserver_ssn, reservation):
+    return '\n'.join([
+        normalize_search_text(reserver_ssn),
+        normalize_search_text(reservation.reserver_name),
+        normalize_search_text(reservation.reserver_email_address),
+        normalize_search_text(reservation.billing_address_street),
+        normalize_phone_number(reservation.reserver_phone_number),
+    ])
+
+
+def fill_search_text(apps, schema_editor):
+    HMLReservation = apps.get_model('hmlvaraus', 'HMLReservation')
+    # Computed in Python so that the text is exactly what saving a reservation produces
+    for hml_reservation in HMLReservation.objects.select_related('reservation').iterator():
+        search_text = build_search_text(hml_reservation.reserver_ssn, hml_reservation.reservation)
+        HMLReservation.objects.filter(pk=hml_reservation.pk).update(search_text=search_text)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hmlvaraus', '0030_importjob'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='hmlreservation',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "CREATE INDEX hmlvaraus_hmlreservation_search_text_trgm ON hmlvaraus_hmlreservation "
+            "USING gin (search_text gin_trgm_ops);",
+            "DROP INDEX hmlvaraus_hmlreservation_search_text_trgm;"
+        ),
+    ]
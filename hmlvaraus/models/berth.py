@@ -1,7 +1,6 @@
 from django.contrib.gis.db import models
 from django.utils.translation import ugettext_lazy as _
 from resources.models import Resource
-from users.models import User
 
 class Berth(models.Model):
     DOCK = 'dock'
@@ -21,8 +20,6 @@ class Berth(models.Model):
     price = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
     type = models.CharField(choices=TYPE_CHOICES, verbose_name=_('Berth type'), default=DOCK, max_length=20)
     is_disabled = models.BooleanField(default=False)
-    reserving = models.DateTimeField(verbose_name=_('Reserving'), blank=True, null=True)
-    reserving_staff_member = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
     is_deleted = models.BooleanField(default=False)
 
     def __str__(self):
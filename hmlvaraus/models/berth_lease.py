@@ -0,0 +1,13 @@
+from django.contrib.gis.db import models
+from django.utils.translation import ugettext_lazy as _
+from hmlvaraus.models.berth import Berth
+from users.models import User
+
+class BerthLease(models.Model):
+    berth = models.OneToOneField(Berth, verbose_name=_('Berth'), primary_key=True, related_name='lease', on_delete=models.CASCADE)
+    code = models.CharField(verbose_name=_('Code'), max_length=40)
+    holder = models.ForeignKey(User, verbose_name=_('Holder'), null=True, blank=True, on_delete=models.SET_NULL)
+    acquired_at = models.DateTimeField(verbose_name=_('Acquired at'), db_index=True)
+
+    def __str__(self):
+        return "%s - %s" % (self.berth_id, self.acquired_at)
@@ -1,8 +1,14 @@
+import re
+
 from django.contrib.gis.db import models
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
-from resources.models import Reservation
+from resources.models import Reservation, ResourceImage
 from hmlvaraus.models.berth import Berth
+from hmlvaraus.overlap import has_overlapping_reservation
 import hashlib
 import time
 
@@ -22,6 +28,8 @@ class HMLReservation(models.Model):
     renewal_notification_day_sent_at = models.DateTimeField(verbose_name=_('Renewal notification day before end sent at'), blank=True, null=True)
     end_notification_sent_at = models.DateTimeField(verbose_name=_('End notification sent at'), blank=True, null=True)
     key_return_notification_sent_at = models.DateTimeField(verbose_name=_('Key return notification sent at'), blank=True, null=True)
+    # Reserver details for staff searches, see hmlvaraus.search
+    search_text = models.TextField(default='', blank=True, editable=False)
 
     def set_paid(self, paid=True):
         if paid:
@@ -99,9 +107,62 @@ class HMLReservation(models.Model):
                 self.berth.save()
             else:
                 resource = self.reservation.resource
-                if not HMLReservation.objects.filter(berth=self.berth, reservation__end__gte=timezone.now(), reservation__state=Reservation.CONFIRMED).exists():
+                if not has_overlapping_reservation(self.berth, timezone.now()):
                     resource.reservable = True
                     resource.save()
 
     def __str__(self):
         return "%s - %s - %s" % (self.pk, self.reservation.reserver_name, self.berth.resource.name)
+
+    def get_search_text(self):
+        return build_search_text(self.reserver_ssn, self.reservation)
+
+
+# Reservation fields included in the search text
+RESERVATION_SEARCH_FIELDS = {'reserver_name', 'reserver_email_address', 'billing_address_street', 'reserver_phone_number'}
+
+
+def normalize_search_text(value):
+    return ' '.join((value or '').lower().split())
+
+
+def normalize_phone_number(value):
+    return re.sub(r'[^0-9]', '', value or '')
+
+
+def get_reservation_search_text(reservation):
+    return '\n'.join([
+        normalize_search_text(reservation.reserver_name),
+        normalize_search_text(reservation.reserver_email_address),
+        normalize_search_text(reservation.billing_address_street),
+        normalize_phone_number(reservation.reserver_phone_number),
+    ])
+
+
+def build_search_text(reserver_ssn, reservation):
+    """
+    Search text of an HML reservation. Migration 0031 has its own copy of this.
+    """
+    return normalize_search_text(reserver_ssn) + '\n' + get_reservation_search_text(reservation)
+
+
+@receiver(pre_save, sender=HMLReservation)
+def set_search_text(sender, instance, **kwargs):
+    instance.search_text = instance.get_search_text()
+
+
+@receiver(post_save, sender=Reservation)
+def update_search_text(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not RESERVATION_SEARCH_FIELDS & set(update_fields):
+        return
+    for pk, reserver_ssn in HMLReservation.objects.filter(reservation=instance).values_list('pk', 'reserver_ssn'):
+        HMLReservation.objects.filter(pk=pk).update(search_text=build_search_text(reserver_ssn, instance))
+
+
+@receiver(post_save, sender=ResourceImage)
+def queue_resource_image_renditions(sender, instance, **kwargs):
+    if not instance.are_renditions_outdated():
+        return
+    from hmlvaraus import tasks
+    image_id = instance.pk
+    transaction.on_commit(lambda: tasks.generate_resource_image_renditions.delay(image_id))
@@ -0,0 +1,58 @@
+from datetime import timedelta
+from django.contrib.gis.db import models
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from resources.models.base import ModifiableModel
+
+# A running job that hasn't committed a chunk for this long is assumed to have died,
+# and a pending job that hasn't been started for this long to have lost its task
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+
+class ImportJob(ModifiableModel):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    STATE_CHOICES = (
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (FINISHED, _('finished')),
+        (FAILED, _('failed')),
+    )
+
+    file = models.FileField(verbose_name=_('File'), upload_to='imports/')
+    state = models.CharField(verbose_name=_('State'), max_length=16, choices=STATE_CHOICES, default=PENDING)
+    rows_total = models.PositiveIntegerField(verbose_name=_('Rows total'), null=True, blank=True)
+    rows_processed = models.PositiveIntegerField(verbose_name=_('Rows processed'), default=0)
+    rows_created = models.PositiveIntegerField(verbose_name=_('Rows created'), default=0)
+    rows_failed = models.PositiveIntegerField(verbose_name=_('Rows failed'), default=0)
+    last_line = models.PositiveIntegerField(verbose_name=_('Last committed line'), default=0)
+    errors = models.TextField(verbose_name=_('Row errors'), default='[]')
+    error = models.TextField(verbose_name=_('Error'), blank=True, default='')
+
+    def get_rows_remaining(self):
+        if self.rows_total is None:
+            return None
+        return max(self.rows_total - self.rows_processed, 0)
+
+    def is_stalled(self):
+        return self.state in (ImportJob.PENDING, ImportJob.RUNNING) and self.modified_at < timezone.now() - STALE_JOB_TIMEOUT
+
+    def claim(self):
+        """
+        Mark a pending, failed or stalled job running. Returns False if another
+        worker got to it first, so the same job is never run twice at once.
+        """
+        now = timezone.now()
+        claimable = Q(state__in=(ImportJob.PENDING, ImportJob.FAILED)) | Q(state=ImportJob.RUNNING, modified_at__lt=now - STALE_JOB_TIMEOUT)
+        if not ImportJob.objects.filter(claimable, pk=self.pk).update(state=ImportJob.RUNNING, error='', modified_at=now):
+            return False
+        self.state = ImportJob.RUNNING
+        self.error = ''
+        self.modified_at = now
+        return True
+
+    def __str__(self):
+        return "%s - %s" % (self.pk, self.state)
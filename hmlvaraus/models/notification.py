@@ -0,0 +1,43 @@
+from django.contrib.gis.db import models
+from django.utils.translation import ugettext_lazy as _
+from hmlvaraus.models.hml_reservation import HMLReservation
+from resources.models.base import ModifiableModel
+
+class Notification(ModifiableModel):
+    EMAIL = 'email'
+    SMS = 'sms'
+
+    CHANNEL_CHOICES = (
+        (EMAIL, _('email')),
+        (SMS, _('sms')),
+    )
+
+    RENEWAL = 'renewal'
+    RENEWAL_MONTH = 'renewal_month'
+    RENEWAL_WEEK = 'renewal_week'
+    RENEWAL_DAY = 'renewal_day'
+    END = 'end'
+    KEY = 'key'
+    CONFIRMATION = 'confirmation'
+    CANCEL = 'cancel'
+
+    TYPE_CHOICES = (
+        (RENEWAL, _('renewal')),
+        (RENEWAL_MONTH, _('renewal month before end')),
+        (RENEWAL_WEEK, _('renewal week before end')),
+        (RENEWAL_DAY, _('renewal day before end')),
+        (END, _('end')),
+        (KEY, _('key return')),
+        (CONFIRMATION, _('confirmation')),
+        (CANCEL, _('cancel')),
+    )
+
+    hml_reservation = models.ForeignKey(HMLReservation, verbose_name=_('Reservation'), related_name='notifications', null=True, on_delete=models.SET_NULL)
+    notification_type = models.CharField(verbose_name=_('Notification type'), choices=TYPE_CHOICES, max_length=20)
+    channel = models.CharField(verbose_name=_('Channel'), choices=CHANNEL_CHOICES, max_length=10)
+    recipient = models.CharField(verbose_name=_('Recipient'), max_length=254, blank=True)
+    success = models.BooleanField(default=False)
+    error = models.TextField(verbose_name=_('Error'), blank=True)
+
+    def __str__(self):
+        return "%s - %s - %s" % (self.notification_type, self.channel, self.recipient)
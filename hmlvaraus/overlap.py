@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Overlap checks of berth reservations"""
+
+from psycopg2.extras import DateTimeTZRange
+
+from resources.models.reservation import Reservation
+
+
+def get_overlapping_reservations(berth, begin, end=None, exclude_reservation_id=None):
+    """
+    Confirmed reservations of the berth whose duration overlaps [begin, end).
+    An end of None leaves the range open ended.
+
+    The lookup only touches the reservation table and is answered by the GiST
+    index over (resource, duration) with the && operator.
+
+    :type berth: hmlvaraus.models.berth.Berth
+    :type begin: datetime.datetime
+    :type end: datetime.datetime | None
+    :type exclude_reservation_id: int | None
+    """
+    queryset = Reservation.objects.filter(
+        resource_id=berth.resource_id,
+        state=Reservation.CONFIRMED,
+        duration__overlap=DateTimeTZRange(begin, end, '[)')
+    )
+    if exclude_reservation_id:
+        queryset = queryset.exclude(pk=exclude_reservation_id)
+    return queryset
+
+
+def has_overlapping_reservation(berth, begin, end=None, exclude_reservation_id=None):
+    return get_overlapping_reservations(berth, begin, end, exclude_reservation_id).exists()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Set-based reconciliation of berth reservability"""
+
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from hmlvaraus.models.berth import Berth
+from hmlvaraus.models.hml_reservation import HMLReservation
+from resources.models.reservation import Reservation
+from resources.models.resource import Resource
+
+LOG = logging.getLogger(__name__)
+
+
+def get_active_berth_ids(now):
+    """
+    Subquery of berths that have a confirmed reservation which has not ended yet.
+    """
+    return HMLReservation.objects.filter(
+        berth__isnull=False,
+        reservation__end__gte=now,
+        reservation__state=Reservation.CONFIRMED
+    ).values('berth_id')
+
+
+def get_unreturned_key_berth_ids():
+    """
+    Subquery of dock berths that still have a confirmed reservation with an unreturned key.
+    """
+    return HMLReservation.objects.filter(
+        berth__isnull=False,
+        berth__type=Berth.DOCK,
+        key_returned=False,
+        reservation__state=Reservation.CONFIRMED
+    ).values('berth_id')
+
+
+def reconcile_reservability(now=None):
+    """
+    Bring the reservable flag of every berth in line with its reservations.
+
+    The "should be reservable" sets are computed with subqueries and applied with
+    one bulk UPDATE per direction, so the cost doesn't grow with the number of berths.
+
+    Returns a dict with the number of rows flipped by each step.
+
+    :type now: datetime.datetime
+    :rtype: dict[str, int]
+    """
+    if now is None:
+        now = timezone.now()
+
+    active_berth_ids = get_active_berth_ids(now)
+
+    with transaction.atomic():
+        # Berths without an ongoing reservation are released, except docks whose key hasn't been returned yet
+        freed_berths = Berth.objects.filter(resource__reservable=False, is_deleted=False)\
+            .exclude(type=Berth.GROUND)\
+            .exclude(id__in=get_unreturned_key_berth_ids())\
+            .exclude(id__in=active_berth_ids)
+        made_reservable = Resource.objects.filter(id__in=freed_berths.values('resource_id'))\
+            .update(reservable=True)
+
+        reserved_berths = Berth.objects.filter(id__in=active_berth_ids, resource__reservable=True)
+        made_unreservable = Resource.objects.filter(id__in=reserved_berths.values('resource_id'))\
+            .update(reservable=False)
+
+        disabled = Berth.objects.filter(is_disabled=False, type=Berth.GROUND)\
+            .exclude(id__in=active_berth_ids)\
+            .update(is_disabled=True)
+
+    result = {
+        'made_reservable': made_reservable,
+        'made_unreservable': made_unreservable,
+        'disabled': disabled,
+    }
+    LOG.info('Berth reservability reconciled: %s' % result)
+    return result
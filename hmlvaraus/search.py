@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Staff searches of reservations and berths by the details of their reservers
+
+Every HML reservation keeps the ssn, name, email address and billing street of
+its reserver lowercased in search_text, with the phone number as digits only.
+The column has a trigram index, so the substring matches below are index
+lookups instead of scans over all the reservations ever made.
+"""
+
+import operator
+import re
+from functools import reduce
+
+from django.db.models import Q
+
+from hmlvaraus.models.hml_reservation import HMLReservation, normalize_phone_number, normalize_search_text
+
+PHONE_NUMBER_RE = re.compile(r'^\+?[\d\s()-]*\d[\d\s()-]*$')
+
+
+def get_search_terms(text):
+    """
+    Normalize search input the same way as the search text. Every term is a list
+    of alternatives of which one has to match. Input that looks like a phone
+    number is matched either as it is, such as a partial ssn, or as its digits,
+    whatever the formatting of the phone number.
+
+    :rtype: list[list[str]]
+    """
+    if PHONE_NUMBER_RE.match(text.strip()):
+        raw, digits = normalize_search_text(text), normalize_phone_number(text)
+        return [[raw] if raw == digits else [raw, digits]]
+    return [[term] for term in normalize_search_text(text).split(' ') if term]
+
+
+def search_hml_reservations(text, queryset=None):
+    """
+    HML reservations whose reserver details contain every term of the text.
+    """
+    if queryset is None:
+        queryset = HMLReservation.objects.all()
+    for alternatives in get_search_terms(text):
+        # search_text is lowercase already, so a case sensitive match can use the index
+        queryset = queryset.filter(reduce(operator.or_, [Q(search_text__contains=term) for term in alternatives]))
+    return queryset
+
+
+def search_berth_ids(text):
+    return search_hml_reservations(text).filter(berth__isnull=False).values_list('berth_id', flat=True)
@@ -37,6 +37,13 @@ TWILIO_ACCOUNT_SID = ''
 TWILIO_AUTH_TOKEN = ''
 TWILIO_FROM_NUMBER = ''
 
+# Dotted path to the SMS gateway class, use 'hmlvaraus.sms.FakeGateway' for tests and development
+SMS_GATEWAY = 'hmlvaraus.sms.TwilioGateway'
+
+# Celery rate limits for notification subtasks, e.g. '60/m'. Enforced per worker.
+NOTIFICATION_EMAIL_RATE_LIMIT = '60/m'
+NOTIFICATION_SMS_RATE_LIMIT = '60/m'
+
 f = os.path.join(BASE_DIR, "local_settings.py")
 if os.path.exists(f):
     import sys
@@ -1,53 +1,143 @@
-
 # -*- coding: utf-8 -*-
 """SMS API"""
 
 import logging
+import threading
 
 
-import twilio
-from twilio.rest import TwilioRestClient
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from django.conf import settings
+from django.utils.module_loading import import_string
 from twilio.base.exceptions import TwilioRestException
 from hmlvaraus.models.sms_message import SMSMessage
 
 LOG = logging.getLogger(__name__)
 
+# Twilio statuses of messages that are still on their way and must not be sent again
+PENDING_STATUSES = ('sent', 'queued', 'accepted', 'sending')
+# Twilio error code for an unknown destination handset, resending won't help
+UNREACHABLE_ERROR_CODE = 30003
 
-def send_sms(phone_number, msg, reservation, sms=None):
-  if settings.DEBUG:
+
+class TwilioGateway(object):
+  """
+  Sends messages through Twilio using one pooled HTTPS session per process.
+  """
+
+  def __init__(self):
+    self.client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN,
+                         http_client=TwilioHttpClient(pool_connections=True))
+    self.from_number = settings.TWILIO_FROM_NUMBER
+
+  def send(self, phone_number, body, callback_url=None):
+    """
+    Returns a (sid, status) tuple of the created message.
+    """
+    kwargs = {}
+    if callback_url:
+      kwargs['status_callback'] = callback_url
+    message = self.client.messages.create(body=body, to=phone_number, from_=self.from_number, **kwargs)
+    return message.sid, message.status
+
+  def fetch_statuses(self, since):
+    """
+    Returns a dict of sid -> (status, error_code) for every message sent since the given date.
+    Pages through the message list instead of fetching the messages one by one.
+    """
+    statuses = {}
+    for message in self.client.messages.stream(from_=self.from_number, date_sent_after=since, page_size=1000):
+      statuses[message.sid] = (message.status, message.error_code)
+    return statuses
+
+
+class FakeGateway(object):
+  """
+  In-memory gateway for tests and development. Set SMS_GATEWAY = 'hmlvaraus.sms.FakeGateway'.
+  """
+
+  def __init__(self):
+    self.sent = []
+    self.statuses = {}
+
+  def send(self, phone_number, body, callback_url=None):
+    sid = 'SM%032d' % (len(self.sent) + 1)
+    self.sent.append({'sid': sid, 'to': phone_number, 'body': body})
+    self.statuses[sid] = ('queued', None)
+    return sid, 'queued'
+
+  def fetch_statuses(self, since):
+    return dict(self.statuses)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def _check_twilio_setting(setting_name):
+  return hasattr(settings, setting_name) and bool(getattr(settings, setting_name))
+
+
+def get_gateway_class():
+  return import_string(getattr(settings, 'SMS_GATEWAY', 'hmlvaraus.sms.TwilioGateway'))
+
+
+def get_gateway():
+  """
+  Returns the process-wide gateway instance configured with SMS_GATEWAY,
+  or None if it can't be used.
+  """
+  global _gateway
+  if _gateway is not None:
+    return _gateway
+
+  gateway_class = get_gateway_class()
+  if settings.DEBUG and gateway_class is TwilioGateway:
     LOG.info('In debug mode. Not sending SMS')
-    return
+    return None
+  if gateway_class is TwilioGateway:
+    for s in ['TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TWILIO_FROM_NUMBER']:
+      if not _check_twilio_setting(s):
+        LOG.error('Twilio setting %s missing or not correct. Can not send sms' % s)
+        return None
 
-  def _check_twilio_setting(setting_name):
-    return hasattr(settings, setting_name) and bool(getattr(settings, setting_name))
+  with _gateway_lock:
+    if _gateway is None:
+      _gateway = gateway_class()
+  return _gateway
 
-  for s in ['TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TWILIO_FROM_NUMBER']:
-    if not _check_twilio_setting(s):
-      LOG.error('Twilio setting %s missing or not correct. Can not send sms' % s)
-      return
 
-  LOG.debug('sending sms to %s  ' % (phone_number))
-  client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+def reset_gateway():
+  global _gateway
+  _gateway = None
 
-  callback_url = 'https://varaukset.hameenlinna.fi/api/sms/'
+
+def get_callback_url():
   if settings.DEBUG:
-    callback_url = 'https://varaukset.haltudemo.fi/api/sms/'
-
-  if sms and hasattr(sms, 'twilio_id') and sms.twilio_id:
-    try:
-      twilio_sms = client.messages(sms.twilio_id).fetch()
-      if twilio_sms.status == 'delivered':
-        sms.success = True
-        sms.save()
-        return
-      if twilio_sms.status in ['sent', 'queued', 'accepted'] or twilio_sms.error_code == 30003:
-        return
-
-    except:
-      LOG.exception('Previously saved sms message not found from twilio %s' % repr(phone_number))
-      pass
+    return 'https://varaukset.haltudemo.fi/api/sms/'
+  return 'https://varaukset.hameenlinna.fi/api/sms/'
+
+
+def _deliver(gateway, sms):
+  try:
+    sid, twilio_status = gateway.send(sms.to_phone_number, sms.message_body, get_callback_url())
+  except:
+    LOG.exception('Could not send sms to number %s' % repr(sms.to_phone_number))
+    return None
+
+  sms.twilio_id = sid
+  if twilio_status == 'delivered':
+    sms.success = True
+  sms.save()
+  return sms
+
+
+def send_sms(phone_number, msg, reservation, sms=None):
+  gateway = get_gateway()
+  if gateway is None:
+    return
+
+  LOG.debug('sending sms to %s  ' % (phone_number))
 
   if not sms:
     sms = SMSMessage.objects.create(
@@ -56,21 +146,78 @@ def send_sms(phone_number, msg, reservation, sms=None):
       hml_reservation=reservation
     )
 
-  try:
-    twilio_sms = client.messages.create(
-      body=str(msg),
-      to=str(phone_number),
-      from_=settings.TWILIO_FROM_NUMBER,
-      status_callback=callback_url
-    )
-
-    sms.twilio_id = twilio_sms.sid
-    if twilio_sms.status == 'delivered':
-      sms.success = True
-    sms.save()
+  return _deliver(gateway, sms)
+
+
+def send_sms_batch(messages):
+  """
+  Send many messages over the shared gateway.
+
+  :param messages: list of (phone_number, msg, reservation) tuples or unsaved/saved SMSMessage objects
+  :return: list of the SMSMessage objects that were handed over to the gateway
+  """
+  gateway = get_gateway()
+  if gateway is None:
+    return []
+
+  sms_messages = []
+  new_messages = []
+  for message in messages:
+    if isinstance(message, SMSMessage):
+      sms_messages.append(message)
+    else:
+      phone_number, msg, reservation = message
+      new_messages.append(SMSMessage(message_body=str(msg), to_phone_number=str(phone_number), hml_reservation=reservation))
+  if new_messages:
+    sms_messages.extend(SMSMessage.objects.bulk_create(new_messages))
+
+  sent = []
+  for sms in sms_messages:
+    if _deliver(gateway, sms):
+      sent.append(sms)
+  return sent
+
+
+def reconcile_sms_statuses(sms_messages, since):
+  """
+  Sync the delivery status of previously sent messages with one paged listing
+  of the gateway's messages instead of a fetch per message.
+
+  Delivered messages are marked successful. Returns the messages that should be sent again.
+
+  :type sms_messages: list[SMSMessage]
+  :type since: datetime.datetime
+  :rtype: list[SMSMessage]
+  """
+  gateway = get_gateway()
+  if gateway is None:
+    return []
 
-  except:
-    LOG.exception('Could not send sms to number %s' % repr(phone_number))
-    pass
+  try:
+    statuses = gateway.fetch_statuses(since.date())
+  except TwilioRestException:
+    LOG.exception('Could not fetch sms statuses, resending only unsent messages')
+    statuses = None
+
+  delivered_ids = []
+  resend = []
+  for sms in sms_messages:
+    if not sms.twilio_id:
+      resend.append(sms)
+      continue
+    if statuses is None:
+      continue
+    twilio_status, error_code = statuses.get(sms.twilio_id, (None, None))
+    if twilio_status == 'delivered':
+      delivered_ids.append(sms.pk)
+    elif twilio_status in PENDING_STATUSES or error_code == UNREACHABLE_ERROR_CODE:
+      continue
+    else:
+      if twilio_status is None:
+        LOG.warning('Previously saved sms message not found from twilio %s' % repr(sms.to_phone_number))
+      resend.append(sms)
+
+  SMSMessage.objects.filter(pk__in=delivered_ids).update(success=True)
+  return resend
 
 # vim: tabstop=2 expandtab shiftwidth=2 softtabstop=2
@@ -9,11 +9,13 @@ from django.contrib.auth.models import AnonymousUser
 from django.core.mail import send_mail
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
-from hmlvaraus.sms import send_sms
+from hmlvaraus.sms import get_gateway, send_sms, send_sms_batch, reconcile_sms_statuses
 from django.conf import settings
 from django.db.models import Q
 import hashlib
-import time
+import logging
+
+LOG = logging.getLogger(__name__)
 
 @app.task
 def retry_sms():
@@ -23,34 +25,43 @@ def retry_sms():
     hour_ago = timezone.now() - timedelta(hours=1)
     sms_messages = SMSMessage.objects.filter(hml_reservation__reservation__state=Reservation.CONFIRMED, success=False, created_at__gte=two_days_ago, created_at__lte=hour_ago)
 
-    for sms_message in sms_messages:
-        send_sms(sms_message.to_phone_number, sms_message.message_body, sms_message.hml_reservation, sms_message)
-        time.sleep(1)
+    resend = reconcile_sms_statuses(list(sms_messages), two_days_ago)
+    return len(send_sms_batch(resend))
+
+
+@app.task
+def process_import_job(job_id):
+    from hmlvaraus.importer import run_import_job
+    from hmlvaraus.models.import_job import ImportJob
+    try:
+        job = ImportJob.objects.get(pk=job_id)
+    except ImportJob.DoesNotExist:
+        return
+    if not job.claim():
+        return
+    return run_import_job(job).state
 
 
 @app.task
 def check_reservability():
-    from hmlvaraus.models.hml_reservation import HMLReservation
-    from resources.models.reservation import Reservation
-    from hmlvaraus.models.berth import Berth
-    unavailable_berths = Berth.objects.filter(resource__reservable=False, is_deleted=False).exclude(type__in=[Berth.GROUND])
+    from hmlvaraus.reservability import reconcile_reservability
+    return reconcile_reservability()
 
-    for berth in unavailable_berths:
-        if berth.type == Berth.DOCK and berth.hml_reservations.filter(reservation__state=Reservation.CONFIRMED, key_returned=False).exists():
-            continue
-        if not HMLReservation.objects.filter(berth=berth, reservation__end__gte=timezone.now(), reservation__state=Reservation.CONFIRMED).exists():
-            resource = berth.resource
-            resource.reservable = True
-            resource.save()
 
-    reservations = HMLReservation.objects.filter(reservation__end__gte=timezone.now(), reservation__state=Reservation.CONFIRMED)
-    berths = Berth.objects.filter(hml_reservations__in=reservations, resource__reservable=True)
-    for berth in berths:
-        resource = berth.resource
-        resource.reservable = False
-        resource.save()
+@app.task
+def refresh_opening_hours():
+    from django.core.management import call_command
+    call_command('refresh_opening_hours')
+
 
-    Berth.objects.exclude(hml_reservations__in=reservations).filter(is_disabled=False, type=Berth.GROUND).update(is_disabled=True)
+@app.task
+def generate_resource_image_renditions(image_id):
+    from resources.models import ResourceImage
+    try:
+        image = ResourceImage.objects.get(pk=image_id)
+    except ResourceImage.DoesNotExist:
+        return
+    image.generate_renditions()
 
 @app.task
 def cancel_failed_reservation(purchase_id):
@@ -70,149 +81,204 @@ def cancel_failed_reservation(purchase_id):
 def cancel_failed_reservations():
     from hmlvaraus.models.purchase import Purchase
     from hmlvaraus.models.berth import Berth
+    from hmlvaraus.models.notification import Notification
     three_days_ago = timezone.now() - timedelta(days=3)
-    failed_purchases = Purchase.objects.filter(created_at__lte=three_days_ago, purchase_process_notified__isnull=True, finished__isnull=True, hml_reservation__is_paid=False)
+    failed_purchases = Purchase.objects.filter(created_at__lte=three_days_ago, purchase_process_notified__isnull=True, finished__isnull=True, hml_reservation__is_paid=False).select_related('hml_reservation', 'hml_reservation__reservation', 'hml_reservation__berth')
     user = AnonymousUser()
+    cancelled = []
     for purchase in failed_purchases:
         purchase.hml_reservation.cancel_reservation(user)
         purchase.set_finished()
-        if purchase.hml_reservation.reservation.reserver_email_address:
-            send_cancel_email(purchase.hml_reservation)
-        if purchase.hml_reservation.reservation.reserver_phone_number:
-            send_cancel_sms(purchase.hml_reservation)
-        berth = purchase.hml_reservation.berth
-        if berth.type == Berth.GROUND and not berth.is_disabled:
-            berth.is_disabled = True
-            berth.save()
-        time.sleep(1)
+        cancelled.append(purchase.hml_reservation)
+
+    ground_berth_ids = [reservation.berth_id for reservation in cancelled if reservation.berth and reservation.berth.type == Berth.GROUND]
+    Berth.objects.filter(id__in=ground_berth_ids, is_disabled=False).update(is_disabled=True)
+
+    return dispatch_notifications(cancelled, Notification.CANCEL)
 
 @app.task
 def check_key_returned():
     from hmlvaraus.models.hml_reservation import HMLReservation
     from hmlvaraus.models.berth import Berth
+    from hmlvaraus.models.notification import Notification
     from resources.models.reservation import Reservation
     now_minus_week = timezone.now() - timedelta(weeks=1)
-    reservations = HMLReservation.objects.filter(Q(key_return_notification_sent_at__lte=now_minus_week) | Q(key_return_notification_sent_at=None), berth__type=Berth.DOCK, reservation__end__lte=timezone.now(), key_returned=False, reservation__state=Reservation.CONFIRMED).exclude(child__reservation__state=Reservation.CONFIRMED).distinct()
+    reservations = HMLReservation.objects.filter(Q(key_return_notification_sent_at__lte=now_minus_week) | Q(key_return_notification_sent_at=None), berth__type=Berth.DOCK, reservation__end__lte=timezone.now(), key_returned=False, reservation__state=Reservation.CONFIRMED).exclude(child__reservation__state=Reservation.CONFIRMED).distinct().select_related('reservation')
 
-    for reservation in reservations:
-        sent = False
-        if reservation.reservation.reserver_email_address:
-            sent = True
-            send_key_email(reservation)
-        if reservation.reservation.reserver_phone_number:
-            sent = True
-            send_key_sms(reservation)
-        if sent:
-            reservation.key_return_notification_sent_at = timezone.now()
-            reservation.save()
-            time.sleep(1)
+    due = [reservation for reservation in reservations if has_contact_info(reservation)]
+    return dispatch_notifications(due, Notification.KEY)
 
 
 @app.task
 def check_ended_reservations():
     from hmlvaraus.models.hml_reservation import HMLReservation
     from hmlvaraus.models.berth import Berth
+    from hmlvaraus.models.notification import Notification
     from resources.models.reservation import Reservation
     now_minus_day = timezone.now() - timedelta(hours=24)
-    reservations = HMLReservation.objects.filter(reservation__state=Reservation.CONFIRMED, reservation__end__range=(now_minus_day, timezone.now())).exclude(child__reservation__state=Reservation.CONFIRMED).distinct()
+    reservations = HMLReservation.objects.filter(reservation__state=Reservation.CONFIRMED, reservation__end__range=(now_minus_day, timezone.now())).exclude(child__reservation__state=Reservation.CONFIRMED).distinct().select_related('reservation', 'berth')
+    reservations = list(reservations)
 
-    for reservation in reservations:
-        berth = reservation.berth
-        if berth.type == Berth.GROUND:
-            berth.is_disabled = True
-            berth.save()
-        sent = False
-        if reservation.end_notification_sent_at:
-            continue
-        if reservation.reservation.reserver_email_address:
-            sent = True
-            send_end_email(reservation)
-        if reservation.reservation.reserver_phone_number:
-            sent = True
-            send_end_sms(reservation)
-        if sent:
-            reservation.end_notification_sent_at = timezone.now()
-            reservation.save()
-            time.sleep(1)
+    ground_berth_ids = [reservation.berth_id for reservation in reservations if reservation.berth and reservation.berth.type == Berth.GROUND]
+    Berth.objects.filter(id__in=ground_berth_ids).update(is_disabled=True)
+
+    due = [reservation for reservation in reservations if not reservation.end_notification_sent_at and has_contact_info(reservation)]
+    return dispatch_notifications(due, Notification.END)
 
 #This task is run manually once after initial deployment
 @app.task
 def send_initial_renewal_notification(reservation_id):
     from hmlvaraus.models.hml_reservation import HMLReservation
-    reservation = HMLReservation.objects.get(pk=reservation_id)
+    from hmlvaraus.models.notification import Notification
+    reservation = HMLReservation.objects.select_related('reservation').get(pk=reservation_id)
     if not reservation.renewal_code:
         reservation.set_renewal_code()
-    if reservation.reservation.reserver_email_address:
-        send_renewal_email(reservation)
-    if reservation.reservation.reserver_phone_number:
-        send_renewal_sms(reservation)
+    return dispatch_notifications([reservation], Notification.RENEWAL)
 
 @app.task
 def check_and_handle_reservation_renewals():
     from hmlvaraus.models.hml_reservation import HMLReservation
+    from hmlvaraus.models.notification import Notification
     from resources.models.reservation import Reservation
     now_plus_month = timezone.now() + timedelta(days=30)
     now_plus_week = timezone.now() + timedelta(days=7)
     now_plus_day = timezone.now() + timedelta(days=1)
-    reservations = HMLReservation.objects.filter(reservation__end__lte=now_plus_month, reservation__end__gte=timezone.now(), reservation__state=Reservation.CONFIRMED).exclude(child__reservation__state=Reservation.CONFIRMED).distinct()
+    reservations = HMLReservation.objects.filter(reservation__end__lte=now_plus_month, reservation__end__gte=timezone.now(), reservation__state=Reservation.CONFIRMED).exclude(child__reservation__state=Reservation.CONFIRMED).distinct().select_related('reservation')
 
+    due = {
+        Notification.RENEWAL_DAY: [],
+        Notification.RENEWAL_WEEK: [],
+        Notification.RENEWAL_MONTH: [],
+    }
     for reservation in reservations:
-        sent = False
         if reservation.reservation.end < now_plus_day:
-            if reservation.renewal_notification_day_sent_at:
-                continue
-            if not reservation.renewal_code:
-                reservation.set_renewal_code()
-            if reservation.reservation.reserver_email_address:
-                sent = True
-                send_renewal_email(reservation, 'day')
-            if reservation.reservation.reserver_phone_number:
-                sent = True
-                send_renewal_sms(reservation)
-            if sent:
-                reservation.renewal_notification_day_sent_at = timezone.now()
-                reservation.save()
-                time.sleep(1)
-
+            notification_type = Notification.RENEWAL_DAY
         elif reservation.reservation.end < now_plus_week:
-            if reservation.renewal_notification_week_sent_at:
-                continue
-            if not reservation.renewal_code:
-                reservation.set_renewal_code()
-            if reservation.reservation.reserver_email_address:
-                sent = True
-                send_renewal_email(reservation, 'week')
-            if reservation.reservation.reserver_phone_number:
-                sent = True
-                send_renewal_sms(reservation)
-            if sent:
-                reservation.renewal_notification_week_sent_at = timezone.now()
-                reservation.save()
-                time.sleep(1)
+            notification_type = Notification.RENEWAL_WEEK
         else:
-            if reservation.renewal_notification_month_sent_at:
-                continue
-            if not reservation.renewal_code:
-                reservation.set_renewal_code()
-            if reservation.reservation.reserver_email_address:
-                sent = True
-                send_renewal_email(reservation, 'month')
-            if reservation.reservation.reserver_phone_number:
-                sent = True
-                send_renewal_sms(reservation)
-            if sent:
-                reservation.renewal_notification_month_sent_at = timezone.now()
-                reservation.save()
-                time.sleep(1)
+            notification_type = Notification.RENEWAL_MONTH
+
+        if getattr(reservation, RENEWAL_SENT_AT_FIELDS[notification_type]):
+            continue
+        if not reservation.renewal_code:
+            reservation.set_renewal_code()
+        if has_contact_info(reservation):
+            due[notification_type].append(reservation)
+
+    dispatched = 0
+    for notification_type, due_reservations in due.items():
+        dispatched += dispatch_notifications(due_reservations, notification_type)
+    return dispatched
 
 @app.task
 def send_confirmation(reservation_id):
     from hmlvaraus.models.hml_reservation import HMLReservation
-    reservation = HMLReservation.objects.get(pk=reservation_id)
-    if reservation.reservation.reserver_email_address:
-        send_confirmation_email(reservation)
-    if reservation.reservation.reserver_phone_number:
-        send_confirmation_sms(reservation)
+    from hmlvaraus.models.notification import Notification
+    reservation = HMLReservation.objects.select_related('reservation').get(pk=reservation_id)
+    return dispatch_notifications([reservation], Notification.CONFIRMATION)
+
+
+# Notifications are sent one recipient and channel per subtask. The rate limits are token buckets
+# enforced by each Celery worker, so they replace sleeping between sends in the periodic tasks.
+@app.task(rate_limit=getattr(settings, 'NOTIFICATION_EMAIL_RATE_LIMIT', None))
+def send_notification_email(hml_reservation_id, notification_type):
+    from hmlvaraus.models.notification import Notification
+    return deliver_notification(hml_reservation_id, notification_type, Notification.EMAIL)
+
+@app.task(rate_limit=getattr(settings, 'NOTIFICATION_SMS_RATE_LIMIT', None))
+def send_notification_sms(hml_reservation_id, notification_type):
+    from hmlvaraus.models.notification import Notification
+    return deliver_notification(hml_reservation_id, notification_type, Notification.SMS)
+
+
+RENEWAL_SENT_AT_FIELDS = {
+    'renewal_month': 'renewal_notification_month_sent_at',
+    'renewal_week': 'renewal_notification_week_sent_at',
+    'renewal_day': 'renewal_notification_day_sent_at',
+}
+
+# HMLReservation fields set when a notification of the type has been delivered, so it's not sent again
+SENT_AT_FIELDS = dict(RENEWAL_SENT_AT_FIELDS, end='end_notification_sent_at', key='key_return_notification_sent_at')
+
+
+def has_contact_info(reservation):
+    return bool(reservation.reservation.reserver_email_address or reservation.reservation.reserver_phone_number)
+
+
+def dispatch_notifications(reservations, notification_type):
+    """
+    Queue an email and an SMS subtask for every reservation that has the contact info for it.
+    Returns the number of queued subtasks.
+    """
+    dispatched = 0
+    for reservation in reservations:
+        if reservation.reservation.reserver_email_address:
+            send_notification_email.delay(reservation.pk, notification_type)
+            dispatched += 1
+        if reservation.reservation.reserver_phone_number:
+            send_notification_sms.delay(reservation.pk, notification_type)
+            dispatched += 1
+    return dispatched
+
+
+def deliver_notification(hml_reservation_id, notification_type, channel):
+    """
+    Send one notification and record its outcome as a Notification row. A delivered
+    notification is also marked sent on the reservation.
+    """
+    from hmlvaraus.models.hml_reservation import HMLReservation
+    from hmlvaraus.models.notification import Notification
+    try:
+        reservation = HMLReservation.objects.select_related('reservation', 'berth', 'berth__resource', 'berth__resource__unit').get(pk=hml_reservation_id)
+    except ObjectDoesNotExist:
+        LOG.warning('Reservation %s not found, not sending %s notification' % (hml_reservation_id, notification_type))
+        return False
+
+    if channel == Notification.EMAIL:
+        recipient = reservation.reservation.reserver_email_address
+    else:
+        recipient = reservation.reservation.reserver_phone_number
+
+    notification = Notification(hml_reservation=reservation, notification_type=notification_type, channel=channel, recipient=recipient)
+    try:
+        notification.success = bool(get_notification_sender(notification_type, channel)(reservation))
+        if not notification.success:
+            notification.error = get_delivery_failure_reason(channel)
+    except Exception as e:
+        LOG.exception('Could not send %s %s notification to %s' % (notification_type, channel, repr(recipient)))
+        notification.error = str(e)
+    notification.save()
+
+    if notification.success and notification_type in SENT_AT_FIELDS:
+        HMLReservation.objects.filter(pk=reservation.pk).update(**{SENT_AT_FIELDS[notification_type]: timezone.now()})
+    return notification.success
+
+
+def get_delivery_failure_reason(channel):
+    """
+    Reason for a send that failed without an exception. The SMS gateway errors are logged by hmlvaraus.sms.
+    """
+    from hmlvaraus.models.notification import Notification
+    if channel == Notification.EMAIL:
+        return 'No email was sent'
+    if get_gateway() is None:
+        return 'SMS gateway is not configured'
+    return 'SMS gateway did not accept the message'
+
+
+def get_notification_sender(notification_type, channel):
+    senders = {
+        'renewal': (send_renewal_email, send_renewal_sms),
+        'renewal_month': (lambda reservation: send_renewal_email(reservation, 'month'), send_renewal_sms),
+        'renewal_week': (lambda reservation: send_renewal_email(reservation, 'week'), send_renewal_sms),
+        'renewal_day': (lambda reservation: send_renewal_email(reservation, 'day'), send_renewal_sms),
+        'end': (send_end_email, send_end_sms),
+        'key': (send_key_email, send_key_sms),
+        'confirmation': (send_confirmation_email, send_confirmation_sms),
+        'cancel': (send_cancel_email, send_cancel_sms),
+    }
+    email_sender, sms_sender = senders[notification_type]
+    return email_sender if channel == 'email' else sms_sender
 
 
 def send_renewal_email(reservation, notification_type=None):
@@ -259,7 +325,7 @@ Linkki on käytettävissä n. 20min päästä uudelleen, mikäli venepaikan uusi
     Mikäli et uusi varaustasi ennen sen päättymistä, venepaikka vapautuu järjestelmään avoimesti varattavaksi.</p>
     <p>Uusi venepaikkavarauksesi <a href="{2}">tästä</a>.</p> <p>Linkki on käytettävissä n. 20min päästä uudelleen, mikäli venepaikan uusinta epäonnistuu (ei mene kokonaisuudessaan läpi).</p>'''.format(full_name, end_date_finnish, renewal_link)
 
-    send_mail(
+    return send_mail(
         topic,
         body_plain,
         settings.EMAIL_FROM,
@@ -281,7 +347,7 @@ def send_renewal_sms(reservation):
     if phone_number[0] == '0':
         phone_number = '+358' + phone_number[1:]
     body_plain = 'Hei, venepaikkavarauksesi päättyy {0}. Uusi se palvelupisteessä tai: {1}'.format(end_date_finnish, renewal_link)
-    send_sms(phone_number, body_plain, reservation)
+    return send_sms(phone_number, body_plain, reservation)
 
 
 def send_end_email(reservation):
@@ -305,7 +371,7 @@ Poletit mitätöityvät automaattisesti eikä niitä tarvitse palauttaa.'''.form
     Poletit mitätöityvät automaattisesti eikä niitä tarvitse palauttaa.</p>'''.format(full_name, end_date_finnish)
 
 
-    send_mail(
+    return send_mail(
         topic,
         body_plain,
         settings.EMAIL_FROM,
@@ -327,7 +393,7 @@ def send_end_sms(reservation):
         body_plain += ' Muista palauttaa venepaikan avain.'
 
     body_plain += ' Terveisin Hämeenlinnan kaupunki.'
-    send_sms(phone_number, body_plain, reservation)
+    return send_sms(phone_number, body_plain, reservation)
 
 
 def send_key_email(reservation):
@@ -352,7 +418,7 @@ Palauttamattomasta avaimesta peritään hinnaston mukainen maksu.'''.format(full
     Venelaiturin avain tulee palauttaa viikon kuluessa varauksen päättymisestä. 
     Palauttamattomasta avaimesta peritään hinnaston mukainen maksu.</p>'''.format(full_name, end_date_finnish)
 
-    send_mail(
+    return send_mail(
         topic,
         body_plain,
         settings.EMAIL_FROM,
@@ -370,7 +436,7 @@ def send_key_sms(reservation):
     if phone_number[0] == '0':
         phone_number = '+358' + phone_number[1:]
     body_plain = 'Hei, venepaikkavarauksesi on päättynyt {0}. Palauta avain viikon kuluessa tai perimme hinnaston mukaisen maksun. Terveisin Hämeenlinnan kaupunki.'.format(end_date_finnish)
-    send_sms(phone_number, body_plain, reservation)
+    return send_sms(phone_number, body_plain, reservation)
 
 
 def send_confirmation_email(reservation):
@@ -408,7 +474,7 @@ Lisää venerantojen sekä laituripaikkojen käytöstä osoitteessa www.hameenli
     Hakiessasi avainta tai polettia varauduthan todistamaan henkilöllisyytesi. 
     Lisää venerantojen sekä laituripaikkojen käytöstä osoitteessa www.hameenlinna.fi/venepaikat</p>'''.format(full_name, begin_date_finnish, end_date_finnish, berth_name)
 
-    send_mail(
+    return send_mail(
         topic,
         body_plain,
         settings.EMAIL_FROM,
@@ -429,7 +495,7 @@ def send_confirmation_sms(reservation):
     if phone_number[0] == '0':
         phone_number = '+358' + phone_number[1:]
     body_plain = 'Varauksesi on vahvistettu aikavälille {0} - {1}. Venepaikka: {2}. Laituripaikkojen avaimet ja maallevetoalueiden poletit noudetaan palvelupiste Kastellista. Terveisin Hämeenlinnan kaupunki.'.format(begin_date_finnish, end_date_finnish, berth_name)
-    send_sms(phone_number, body_plain, reservation)
+    return send_sms(phone_number, body_plain, reservation)
 
 
 def send_cancel_email(reservation):
@@ -466,7 +532,7 @@ Palvelupisteiden yhteystiedot löydät osoitteesta http://www.hameenlinna.fi/Asi
     Jos venepaikan varaaminen ei onnistu järjestelmän kautta, voit tehdä varauksen sellaisessa palvelupisteessä, josta löytyy kassapalvelut. 
     Palvelupisteiden yhteystiedot löydät osoitteesta http://www.hameenlinna.fi/Asiointi/Palvelupisteet/.</p>'''.format(full_name, begin_date_finnish, end_date_finnish, berth_name)
 
-    send_mail(
+    return send_mail(
         topic,
         body_plain,
         settings.EMAIL_FROM,
@@ -487,4 +553,4 @@ def send_cancel_sms(reservation):
     if phone_number[0] == '0':
         phone_number = '+358' + phone_number[1:]
     body_plain = 'Hei, venepaikkavarauksesi epäonnistui. Yritit varausta aikavälille {0} - {1}, venepaikkaan {2}. Ota yhteys palvelupisteeseen. Terveisin Hämeenlinnan kaupunki.'.format(begin_date_finnish, end_date_finnish, berth_name)
-    send_sms(phone_number, body_plain, reservation)
+    return send_sms(phone_number, body_plain, reservation)
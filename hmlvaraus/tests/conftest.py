@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from resources.tests.conftest import *
+from hmlvaraus import sms
+from hmlvaraus.models.berth import Berth
+from hmlvaraus.tests.utils import create_hml_reservation
+
+
+@pytest.fixture
+def berth(resource_in_unit):
+    return Berth.objects.create(resource=resource_in_unit, width_cm=300, depth_cm=100, length_cm=800)
+
+
+@pytest.fixture
+def hml_reservation(berth, user):
+    return create_hml_reservation(
+        berth, user,
+        reserver_ssn='010170-123A',
+        reserver_name='Matti  Meikäläinen',
+        reserver_email_address='Matti.Meikalainen@Example.com',
+        reserver_phone_number='+358 (40) 123-4567',
+        billing_address_street=' Satamakatu 5 ',
+    )
+
+
+@pytest.fixture
+def fake_gateway(settings):
+    settings.SMS_GATEWAY = 'hmlvaraus.sms.FakeGateway'
+    sms.reset_gateway()
+    yield sms.get_gateway()
+    sms.reset_gateway()
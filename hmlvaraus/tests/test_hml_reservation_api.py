@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from hmlvaraus.models.berth import Berth
+from hmlvaraus.models.purchase import Purchase
+from hmlvaraus.tests.utils import create_hml_reservation
+
+list_url = '/api/hml_reservation/'
+
+
+def create_berth_reservations(resource, user):
+    berth = Berth.objects.create(resource=resource)
+    hml_reservation = create_hml_reservation(berth, user, reserver_name='Reserver of %s' % resource.name)
+    create_hml_reservation(
+        berth, user, begin='2018-04-01T00:00:00+03:00', end='2018-10-31T00:00:00+02:00', parent=hml_reservation)
+    # bulk_create skips the post_save receiver that schedules cancelling unpaid purchases
+    Purchase.objects.bulk_create([Purchase(hml_reservation=hml_reservation, purchase_code=str(hml_reservation.pk))])
+
+
+@pytest.mark.django_db
+@pytest.mark.urls('hmlvaraus.urls')
+def test_hml_reservation_list_query_count(staff_api_client, staff_user, resource_in_unit, resource_in_unit2,
+                                          resource_in_unit3):
+    create_berth_reservations(resource_in_unit, staff_user)
+
+    with CaptureQueriesContext(connection) as one_berth:
+        response = staff_api_client.get(list_url)
+    assert response.status_code == 200
+    assert response.data['count'] == 2
+
+    create_berth_reservations(resource_in_unit2, staff_user)
+    create_berth_reservations(resource_in_unit3, staff_user)
+    with CaptureQueriesContext(connection) as three_berths:
+        response = staff_api_client.get(list_url)
+    assert response.status_code == 200
+    assert response.data['count'] == 6
+
+    assert len(three_berths) == len(one_berth)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from resources.models import Resource, ResourceType, Unit
+from resources.models.typeahead import search_typeahead
+from hmlvaraus import tasks
+from hmlvaraus.importer import UnitImporter, run_import, run_import_job
+from hmlvaraus.models.berth import Berth
+from hmlvaraus.models.import_job import STALE_JOB_TIMEOUT, ImportJob
+from hmlvaraus.models.hml_reservation import HMLReservation
+from hmlvaraus.search import search_hml_reservations
+
+RESERVATION_HEADER = '3;Reservations\nresource;unit;begin;end;description;cancelled;paid;name;email;phone;street;city;zip\n'
+
+
+def make_file(header, rows):
+    return io.BytesIO((header + ''.join(';'.join(row) + '\n' for row in rows)).encode('utf-8'))
+
+
+def reservation_row(name, email='', phone=''):
+    return ['resource in unit', 'unit', '2017-04-01', '2017-10-31', 'Pier 1', '', '', name, email, phone, 'Satamakatu 5', 'Helsinki', '00100']
+
+
+@pytest.mark.django_db
+def test_imported_reservations_are_searchable(berth):
+    # reservations are matched to berths by unit, resource name and description
+    berth.resource.description = 'Pier 1'
+    berth.resource.save()
+    uploaded_file = make_file(RESERVATION_HEADER, [reservation_row('Matti Meikäläinen', 'Matti@Example.com', '040 123 4567')])
+
+    result = run_import(uploaded_file)
+
+    assert result['created'] == 1
+    hml_reservation = HMLReservation.objects.get()
+    assert hml_reservation.search_text == hml_reservation.get_search_text()
+    assert list(search_hml_reservations('meikäläinen matti')) == [hml_reservation]
+    assert list(search_hml_reservations('0401234567')) == [hml_reservation]
+    assert list(search_hml_reservations('matti@example.com')) == [hml_reservation]
+
+
+UNIT_HEADER = '1;Units\nname;street;zip;email;phone;location;description\n'
+
+
+@pytest.mark.django_db
+def test_import_job_resumes_after_failure(monkeypatch, settings, tmpdir, staff_user):
+    settings.MEDIA_ROOT = str(tmpdir)
+    rows = [['Unit %d' % i, 'Satamakatu %d' % i, '00100', '', '', '', ''] for i in range(1, 6)]
+    job = ImportJob.objects.create(file=ContentFile(make_file(UNIT_HEADER, rows).getvalue(), name='units.csv'), created_by=staff_user)
+
+    create_objects = UnitImporter.create_objects
+
+    def create_objects_failing_at_unit_3(self, units):
+        if any(unit.name == 'Unit 3' for unit in units):
+            raise RuntimeError('Connection lost')
+        create_objects(self, units)
+
+    monkeypatch.setattr(UnitImporter, 'create_objects', create_objects_failing_at_unit_3)
+    run_import_job(job, batch_size=2)
+
+    job = ImportJob.objects.get(pk=job.pk)
+    assert job.state == ImportJob.FAILED
+    assert job.error == 'Connection lost'
+    assert (job.rows_total, job.rows_processed, job.rows_created) == (5, 2, 2)
+    # the type and header rows are on lines 1 and 2
+    assert job.last_line == 4
+    assert job.claim()
+
+    monkeypatch.undo()
+    run_import_job(job, batch_size=2)
+
+    job = ImportJob.objects.get(pk=job.pk)
+    assert job.state == ImportJob.FINISHED
+    assert (job.rows_processed, job.rows_created, job.rows_failed) == (5, 5, 0)
+    assert job.last_line == 7
+    assert sorted(Unit.objects.values_list('name', flat=True)) == ['Unit %d' % i for i in range(1, 6)]
+    assert not job.claim()
+
+
+@pytest.mark.django_db
+def test_import_job_stores_limited_errors(monkeypatch, settings, tmpdir, staff_user):
+    settings.MEDIA_ROOT = str(tmpdir)
+    monkeypatch.setattr('hmlvaraus.importer.MAX_JOB_ERRORS', 3)
+    rows = [['Unit %d' % i] for i in range(1, 6)]
+    job = ImportJob.objects.create(file=ContentFile(make_file(UNIT_HEADER, rows).getvalue(), name='units.csv'), created_by=staff_user)
+
+    run_import_job(job, batch_size=2)
+
+    job = ImportJob.objects.get(pk=job.pk)
+    assert job.rows_failed == 5
+    assert [error['row'] for error in json.loads(job.errors)] == [3, 4, 5]
+
+
+@pytest.mark.django_db
+@pytest.mark.urls('hmlvaraus.urls')
+def test_importer_requires_file(staff_api_client):
+    response = staff_api_client.post('/api/importer/', {'background': 'true'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.urls('hmlvaraus.urls')
+def test_import_job_is_queued_after_commit(monkeypatch, settings, tmpdir, staff_api_client, staff_user):
+    settings.MEDIA_ROOT = str(tmpdir)
+    queued = []
+
+    def queue(job_id):
+        # the worker must be able to load the job
+        assert ImportJob.objects.filter(pk=job_id).exists()
+        queued.append(job_id)
+
+    monkeypatch.setattr(tasks.process_import_job, 'delay', queue)
+    uploaded_file = ContentFile(make_file(UNIT_HEADER, []).getvalue(), name='units.csv')
+
+    response = staff_api_client.post('/api/importer/', {'file': uploaded_file, 'background': 'true'}, format='multipart')
+    assert response.status_code == 202
+    job = ImportJob.objects.get()
+    assert queued == [job.pk]
+
+    # a pending job is queued again only when its task seems to have been lost
+    url = '/api/importer/%d/' % job.pk
+    assert staff_api_client.post(url).status_code == 409
+    ImportJob.objects.filter(pk=job.pk).update(modified_at=timezone.now() - STALE_JOB_TIMEOUT - timedelta(minutes=1))
+    assert staff_api_client.post(url).status_code == 202
+    assert queued == [job.pk, job.pk]
+
+
+BERTH_HEADER = '2;Berths\nunit;name;description;disabled;price;length;width;depth;type\n'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('batch_size', [1, 500])
+def test_duplicate_berth_rows_create_one_berth(test_unit, batch_size):
+    ResourceType.objects.create(id='boat', name='Veneet', main_type='space')
+    row = ['unit', 'Laituri 12', 'Pier 1', '', '100', '800', '300', '100', 'laituri']
+    changed_row = row[:4] + ['200'] + row[5:]
+
+    result = run_import(make_file(BERTH_HEADER, [row, row, changed_row]), batch_size=batch_size)
+
+    assert result['created'] == 1
+    assert [error['row'] for error in result['errors']] == [5]
+    berth = Berth.objects.get()
+    assert (berth.resource.name, berth.price) == ('Laituri 12', 100)
+
+
+@pytest.mark.django_db
+def test_imported_berths_are_searchable(api_client, test_unit):
+    ResourceType.objects.create(id='boat', name='Veneet', main_type='space')
+    uploaded_file = make_file(BERTH_HEADER, [['unit', 'Laituri 12', 'Pier 1', '', '100', '800', '300', '100', 'laituri']])
+
+    result = run_import(uploaded_file)
+
+    assert result['created'] == 1
+    resource = Resource.objects.get(berth__isnull=False)
+    response = api_client.get(reverse('resource-list'), {'search': 'laituri', 'search_mode': 'fulltext'})
+    assert [item['id'] for item in response.data['results']] == [resource.id]
+
+
+@pytest.mark.django_db
+def test_imported_units_are_suggested():
+    assert list(search_typeahead('unit', ['satama'])) == []
+
+    run_import(make_file(UNIT_HEADER, [['Satamatoimisto', 'Satamakatu 1', '00100', '', '', '', '']]))
+
+    assert list(search_typeahead('unit', ['satama'])) == [Unit.objects.get(name='Satamatoimisto').pk]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.utils import timezone
+
+from hmlvaraus.leases import (
+    LEASE_DURATION, LEASE_LISTING_DURATION, acquire_lease, check_lease_code, get_leased_berth_ids
+)
+from hmlvaraus.models.berth_lease import BerthLease
+
+
+def expire_lease(berth, age):
+    BerthLease.objects.filter(berth=berth).update(acquired_at=timezone.now() - age)
+
+
+@pytest.mark.django_db
+def test_acquire_lease(berth, user, user2):
+    code = acquire_lease(berth, user)
+    assert code
+    assert check_lease_code(berth, code)
+    assert not check_lease_code(berth, '')
+
+    # The lease row exists now, so the second request falls through to the INSERT and loses
+    assert acquire_lease(berth, user2) is None
+    assert acquire_lease(berth) is None
+    assert check_lease_code(berth, code)
+
+    expire_lease(berth, LEASE_DURATION)
+    new_code = acquire_lease(berth, user2)
+    assert new_code and new_code != code
+    assert check_lease_code(berth, new_code)
+    assert not check_lease_code(berth, code)
+
+
+@pytest.mark.django_db
+def test_staff_member_keeps_lease(berth, staff_user, user):
+    code = acquire_lease(berth, staff_user)
+    assert code
+    assert acquire_lease(berth, user) is None
+
+    new_code = acquire_lease(berth, staff_user)
+    assert new_code
+    assert check_lease_code(berth, new_code)
+    assert BerthLease.objects.get(berth=berth).holder == staff_user
+
+
+@pytest.mark.django_db
+def test_get_leased_berth_ids(berth, user):
+    assert not get_leased_berth_ids().filter(berth=berth).exists()
+
+    acquire_lease(berth, user)
+    assert list(get_leased_berth_ids()) == [{'berth_id': berth.pk}]
+
+    # An expired lease still hides the berth until the listing duration has passed
+    expire_lease(berth, LEASE_DURATION)
+    assert get_leased_berth_ids().filter(berth=berth).exists()
+    assert not get_leased_berth_ids(now=timezone.now() + LEASE_LISTING_DURATION).filter(berth=berth).exists()
+
+    expire_lease(berth, LEASE_LISTING_DURATION)
+    assert not get_leased_berth_ids().filter(berth=berth).exists()
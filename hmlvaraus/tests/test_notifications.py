@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.core import mail
+
+from hmlvaraus import sms, tasks
+from hmlvaraus.models.hml_reservation import HMLReservation
+from hmlvaraus.models.notification import Notification
+from hmlvaraus.tests.utils import create_hml_reservation
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    queued = []
+    monkeypatch.setattr(tasks.send_notification_email, 'delay', lambda *args: queued.append(('email',) + args))
+    monkeypatch.setattr(tasks.send_notification_sms, 'delay', lambda *args: queued.append(('sms',) + args))
+    return queued
+
+
+@pytest.mark.django_db
+def test_dispatch_notifications(queued, berth, user, hml_reservation):
+    email_only = create_hml_reservation(berth, user, begin='2018-04-01T00:00:00+03:00', end='2018-10-31T00:00:00+02:00',
+                                        reserver_email_address='teppo@example.com')
+    no_contact_info = create_hml_reservation(berth, user, begin='2019-04-01T00:00:00+03:00', end='2019-10-31T00:00:00+02:00')
+
+    assert tasks.dispatch_notifications([hml_reservation, email_only, no_contact_info], Notification.END) == 3
+    assert queued == [
+        ('email', hml_reservation.pk, Notification.END),
+        ('sms', hml_reservation.pk, Notification.END),
+        ('email', email_only.pk, Notification.END),
+    ]
+    # reservations are marked sent only once the notifications are delivered
+    assert not HMLReservation.objects.filter(end_notification_sent_at__isnull=False).exists()
+
+
+@pytest.mark.django_db
+def test_deliver_notification(settings, fake_gateway, hml_reservation):
+    settings.EMAIL_FROM = 'varaukset@example.com'
+
+    assert tasks.deliver_notification(hml_reservation.pk, Notification.END, Notification.EMAIL)
+    assert tasks.deliver_notification(hml_reservation.pk, Notification.END, Notification.SMS)
+
+    assert [message.to for message in mail.outbox] == [['Matti.Meikalainen@Example.com']]
+    assert [message['to'] for message in fake_gateway.sent] == ['+358 (40) 123-4567']
+    notifications = Notification.objects.order_by('channel')
+    assert [(n.channel, n.success, n.error) for n in notifications] == [('email', True, ''), ('sms', True, '')]
+    assert HMLReservation.objects.get(pk=hml_reservation.pk).end_notification_sent_at is not None
+
+
+@pytest.mark.django_db
+def test_deliver_notification_without_sms_gateway(settings, hml_reservation):
+    settings.DEBUG = True
+    settings.SMS_GATEWAY = 'hmlvaraus.sms.TwilioGateway'
+    sms.reset_gateway()
+
+    assert not tasks.deliver_notification(hml_reservation.pk, Notification.END, Notification.SMS)
+
+    notification = Notification.objects.get()
+    assert (notification.success, notification.error) == (False, 'SMS gateway is not configured')
+    assert HMLReservation.objects.get(pk=hml_reservation.pk).end_notification_sent_at is None
+
+
+@pytest.mark.django_db
+def test_deliver_notification_with_failing_sms_gateway(monkeypatch, fake_gateway, hml_reservation):
+    def send(*args, **kwargs):
+        raise RuntimeError('Service unavailable')
+    monkeypatch.setattr(fake_gateway, 'send', send)
+
+    assert not tasks.deliver_notification(hml_reservation.pk, Notification.KEY, Notification.SMS)
+
+    notification = Notification.objects.get()
+    assert (notification.success, notification.error) == (False, 'SMS gateway did not accept the message')
+    assert HMLReservation.objects.get(pk=hml_reservation.pk).key_return_notification_sent_at is None
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.utils.dateparse import parse_datetime
+
+from hmlvaraus.overlap import get_overlapping_reservations, has_overlapping_reservation
+from resources.models import Reservation
+
+# The hml_reservation fixture lasts for [2017-04-01, 2017-10-31)
+BEGIN = parse_datetime('2017-04-01T00:00:00+03:00')
+END = parse_datetime('2017-10-31T00:00:00+02:00')
+LATER = parse_datetime('2018-04-01T00:00:00+03:00')
+
+
+@pytest.mark.django_db
+def test_get_overlapping_reservations(berth, hml_reservation):
+    reservation = hml_reservation.reservation
+    assert list(get_overlapping_reservations(berth, parse_datetime('2017-10-30T00:00:00+02:00'), LATER)) == [reservation]
+    assert list(get_overlapping_reservations(berth, parse_datetime('2017-03-01T00:00:00+02:00'), BEGIN)) == []
+    assert list(get_overlapping_reservations(berth, END, LATER)) == []
+
+
+@pytest.mark.django_db
+def test_has_overlapping_reservation(berth, hml_reservation):
+    assert has_overlapping_reservation(berth, BEGIN, END)
+    assert has_overlapping_reservation(berth, parse_datetime('2017-10-30T23:59:59+02:00'))
+    assert not has_overlapping_reservation(berth, END)
+    assert not has_overlapping_reservation(berth, BEGIN, END, exclude_reservation_id=hml_reservation.reservation_id)
+
+    Reservation.objects.filter(pk=hml_reservation.reservation_id).update(state=Reservation.CANCELLED)
+    assert not has_overlapping_reservation(berth, BEGIN, END)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import pytest
+from django.utils.dateparse import parse_datetime
+
+from hmlvaraus.models.berth import Berth
+from hmlvaraus.models.hml_reservation import HMLReservation
+from hmlvaraus.reservability import reconcile_reservability
+from hmlvaraus.tests.utils import create_hml_reservation
+from resources.models import Resource
+
+DURING_SEASON = parse_datetime('2017-06-01T12:00:00+03:00')
+AFTER_SEASON = parse_datetime('2017-11-15T12:00:00+02:00')
+
+
+@pytest.mark.django_db
+def test_reconcile_reservability(berth, resource_in_unit2, user):
+    reserved_berth = Berth.objects.create(resource=resource_in_unit2)
+    hml_reservation = create_hml_reservation(reserved_berth, user)
+    Resource.objects.filter(pk=berth.resource_id).update(reservable=False)
+
+    result = reconcile_reservability(now=DURING_SEASON)
+    assert result == {'made_reservable': 1, 'made_unreservable': 1, 'disabled': 0}
+    assert Resource.objects.get(pk=berth.resource_id).reservable
+    assert not Resource.objects.get(pk=reserved_berth.resource_id).reservable
+
+    # The reservation has ended but the dock key is still out
+    assert reconcile_reservability(now=AFTER_SEASON)['made_reservable'] == 0
+    assert not Resource.objects.get(pk=reserved_berth.resource_id).reservable
+
+    HMLReservation.objects.filter(pk=hml_reservation.pk).update(key_returned=True)
+    assert reconcile_reservability(now=AFTER_SEASON)['made_reservable'] == 1
+    assert Resource.objects.get(pk=reserved_berth.resource_id).reservable
+
+
+@pytest.mark.django_db
+def test_reconcile_reservability_disables_free_ground_berths(berth, resource_in_unit2, user):
+    reserved_berth = Berth.objects.create(resource=resource_in_unit2, type=Berth.GROUND)
+    create_hml_reservation(reserved_berth, user)
+    Berth.objects.filter(pk=berth.pk).update(type=Berth.GROUND)
+
+    assert reconcile_reservability(now=DURING_SEASON)['disabled'] == 1
+    assert Berth.objects.get(pk=berth.pk).is_disabled
+    assert not Berth.objects.get(pk=reserved_berth.pk).is_disabled
+
+    assert reconcile_reservability(now=AFTER_SEASON)['disabled'] == 1
+    assert Berth.objects.get(pk=reserved_berth.pk).is_disabled
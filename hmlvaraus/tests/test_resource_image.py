@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from hmlvaraus import tasks
+from resources.tests.utils import create_resource_image
+
+
+@pytest.mark.django_db(transaction=True)
+def test_renditions_are_queued_when_the_image_changes(monkeypatch, settings, tmpdir, space_resource):
+    settings.MEDIA_ROOT = str(tmpdir)
+    queued = []
+    monkeypatch.setattr(tasks.generate_resource_image_renditions, 'delay', queued.append)
+
+    image = create_resource_image(space_resource)
+    assert queued == [image.pk]
+
+    image.caption = 'new caption'
+    image.save()
+    assert queued == [image.pk]
+
+    image.cropping = '0,0,16,16'
+    image.save()
+    assert queued == [image.pk, image.pk]
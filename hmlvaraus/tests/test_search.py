@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from hmlvaraus.models.hml_reservation import HMLReservation
+from hmlvaraus.search import get_search_terms, search_berth_ids, search_hml_reservations
+
+
+def get_ids(text):
+    return list(search_hml_reservations(text).values_list('id', flat=True))
+
+
+@pytest.mark.django_db
+def test_search_text_is_normalized(hml_reservation):
+    assert hml_reservation.search_text == '\n'.join([
+        '010170-123a',
+        'matti meikäläinen',
+        'matti.meikalainen@example.com',
+        'satamakatu 5',
+        '358401234567',
+    ])
+
+
+@pytest.mark.parametrize('text, terms', [
+    ('010170-123A', [['010170-123a']]),
+    ('  Matti   MEIKÄLÄINEN ', [['matti'], ['meikäläinen']]),
+    ('+358 (40) 123-4567', [['+358 (40) 123-4567', '358401234567']]),
+    ('040 123 4567', [['040 123 4567', '0401234567']]),
+    ('010170-123', [['010170-123', '010170123']]),
+    ('1234567', [['1234567']]),
+])
+def test_get_search_terms(text, terms):
+    assert get_search_terms(text) == terms
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('text', [
+    '010170-123a',
+    '010170-123A',
+    '010170-123',
+    'MEIKÄLÄINEN matti',
+    'matti.meikalainen@EXAMPLE.COM',
+    'satamakatu 5',
+    'Satamakatu',
+    '358 40 123 4567',
+    '1234567',
+])
+def test_search_reservations_by_reserver(hml_reservation, text):
+    assert get_ids(text) == [hml_reservation.id]
+    assert list(search_berth_ids(text)) == [hml_reservation.berth_id]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('text', [
+    'teppo',
+    'satamakatu 6',
+    '0401234567',
+])
+def test_search_reservations_no_match(hml_reservation, text):
+    assert get_ids(text) == []
+
+
+@pytest.mark.django_db
+def test_search_text_follows_reservation_changes(hml_reservation):
+    reservation = hml_reservation.reservation
+    reservation.reserver_name = 'Teppo Testaaja'
+    reservation.reserver_phone_number = '050-765 4321'
+    reservation.save(update_fields=['reserver_name', 'reserver_phone_number'])
+
+    hml_reservation = HMLReservation.objects.get(id=hml_reservation.id)
+    assert hml_reservation.search_text == hml_reservation.get_search_text()
+    assert get_ids('teppo testaaja') == [hml_reservation.id]
+    assert get_ids('0507654321') == [hml_reservation.id]
+    assert get_ids('meikäläinen') == []
+
+
+@pytest.mark.django_db
+@pytest.mark.urls('hmlvaraus.urls')
+def test_reserver_search_of_berths_is_for_staff(hml_reservation, user_api_client, staff_api_client):
+    url = '/api/berth/?search=meikäläinen'
+
+    response = staff_api_client.get(url)
+    assert response.status_code == 200
+    assert [berth['id'] for berth in response.data['results']] == [hml_reservation.berth_id]
+
+    response = user_api_client.get(url)
+    assert response.status_code == 200
+    assert response.data['results'] == []
+
+    # berth fields are still searchable by everyone
+    response = user_api_client.get('/api/berth/?search=resource in unit')
+    assert [berth['id'] for berth in response.data['results']] == [hml_reservation.berth_id]
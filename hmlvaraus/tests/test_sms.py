@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pytest
+from django.utils import timezone
+
+from hmlvaraus import sms
+from hmlvaraus.models.sms_message import SMSMessage
+
+
+@pytest.mark.django_db
+def test_send_sms_batch(fake_gateway, hml_reservation):
+    unsent = SMSMessage.objects.create(message_body='retry', to_phone_number='+358401111111',
+                                       hml_reservation=hml_reservation)
+
+    sent = sms.send_sms_batch([
+        ('+358402222222', 'first', hml_reservation),
+        ('+358403333333', 'second', hml_reservation),
+        unsent,
+    ])
+
+    assert len(sent) == 3
+    assert [message['to'] for message in fake_gateway.sent] == ['+358402222222', '+358403333333', '+358401111111']
+    assert [message['body'] for message in fake_gateway.sent] == ['first', 'second', 'retry']
+    stored = SMSMessage.objects.filter(hml_reservation=hml_reservation).order_by('twilio_id')
+    assert [message.twilio_id for message in stored] == [message['sid'] for message in fake_gateway.sent]
+    assert not any(message.success for message in stored)
+
+
+@pytest.mark.django_db
+def test_send_sms_batch_without_gateway(settings, hml_reservation):
+    settings.DEBUG = True
+    settings.SMS_GATEWAY = 'hmlvaraus.sms.TwilioGateway'
+    sms.reset_gateway()
+    assert sms.send_sms_batch([('+358402222222', 'first', hml_reservation)]) == []
+    assert not SMSMessage.objects.exists()
+
+
+@pytest.mark.django_db
+def test_reconcile_sms_statuses(fake_gateway, hml_reservation):
+    messages = sms.send_sms_batch([
+        ('+35840000000%d' % i, 'message %d' % i, hml_reservation) for i in range(5)])
+    delivered, pending, unreachable, failed, missing = messages
+    fake_gateway.statuses.update({
+        delivered.twilio_id: ('delivered', None),
+        pending.twilio_id: ('sending', None),
+        unreachable.twilio_id: ('undelivered', sms.UNREACHABLE_ERROR_CODE),
+        failed.twilio_id: ('failed', 30008),
+    })
+    del fake_gateway.statuses[missing.twilio_id]
+    never_sent = SMSMessage.objects.create(message_body='unsent', to_phone_number='+358401111111',
+                                           hml_reservation=hml_reservation)
+
+    resend = sms.reconcile_sms_statuses(messages + [never_sent], timezone.now() - datetime.timedelta(days=1))
+
+    assert set(resend) == {failed, missing, never_sent}
+    assert list(SMSMessage.objects.filter(success=True)) == [delivered]
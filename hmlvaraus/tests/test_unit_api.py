@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pytest
+from django.utils import timezone
+
+from resources.models import Reservation, Resource
+from hmlvaraus.api.unit import UNIT_STATISTICS_DEFAULTS, get_unit_statistics
+from hmlvaraus.models.berth import Berth
+from hmlvaraus.tests.utils import create_hml_reservation
+
+
+def create_berth(unit, resource_type, name, reservable=True, **berth_fields):
+    resource = Resource.objects.create(name=name, unit=unit, type=resource_type, reservable=reservable)
+    return Berth.objects.create(resource=resource, **berth_fields)
+
+
+@pytest.mark.django_db
+def test_get_unit_statistics(test_unit, test_unit2, space_resource_type, user):
+    now = timezone.now()
+    reserved = create_berth(test_unit, space_resource_type, 'reserved')
+    create_hml_reservation(reserved, user, begin=now - datetime.timedelta(days=1), end=now + datetime.timedelta(days=1))
+    # past reservations aren't counted
+    create_hml_reservation(reserved, user, begin=now - datetime.timedelta(days=10), end=now - datetime.timedelta(days=5))
+    create_berth(test_unit, space_resource_type, 'ground', type=Berth.GROUND)
+    create_berth(test_unit, space_resource_type, 'deleted', is_deleted=True)
+    create_berth(test_unit, space_resource_type, 'disabled', is_disabled=True)
+    cancelled = create_berth(test_unit, space_resource_type, 'not reservable', reservable=False)
+    hml_reservation = create_hml_reservation(
+        cancelled, user, begin=now - datetime.timedelta(days=1), end=now + datetime.timedelta(days=1))
+    Reservation.objects.filter(pk=hml_reservation.reservation_id).update(state=Reservation.CANCELLED)
+    Resource.objects.create(name='no berth', unit=test_unit, type=space_resource_type, reservable=True)
+
+    statistics = get_unit_statistics([test_unit.pk, test_unit2.pk])
+
+    assert statistics[test_unit.pk] == {
+        'resources_total': 6,
+        'resources_count': 5,
+        'resources_reservable_count': 2,
+        'reservation_count': 1,
+    }
+    assert statistics[test_unit2.pk] == UNIT_STATISTICS_DEFAULTS
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from resources.models import Reservation
+from hmlvaraus.models.hml_reservation import HMLReservation
+
+
+def create_hml_reservation(berth, user, begin='2017-04-01T00:00:00+03:00', end='2017-10-31T00:00:00+02:00',
+                           reserver_ssn='', parent=None, **reservation_fields):
+    reservation = Reservation.objects.create(
+        resource=berth.resource, begin=begin, end=end, user=user, state=Reservation.CONFIRMED, **reservation_fields)
+    return HMLReservation.objects.create(reservation=reservation, berth=berth, reserver_ssn=reserver_ssn, parent=parent)
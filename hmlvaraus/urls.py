@@ -6,7 +6,7 @@ from hmlvaraus.api.berth import BerthViewSet, GroundBerthPriceView
 from hmlvaraus.api.unit import UnitViewSet
 from hmlvaraus.api.user import UserViewSet
 from hmlvaraus.views.spa import IndexView
-from hmlvaraus.api.importer import ImporterView
+from hmlvaraus.api.importer import ImporterView, ImportJobView
 
 router = DefaultRouter()
 router.register(r'hml_reservation', HMLReservationViewSet)
@@ -23,6 +23,7 @@ urlpatterns = [
     url(r'^api/sms/', SmsView.as_view()),
     url(r'^api/renewal/', RenewalView.as_view()),
     url(r'^api/ground_berth_price/', GroundBerthPriceView.as_view()),
+    url(r'^api/importer/(?P<pk>\d+)/$', ImportJobView.as_view()),
     url(r'^api/importer/', ImporterView.as_view()),
     url(r'^api/', include(router.urls))
 ]
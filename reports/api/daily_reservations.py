@@ -2,7 +2,7 @@ import datetime
 import io
 
 from django.utils.translation import ugettext_lazy as _
-from django.utils import formats
+from django.utils import formats, timezone
 from django.utils.timezone import localtime
 from rest_framework import exceptions, renderers, serializers, status, views
 from rest_framework.response import Response
@@ -13,6 +13,35 @@ from docx.shared import Pt
 from resources.models import Reservation, Resource, Unit
 
 
+REPORT_FIELDS = (
+    'event_subject',
+    'reserver_name',
+    'host_name',
+    'number_of_participants',
+)
+MAX_REPORT_DAYS = 31
+
+
+def get_reservations_by_resource(resources, first_day, days=1):
+    """
+    Reservations of the resources beginning during the days, fetched in one query
+    and grouped by resource id and local date, in order of begin time.
+
+    :rtype: dict[str, dict[datetime.date, list[Reservation]]]
+    """
+    begin = timezone.make_aware(datetime.datetime.combine(first_day, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(first_day + datetime.timedelta(days=days), datetime.time.min))
+    reservations = Reservation.objects.filter(
+        resource__in=[resource.id for resource in resources], begin__gte=begin, begin__lt=end
+    ).order_by('resource', 'begin')
+
+    grouped = {}
+    for reservation in reservations:
+        by_day = grouped.setdefault(reservation.resource_id, {})
+        by_day.setdefault(localtime(reservation.begin).date(), []).append(reservation)
+    return grouped
+
+
 class DocxRenderer(renderers.BaseRenderer):
     media_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
     format = 'docx'
@@ -21,19 +50,27 @@ class DocxRenderer(renderers.BaseRenderer):
 
     def render(self, data, media_type=None, renderer_context=None):
         day = data['day']
-        resource_qs = data['resource_qs']
+        days = data['days']
+        resources = list(data['resource_qs'])
+        reservations_by_resource = get_reservations_by_resource(resources, day, days)
 
         include_resources_without_reservations = data['include_resources_without_reservations']
         document = Document()
+        labels = {field: Reservation._meta.get_field(field).verbose_name + ':' for field in REPORT_FIELDS}
+
+        if days == 1:
+            range_text = formats.date_format(day, format='D j.n.Y')
+        else:
+            range_text = '%s–%s' % (formats.date_format(day, format='D j.n.Y'),
+                                     formats.date_format(day + datetime.timedelta(days=days - 1), format='D j.n.Y'))
 
         first_resource = True
         atleast_one_reservation = False
 
-        for resource in resource_qs:
-            reservations = Reservation.objects.filter(resource=resource, begin__date=day).order_by('resource', 'begin')
-            reservation_count = reservations.count()
+        for resource in resources:
+            reservations_by_day = reservations_by_resource.get(resource.id, {})
 
-            if reservation_count == 0 and not include_resources_without_reservations:
+            if not reservations_by_day and not include_resources_without_reservations:
                 continue
 
             atleast_one_reservation = True
@@ -46,42 +83,18 @@ class DocxRenderer(renderers.BaseRenderer):
 
             name_h = document.add_heading(resource.name, 1)
             name_h.paragraph_format.space_after = Pt(12)
-            date_h = document.add_heading(formats.date_format(day, format='D j.n.Y'), 2)
-            date_h.paragraph_format.space_after = Pt(48)
 
-            if reservation_count == 0:
+            if not reservations_by_day:
+                date_h = document.add_heading(range_text, 2)
+                date_h.paragraph_format.space_after = Pt(48)
                 p = document.add_paragraph(_('No reservations'))
                 p.paragraph_format.space_before = Pt(24)
 
-            for reservation in reservations:
-
-                # the time
-                p = document.add_paragraph()
-                p.paragraph_format.space_before = Pt(24)
-                p.add_run(formats.time_format(localtime(reservation.begin)) + '–' +
-                          formats.time_format(localtime(reservation.end))).bold = True
-
-                # collect attributes from the reservation, skip empty ones
-                attrs = [(field, getattr(reservation, field)) for field in (
-                    'event_subject',
-                    'reserver_name',
-                    'host_name',
-                    'number_of_participants',
-                ) if getattr(reservation, field)]
-
-                if not attrs:
-                    # this should not normally happen as event_subject and number_of_participants
-                    # should be required fields
-                    p = document.add_paragraph(_('No information available'))
-                    p.paragraph_format.space_before = Pt(24)
-                    continue
-
-                table = document.add_table(rows=0, cols=2)
-                # build the attribute table
-                for attr in attrs:
-                    row_cells = table.add_row().cells
-                    row_cells[0].text = Reservation._meta.get_field(attr[0]).verbose_name + ':'
-                    row_cells[1].text = str(attr[1])
+            for reservation_day, reservations in sorted(reservations_by_day.items()):
+                date_h = document.add_heading(formats.date_format(reservation_day, format='D j.n.Y'), 2)
+                date_h.paragraph_format.space_after = Pt(48)
+                for reservation in reservations:
+                    self.add_reservation(document, reservation, labels)
 
         if not atleast_one_reservation:
             document.add_heading(_('No reservations'), 1)
@@ -91,9 +104,34 @@ class DocxRenderer(renderers.BaseRenderer):
 
         return output.getvalue()
 
+    def add_reservation(self, document, reservation, labels):
+        # the time
+        p = document.add_paragraph()
+        p.paragraph_format.space_before = Pt(24)
+        p.add_run(formats.time_format(localtime(reservation.begin)) + '–' +
+                  formats.time_format(localtime(reservation.end))).bold = True
+
+        # collect attributes from the reservation, skip empty ones
+        attrs = [(field, getattr(reservation, field)) for field in REPORT_FIELDS if getattr(reservation, field)]
+
+        if not attrs:
+            # this should not normally happen as event_subject and number_of_participants
+            # should be required fields
+            p = document.add_paragraph(_('No information available'))
+            p.paragraph_format.space_before = Pt(24)
+            return
+
+        table = document.add_table(rows=0, cols=2)
+        # build the attribute table
+        for field, value in attrs:
+            row_cells = table.add_row().cells
+            row_cells[0].text = labels[field]
+            row_cells[1].text = str(value)
+
 
 class ReportParamSerializer(serializers.Serializer):
     day = serializers.DateField(required=False)
+    days = serializers.IntegerField(required=False, default=1, min_value=1, max_value=MAX_REPORT_DAYS)
     unit = serializers.CharField(required=False)
     resource = serializers.CharField(required=False)
     include_resources_without_reservations = serializers.BooleanField(required=False, default=False)
@@ -145,7 +183,12 @@ class DailyReservationsReport(views.APIView):
 
         response = Response(serializer.validated_data)
 
-        filename = '%s-%s' % (_('day-report'), serializer.validated_data['day'])
+        day = serializer.validated_data['day']
+        days = serializer.validated_data['days']
+        if days == 1:
+            filename = '%s-%s' % (_('day-report'), day)
+        else:
+            filename = '%s-%s-%s' % (_('reservation-report'), day, day + datetime.timedelta(days=days - 1))
         response['Content-Disposition'] = 'attachment; filename=%s.%s' % (filename, request.accepted_renderer.format)
         return response
 
@@ -1,6 +1,9 @@
+import datetime
+
 import pytest
 from freezegun import freeze_time
 from django.utils import dateparse
+from reports.api.daily_reservations import get_reservations_by_resource
 from resources.models import Reservation
 from resources.tests.conftest import *
 
@@ -85,3 +88,40 @@ def test_daily_reservations_filter_errors(api_client, test_unit, reservation, re
     response = api_client.get(list_url + '', HTTP_ACCEPT_LANGUAGE='en')
     assert response.status_code == 400
     assert 'Either unit or resource is required.' in response.data['non_field_errors']
+
+
+@pytest.mark.django_db
+def test_reservations_report_for_several_days(api_client, test_unit, reservation, resource_in_unit):
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2015-04-07T09:00:00+02:00',
+        end='2015-04-07T10:00:00+02:00',
+        reserver_name='Jane Smith',
+        event_subject="Jane's party",
+    )
+
+    response = api_client.get(list_url + '?unit=%s&day=2015-04-04' % test_unit.id)
+    assert response.status_code == 200
+    check_valid_response(response)
+    one_day_length = len(response.content)
+
+    response = api_client.get(list_url + '?unit=%s&day=2015-04-01&days=7' % test_unit.id)
+    assert response.status_code == 200
+    check_valid_response(response)
+    assert response._headers['content-disposition'][1].endswith('2015-04-01-2015-04-07.docx')
+    assert len(response.content) > one_day_length
+
+    response = api_client.get(list_url + '?unit=%s&days=0' % test_unit.id)
+    assert response.status_code == 400
+    assert 'days' in response.data
+
+
+@pytest.mark.django_db
+def test_reservations_report_groups_reservations(test_unit, reservation, reservation2, resource_in_unit,
+                                                 resource_in_unit2, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        grouped = get_reservations_by_resource([resource_in_unit, resource_in_unit2], datetime.date(2015, 4, 4))
+    assert grouped == {
+        resource_in_unit.id: {datetime.date(2015, 4, 4): [reservation]},
+        resource_in_unit2.id: {datetime.date(2015, 4, 4): [reservation2]},
+    }
@@ -1,3 +1,6 @@
+from django.utils import timezone
+
+
 class CommonExcludeMixin(object):
     readonly_fields = ('id',)
     exclude = ('created_at', 'created_by', 'modified_at', 'modified_by')
@@ -8,6 +11,7 @@ class PopulateCreatedAndModifiedMixin(object):
         if change is False:
             obj.created_by = request.user
         obj.modified_by = request.user
+        obj.modified_at = timezone.now()
         obj.save()
 
 
@@ -3,6 +3,7 @@ from django import forms
 from django.contrib.admin.options import InlineModelAdmin
 from django.utils.translation import ugettext_lazy
 from resources.models import Day, Period, Resource, Unit
+from resources.models.availability import deferred_opening_hours_refresh
 
 DAYS_OF_WEEK_MAP = dict(Day.DAYS_OF_WEEK)
 WEEKDAY_PREFIX = "wd-"
@@ -89,18 +90,21 @@ class PeriodModelForm(forms.ModelForm):
             self.initial.update(helper.initial)
 
     def save(self, commit=True):
-        self.instance = super(PeriodModelForm, self).save(commit=commit)
-        assert isinstance(self.instance, Period)
-
-        def save_days():
-            for wd, helper in self.day_fields.items():
-                helper.save(period=self.instance)
-            self.instance.save_closedness()
-
-        if commit:
-            save_days()
-        else:
-            self.save_m2m = save_days
+        # The period and its days refresh the stored opening hours only once
+        with deferred_opening_hours_refresh():
+            self.instance = super(PeriodModelForm, self).save(commit=commit)
+            assert isinstance(self.instance, Period)
+
+            def save_days():
+                with deferred_opening_hours_refresh():
+                    for wd, helper in self.day_fields.items():
+                        helper.save(period=self.instance)
+                    self.instance.save_closedness()
+
+            if commit:
+                save_days()
+            else:
+                self.save_m2m = save_days
         return self.instance
 
 
@@ -5,6 +5,7 @@ from .reservation import ReservationViewSet
 #from .unit import UnitViewSet
 from .search import TypeaheadViewSet
 from .equipment import EquipmentViewSet
+from .availability import AvailabilityViewSet
 
 from rest_framework import routers
 
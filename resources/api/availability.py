@@ -0,0 +1,97 @@
+import datetime
+
+import arrow
+import pytz
+from arrow.parser import ParserError
+from rest_framework import exceptions, mixins, permissions, response, viewsets
+
+from resources.models import Resource
+from resources.timetools import get_availability
+
+from .base import register_view
+
+MAX_AVAILABILITY_DAYS = 31
+
+
+class AvailabilityViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Opening hours and free time of resources between `start` and `end`.
+
+    Availability of a page of resources is calculated in a fixed number of queries
+    regardless of the page size and the length of the range. `resource` limits the
+    listing to comma separated resource ids and `duration` (in minutes) leaves out
+    free time shorter than it. The range can be at most MAX_AVAILABILITY_DAYS long.
+    """
+    queryset = Resource.objects.select_related('unit').filter(unit__isnull=False).order_by('id')
+    permission_classes = (permissions.AllowAny,)
+
+    def get_queryset(self):
+        queryset = self.queryset
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(public=True)
+        resource_ids = self.request.query_params.get('resource')
+        if resource_ids:
+            queryset = queryset.filter(id__in=resource_ids.split(','))
+        return queryset
+
+    def parse_parameters(self):
+        params = self.request.query_params
+        times = {}
+        for name in ('start', 'end'):
+            if name not in params:
+                raise exceptions.ParseError("'%s' is required" % name)
+            try:
+                times[name] = arrow.get(params[name]).to('utc').datetime
+            except ParserError:
+                raise exceptions.ParseError("'%s' must be a timestamp in ISO 8601 format" % name)
+        if times['start'] >= times['end']:
+            raise exceptions.ParseError("'end' must be after 'start'")
+        if times['end'] - times['start'] > datetime.timedelta(days=MAX_AVAILABILITY_DAYS):
+            raise exceptions.ParseError("'start' and 'end' can be at most %d days apart" % MAX_AVAILABILITY_DAYS)
+
+        duration = None
+        if 'duration' in params:
+            try:
+                duration = datetime.timedelta(minutes=int(params['duration']))
+            except ValueError:
+                raise exceptions.ParseError("'duration' must be an integer")
+        return times['start'], times['end'], duration
+
+    def serialize_availability(self, resource, opening_hours, availability):
+        zone = pytz.timezone(resource.unit.time_zone)
+        hours = []
+        for date, open_hours in sorted(opening_hours.items()):
+            hours.append({
+                'date': date.isoformat(),
+                'opens': open_hours.opens.astimezone(zone).isoformat() if open_hours else None,
+                'closes': open_hours.closes.astimezone(zone).isoformat() if open_hours else None,
+            })
+        free_hours = []
+        for date in sorted(availability):
+            for free_time in availability[date]:
+                free_hours.append({
+                    'starts': free_time.begin.isoformat(),
+                    'ends': free_time.end.isoformat(),
+                })
+        return {
+            'id': resource.id,
+            'opening_hours': hours,
+            'available_hours': free_hours,
+        }
+
+    def list(self, request, *args, **kwargs):
+        start, end, duration = self.parse_parameters()
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        resources = list(page if page is not None else queryset)
+        opening_hours, availability = get_availability(start, end, resources, duration=duration)
+        data = [self.serialize_availability(resource, opening_hours[resource], availability[resource])
+                for resource in resources]
+
+        if page is not None:
+            return self.get_paginated_response(data)
+        return response.Response(data)
+
+
+register_view(AvailabilityViewSet, 'availability', base_name='availability')
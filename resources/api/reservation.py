@@ -7,21 +7,22 @@ from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import PermissionDenied, ValidationError as DjangoValidationError
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from rest_framework import viewsets, serializers, filters, exceptions, permissions
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.fields import BooleanField, IntegerField
 from rest_framework import renderers
-from rest_framework.exceptions import NotAcceptable, ValidationError
-from guardian.shortcuts import get_objects_for_user
+from rest_framework.exceptions import ValidationError
 
 from helusers.jwt import JWTAuthentication
 from munigeo import api as munigeo_api
-from resources.models import Reservation, Resource, Unit
+from resources.models import Reservation, Resource
+from resources.models.permission_index import get_unit_permission_index
 from resources.models.reservation import RESERVATION_EXTRA_FIELDS
 from resources.pagination import ReservationPagination
 from users.models import User
-from resources.models.utils import generate_reservation_xlsx, get_object_or_none
+from resources.models.utils import get_object_or_none, stream_reservation_csv, stream_reservation_xlsx
 
 from .base import NullableDateTimeField, TranslatedModelSerializer, register_view
 
@@ -33,6 +34,10 @@ try:
 except:
     pass
 
+EXPORT_FORMATS = ('xlsx', 'csv')
+# Exports are not paginated, but they are cut at this many reservations
+EXPORT_MAX_ROWS = 50000
+
 
 class UserSerializer(TranslatedModelSerializer):
     display_name = serializers.ReadOnlyField(source='get_display_name')
@@ -222,19 +227,6 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
         resource = instance.resource
         user = self.context['request'].user
 
-        if self.context['request'].accepted_renderer.format == 'xlsx':
-            # Return somewhat different data in case we are dealing with xlsx.
-            # The excel renderer needs datetime objects, so begin and end are passed as objects
-            # to avoid needing to convert them back and forth.
-            data.update(**{
-                'unit': resource.unit.name,  # additional
-                'resource': resource.name,  # resource name instead of id
-                'begin': instance.begin,  # datetime object
-                'end': instance.end,  # datetime object
-                'user': instance.user.email,  # just email
-                'created_at': instance.created_at
-            })
-
         # Show the comments field and the user object only for staff
         if not resource.is_admin(user):
             del data['comments']
@@ -369,12 +361,14 @@ class CanApproveFilterBackend(filters.BaseFilterBackend):
         filter_value = request.query_params.get('can_approve', None)
         if filter_value:
             queryset = queryset.filter(resource__need_manual_confirmation=True)
-            units = get_objects_for_user(user=request.user, perms=['can_approve_reservation'], klass=Unit)
+            unit_ids = get_unit_permission_index(request.user).get_unit_ids('can_approve_reservation')
             can_approve = BooleanField().to_internal_value(filter_value)
-            if can_approve:
-                queryset = queryset.filter(resource__unit__in=units)
+            if unit_ids is None:
+                queryset = queryset if can_approve else queryset.none()
+            elif can_approve:
+                queryset = queryset.filter(resource__unit__in=list(unit_ids))
             else:
-                queryset = queryset.exclude(resource__unit__in=units)
+                queryset = queryset.exclude(resource__unit__in=list(unit_ids))
         return queryset
 
 
@@ -393,20 +387,23 @@ class ReservationPermission(permissions.BasePermission):
 
 
 class ReservationExcelRenderer(renderers.BaseRenderer):
+    """
+    Selects the xlsx export. The export itself is streamed by ReservationViewSet,
+    so only error responses are ever rendered here and they are left empty.
+    """
     media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     format = 'xlsx'
     charset = None
     render_style = 'binary'
 
     def render(self, data, media_type=None, renderer_context=None):
-        if not renderer_context or renderer_context['response'].status_code == 404:
-            return bytes()
-        if renderer_context['view'].action == 'retrieve':
-            return generate_reservation_xlsx([data])
-        elif renderer_context['view'].action == 'list':
-            return generate_reservation_xlsx(data['results'])
-        else:
-            return NotAcceptable()
+        return bytes()
+
+
+class ReservationCSVRenderer(ReservationExcelRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
 
 
 class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
@@ -416,7 +413,8 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
     filter_backends = (filters.OrderingFilter, UserFilterBackend, ResourceFilterBackend, ReservationFilterBackend,
                        NeedManualConfirmationFilterBackend, StateFilterBackend, CanApproveFilterBackend)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, ReservationPermission)
-    renderer_classes = (renderers.JSONRenderer, renderers.BrowsableAPIRenderer, ReservationExcelRenderer)
+    renderer_classes = (renderers.JSONRenderer, renderers.BrowsableAPIRenderer, ReservationExcelRenderer,
+                        ReservationCSVRenderer)
     pagination_class = ReservationPagination
     #authentication_classes = (JWTAuthentication, TokenAuthentication)
     ordering_fields = ('begin',)
@@ -467,17 +465,56 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet):
     def perform_destroy(self, instance):
         instance.set_state(Reservation.CANCELLED, self.request.user)
 
-    def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = 'attachment; filename={}.xlsx'.format(_('reservations'))
+    def get_export_rows(self, queryset):
+        """
+        Rows for stream_reservation_xlsx and stream_reservation_csv, read from
+        the database one at a time without building model instances.
+        """
+        # Same rule as Resource.is_admin, which doesn't depend on the resource
+        include_private_fields = self.request.user.is_staff
+
+        # Names are translated, so they are read through the models and only once per resource
+        resources = Resource.objects.filter(id__in=queryset.values('resource_id')).select_related('unit')
+        names = {resource.id: (resource.unit.name if resource.unit else None, resource.name) for resource in resources}
+
+        if not queryset.ordered:
+            queryset = queryset.order_by('begin', 'id')
+        values = queryset[:EXPORT_MAX_ROWS].values('resource_id', 'begin', 'end', 'created_at', 'user__email', 'comments')
+        return (
+            names[row['resource_id']] + (
+                row['begin'], row['end'], row['created_at'],
+                row['user__email'] if include_private_fields else None,
+                row['comments'] if include_private_fields else None,
+            )
+            for row in values.iterator()
+        )
+
+    def get_export_response(self, queryset, filename):
+        renderer = self.request.accepted_renderer
+        if renderer.format == 'xlsx':
+            content = stream_reservation_xlsx(self.get_export_rows(queryset))
+        else:
+            content = stream_reservation_csv(self.get_export_rows(queryset))
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += '; charset={}'.format(renderer.charset)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename={}.{}'.format(filename, renderer.format)
         return response
 
+    def list(self, request, *args, **kwargs):
+        # Exports contain every matching reservation up to EXPORT_MAX_ROWS, they are not paginated
+        if request.accepted_renderer.format in EXPORT_FORMATS:
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.get_export_response(queryset, _('reservations'))
+        return super().list(request, *args, **kwargs)
+
     def retrieve(self, request, *args, **kwargs):
-        response = super().retrieve(request, *args, **kwargs)
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = 'attachment; filename={}-{}.xlsx'.format(_('reservation'), kwargs['pk'])
-        return response
+        if request.accepted_renderer.format in EXPORT_FORMATS:
+            instance = self.get_object()
+            queryset = self.get_queryset().filter(pk=instance.pk)
+            return self.get_export_response(queryset, '{}-{}'.format(_('reservation'), instance.pk))
+        return super().retrieve(request, *args, **kwargs)
 
 register_view(ReservationViewSet, 'reservation')
 
@@ -7,10 +7,13 @@ import pytz
 from arrow.parser import ParserError
 
 from django import forms
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import models
+from django.db.models import F, Q, prefetch_related_objects
 from django.core.urlresolvers import reverse
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
+from django.contrib.postgres.search import SearchQuery, SearchRank
 from resources.pagination import PurposePagination
 from rest_framework import exceptions, filters, mixins, serializers, viewsets, response, status
 from rest_framework.decorators import detail_route
@@ -18,7 +21,10 @@ from rest_framework.exceptions import PermissionDenied
 from rest_framework.fields import BooleanField
 
 from munigeo import api as munigeo_api
-from resources.models import (Purpose, Resource, ResourceImage, ResourceType, ResourceEquipment, TermsOfUse)
+from resources.models import (Purpose, Resource, ResourceImage, ResourceType, ResourceEquipment, TermsOfUse,
+                              get_opening_hours_for_resources, get_available_hours_for_resources)
+from resources.models.availability import filter_open_resources
+from resources.models.resource_cache import RESOURCE_CACHE_TIMEOUT, get_resource_cache_keys
 from .base import TranslatedModelSerializer, register_view
 from .reservation import ReservationSerializer
 from .unit import UnitSerializer
@@ -97,10 +103,83 @@ class TermsOfUseSerializer(TranslatedModelSerializer):
         fields = ('text',)
 
 
+# Relations serialized into the cached resource data
+RESOURCE_CACHE_PREFETCH_RELATED = ('resource_equipment__equipment__aliases', 'resource_equipment__equipment__category',
+                                   'reservation_metadata_set__supported_fields',
+                                   'reservation_metadata_set__required_fields')
+
+
+def get_favorite_resource_ids(request):
+    """
+    Ids of the resources the user has favorited, loaded once per request.
+
+    :rtype: set[str]
+    """
+    favorite_ids = getattr(request, '_favorite_resource_ids', None)
+    if favorite_ids is None:
+        if request.user.is_authenticated():
+            favorite_ids = set(request.user.favorite_resources.values_list('id', flat=True))
+        else:
+            favorite_ids = set()
+        request._favorite_resource_ids = favorite_ids
+    return favorite_ids
+
+
+def get_cached_resource_data(resources):
+    """
+    Serialized data of the resources that only changes when they or the models
+    they refer to are saved. Read from the cache in one round trip, and the
+    missing resources are serialized and cached.
+
+    :rtype: dict[str, dict]
+    :type resources: list[Resource]
+    """
+    keys = get_resource_cache_keys([resource.pk for resource in resources])
+    cached = cache.get_many(list(keys.values()))
+
+    data = {resource.pk: cached[keys[resource.pk]] for resource in resources if keys[resource.pk] in cached}
+    missing = [resource for resource in resources if resource.pk not in data]
+    if not missing:
+        return data
+
+    prefetch_related_objects(missing, *RESOURCE_CACHE_PREFETCH_RELATED)
+    new_data = {}
+    for resource in missing:
+        data[resource.pk] = new_data[keys[resource.pk]] = {
+            'equipment': list(ResourceEquipmentSerializer(resource.resource_equipment.all(), many=True).data),
+            'supported_reservation_extra_fields': resource.get_supported_reservation_extra_field_names(),
+            'required_reservation_extra_fields': resource.get_required_reservation_extra_field_names(),
+        }
+    cache.set_many(new_data, RESOURCE_CACHE_TIMEOUT)
+    return data
+
+
+class ResourceListSerializer(serializers.ListSerializer):
+    """
+    Resolves the opening hours and available hours of all listed resources at once.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        items = list(iterable)
+        self.child.cached_data = get_cached_resource_data(items)
+        if 'request' in self.child.context:
+            self.child.parse_parameters()
+            resources = [item for item in items if item.unit_id]
+            self.child.opening_hours = get_opening_hours_for_resources(
+                resources, self.child.context.get('start'), self.child.context.get('end'))
+            if 'start' in self.child.context:
+                self.child.available_hours = get_available_hours_for_resources(
+                    resources, self.child.context['start'], self.child.context['end'],
+                    duration=self.child.get_duration(), during_closing=self.child.get_during_closing(),
+                    opening_hours=self.child.opening_hours)
+        return super().to_representation(items)
+
+
 class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
     purposes = PurposeSerializer(many=True)
     images = NestedResourceImageSerializer(many=True)
-    equipment = ResourceEquipmentSerializer(many=True, read_only=True, source='resource_equipment')
+    equipment = serializers.SerializerMethodField()
     type = ResourceTypeSerializer()
     # FIXME: location field gets removed by munigeo
     location = serializers.SerializerMethodField()
@@ -108,8 +187,8 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
     opening_hours = serializers.SerializerMethodField()
     reservations = serializers.SerializerMethodField()
     user_permissions = serializers.SerializerMethodField()
-    supported_reservation_extra_fields = serializers.ReadOnlyField(source='get_supported_reservation_extra_field_names')
-    required_reservation_extra_fields = serializers.ReadOnlyField(source='get_required_reservation_extra_field_names')
+    supported_reservation_extra_fields = serializers.SerializerMethodField()
+    required_reservation_extra_fields = serializers.SerializerMethodField()
     is_favorite = serializers.SerializerMethodField()
     generic_terms = serializers.SerializerMethodField()
     reservable_days_in_advance = serializers.ReadOnlyField(source='get_reservable_days_in_advance')
@@ -124,7 +203,22 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
 
     def get_is_favorite(self, obj):
         request = self.context.get('request', None)
-        return request.user in obj.favorited_by.all()
+        return obj.pk in get_favorite_resource_ids(request) if request else False
+
+    def get_cached_data(self, obj):
+        cached_data = getattr(self, 'cached_data', None)
+        if cached_data is None or obj.pk not in cached_data:
+            return get_cached_resource_data([obj])[obj.pk]
+        return cached_data[obj.pk]
+
+    def get_equipment(self, obj):
+        return self.get_cached_data(obj)['equipment']
+
+    def get_supported_reservation_extra_fields(self, obj):
+        return self.get_cached_data(obj)['supported_reservation_extra_fields']
+
+    def get_required_reservation_extra_fields(self, obj):
+        return self.get_cached_data(obj)['required_reservation_extra_fields']
 
     def get_generic_terms(self, obj):
         data = TermsOfUseSerializer(obj.generic_terms).data
@@ -142,9 +236,6 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
     def to_representation(self, obj):
         # we must parse the time parameters before serializing
         self.parse_parameters()
-        if isinstance(obj, dict):
-            # resource is already serialized
-            return obj
         ret = super().to_representation(obj)
         if hasattr(obj, 'distance'):
             if obj.distance is not None:
@@ -196,7 +287,11 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
             start = None
             end = None
 
-        hours_by_date = obj.get_opening_hours(start, end)
+        opening_hours = getattr(self, 'opening_hours', None)
+        if opening_hours is not None and obj.pk in opening_hours:
+            hours_by_date = opening_hours[obj.pk]
+        else:
+            hours_by_date = obj.get_opening_hours(start, end)
 
         ret = []
         for x in sorted(hours_by_date.items()):
@@ -217,6 +312,18 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
         res_ser_list = ReservationSerializer(res_list, many=True, context=self.context).data
         return res_ser_list
 
+    def get_duration(self):
+        try:
+            return datetime.timedelta(minutes=int(self.context['duration']))
+        except KeyError:
+            return None
+
+    def get_during_closing(self):
+        try:
+            return self.context['during_closing']
+        except KeyError:
+            return False
+
     def get_available_hours(self, obj):
         """
         The input datetimes must be converted to UTC before passing them to the model. Also, missing
@@ -228,20 +335,14 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
             return None
         zone = pytz.timezone(obj.unit.time_zone)
 
-        try:
-            duration = datetime.timedelta(minutes=int(self.context['duration']))
-        except KeyError:
-            duration = None
-
-        try:
-            during_closing = self.context['during_closing']
-        except KeyError:
-            during_closing = False
-
-        hour_list = obj.get_available_hours(start=self.context['start'],
-                                            end=self.context['end'],
-                                            duration=duration,
-                                            during_closing=during_closing)
+        available_hours = getattr(self, 'available_hours', None)
+        if available_hours is not None and obj.pk in available_hours:
+            hour_list = available_hours[obj.pk]
+        else:
+            hour_list = obj.get_available_hours(start=self.context['start'],
+                                                end=self.context['end'],
+                                                duration=self.get_duration(),
+                                                during_closing=self.get_during_closing())
         # the hours must be localized when serializing
         for hours in hour_list:
             hours['starts'] = hours['starts'].astimezone(zone)
@@ -250,7 +351,9 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
 
     class Meta:
         model = Resource
-        exclude = ('reservation_confirmed_notification_extra', 'access_code_type', 'reservation_metadata_set')
+        exclude = ('reservation_confirmed_notification_extra', 'access_code_type', 'reservation_metadata_set',
+                   'search_document')
+        list_serializer_class = ResourceListSerializer
 
 
 class ResourceDetailsSerializer(ResourceSerializer):
@@ -320,25 +423,66 @@ class ResourceFilterBackend(filters.BaseFilterBackend):
 
 class AvailableFilterBackend(filters.BaseFilterBackend):
     """
-    Filters resource availability based on request parameters, serializing the queryset
-    in the process. Therefore, AvailableFilterBackend must always be the final filter.
+    Filters resource availability based on request parameters. A resource is
+    available if it has opening hours for the range and free time of at least
+    `duration` in it.
+
+    Unless free time during closing hours is asked for, resources whose stored
+    opening hours show them closed for the whole range are left out in the
+    database. The available hours of the rest are resolved in a fixed number of
+    queries and the result is still a queryset, so it's paginated before anything
+    is serialized. Only the ids and time zones of the resources are loaded for this.
     """
 
     def filter_queryset(self, request, queryset, view):
         params = request.query_params
         # filtering is only done if all three parameters are provided
         if 'start' in params and 'end' in params and 'duration' in params:
-            context = {'request': request}
-            serializer = view.serializer_class(context=context)
-            serialized_queryset = []
-            for resource in queryset:
-                serialized_resource = serializer.to_representation(resource)
-                if serialized_resource['available_hours'] and serialized_resource['opening_hours']:
-                    serialized_queryset.append(serialized_resource)
-            return serialized_queryset
+            serializer = view.serializer_class(context={'request': request})
+            serializer.parse_parameters()
+            start, end = serializer.context['start'], serializer.context['end']
+            during_closing = serializer.get_during_closing()
+            resources = queryset.filter(unit__isnull=False).select_related(None).prefetch_related(None)
+            if not during_closing:
+                resources = filter_open_resources(resources, start, end)
+            resources = list(resources.select_related('unit').only('id', 'unit', 'unit__time_zone'))
+            opening_hours = get_opening_hours_for_resources(resources, start, end)
+            available_hours = get_available_hours_for_resources(
+                resources, start, end, duration=serializer.get_duration(),
+                during_closing=during_closing, opening_hours=opening_hours)
+            available_ids = [resource_id for resource_id, hours in available_hours.items()
+                             if hours and opening_hours.get(resource_id)]
+            return queryset.filter(pk__in=available_ids)
         return queryset
 
 
+class ResourceSearchFilter(filters.SearchFilter):
+    """
+    By default `search` finds resources by substrings of their names and descriptions
+    and the names of their units. With `search_mode=fulltext` the words of `search`
+    are stemmed in Finnish, Swedish and English and matched against the search
+    documents of resources, and the best matches come first.
+    """
+    search_mode_param = 'search_mode'
+    search_configs = ('finnish', 'swedish', 'english')
+
+    def filter_queryset(self, request, queryset, view):
+        search_mode = request.query_params.get(self.search_mode_param, 'contains')
+        if search_mode == 'contains':
+            return super().filter_queryset(request, queryset, view)
+        if search_mode != 'fulltext':
+            raise exceptions.ParseError("'%s' must be either 'contains' or 'fulltext'" % self.search_mode_param)
+
+        text = request.query_params.get(self.search_param, '').strip()
+        if not text:
+            return queryset
+        query = SearchQuery(text, config=self.search_configs[0])
+        for config in self.search_configs[1:]:
+            query = query | SearchQuery(text, config=config)
+        queryset = queryset.filter(search_document=query)
+        return queryset.annotate(search_rank=SearchRank(F('search_document'), query)).order_by('-search_rank', 'id')
+
+
 class LocationFilterBackend(filters.BaseFilterBackend):
     """
     Filters based on resource (or resource unit) location.
@@ -374,9 +518,9 @@ class LocationFilterBackend(filters.BaseFilterBackend):
 class ResourceListViewSet(munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
                           viewsets.GenericViewSet):
     queryset = Resource.objects.select_related('generic_terms', 'unit', 'type', 'reservation_metadata_set')
-    queryset = queryset.prefetch_related('favorited_by', 'resource_equipment', 'purposes', 'images', 'purposes')
+    queryset = queryset.prefetch_related('purposes', 'images')
     serializer_class = ResourceSerializer
-    filter_backends = (filters.SearchFilter, ResourceFilterBackend,
+    filter_backends = (ResourceSearchFilter, ResourceFilterBackend,
                        LocationFilterBackend, AvailableFilterBackend)
     search_fields = ('name_fi', 'description_fi', 'unit__name_fi',
                      'name_sv', 'description_sv', 'unit__name_sv',
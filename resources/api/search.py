@@ -1,4 +1,5 @@
-from django.db.models import Q
+import itertools
+
 from django.utils.encoding import force_text
 from rest_framework import viewsets
 from rest_framework.fields import BooleanField
@@ -6,6 +7,10 @@ from rest_framework.response import Response
 
 from resources.api.resource import ResourceListViewSet
 from resources.api.unit import UnitViewSet
+from resources.models.typeahead import search_typeahead
+
+# Number of matches whose visibility is checked with one query
+TYPEAHEAD_BATCH_SIZE = 100
 
 
 class TypeaheadViewSet(viewsets.ViewSet):
@@ -25,11 +30,15 @@ class TypeaheadViewSet(viewsets.ViewSet):
     be limited by the comma-separated `types` query parameter.
 
     Currently supported are "resource" and "unit".
+
+    Names starting with the first word of the input and containing the
+    rest of the words are returned in alphabetical order.
     """
     objects = {
-        "resource": {"search_fields": ["name"], "viewset": ResourceListViewSet, "text_getter": force_text},
-        "unit": {"search_fields": ["name"], "viewset": UnitViewSet, "text_getter": force_text},
+        "resource": {"viewset": ResourceListViewSet, "text_getter": force_text},
+        "unit": {"viewset": UnitViewSet, "text_getter": force_text},
     }
+    max_results = 10
 
     def list(self, request, *args, **kwargs):
         return Response(dict(self.get_object_lists(request)))
@@ -52,32 +61,33 @@ class TypeaheadViewSet(viewsets.ViewSet):
                 yield obj_list
 
     def get_single_object_type_object_list(self, request, obj_name, query_parts, full=False):
-        # TODO: Could add caching here, keyed on `query_parts`
         obj_schema = self.objects.get(obj_name)
         if not obj_schema:
             return None
-        q = self.build_q(obj_schema["search_fields"], query_parts)
 
         # Defer serialization and queryset retrieval to the viewsets that are in use
         # in the general API.
         viewset_class = obj_schema["viewset"]
         object_viewset = viewset_class(request=request)
         object_viewset.initial(request)
-        queryset = object_viewset.get_queryset().filter(q)[:10]  # TODO: Sort these?
-        if queryset.exists():
+        queryset = object_viewset.get_queryset()
+
+        # Matches come from the prefix index in order of name, the database is only
+        # asked which of them the user is allowed to see, a batch at a time until
+        # there are enough of them
+        matches = search_typeahead(obj_name, query_parts)
+        objects = []
+        while len(objects) < self.max_results:
+            ids = list(itertools.islice(matches, TYPEAHEAD_BATCH_SIZE))
+            if not ids:
+                break
+            visible = {obj.pk: obj for obj in queryset.filter(pk__in=ids)}
+            objects.extend(visible[pk] for pk in ids if pk in visible)
+        objects = objects[:self.max_results]
+        if objects:
             if full:
-                data = object_viewset.get_serializer(queryset, many=True).data
+                data = object_viewset.get_serializer(objects, many=True).data
             else:
                 text_getter = obj_schema["text_getter"]
-                data = [{"id": obj.pk, "text": text_getter(obj)} for obj in queryset]
+                data = [{"id": obj.pk, "text": text_getter(obj)} for obj in objects]
             return (obj_name, data)
-
-    def build_q(self, fields, query_parts):
-        q = Q()
-        for field in fields:
-            field_q = Q()
-            for i, part in enumerate(query_parts):
-                key = ("%s__istartswith" % field if i == 0 else "%s__icontains" % field)
-                field_q &= Q(**{key: part})
-            q |= field_q
-        return q
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Management command to refresh the stored daily opening hours of resources
+"""
+
+from django.core.management.base import BaseCommand
+
+from resources.models import OpeningHours, Resource
+from resources.models.availability import get_opening_hours_window, refresh_opening_hours
+
+
+class Command(BaseCommand):
+    help = "Store the opening hours of resources for the coming days and drop the days that have passed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=100,
+                            help='number of resources refreshed at a time')
+
+    def handle(self, *args, **options):
+        window_begin, window_end = get_opening_hours_window()
+        OpeningHours.objects.filter(date__lt=window_begin).delete()
+
+        batch_size = options['batch_size']
+        resource_ids = list(Resource.objects.order_by('pk').values_list('pk', flat=True))
+        stored = 0
+        for i in range(0, len(resource_ids), batch_size):
+            resources = Resource.objects.select_related('unit').filter(pk__in=resource_ids[i:i + batch_size])
+            stored += refresh_opening_hours(resources)
+
+        self.stdout.write("Stored %d days of opening hours for %d resources until %s" %
+                          (stored, len(resource_ids), window_end))
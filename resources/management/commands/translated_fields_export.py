@@ -17,7 +17,7 @@ import xlsxwriter
 
 def make_excel(data):
     """
-    Based on models.utils.generate_reservation_xlsx
+    Based on the reservation export in models.utils
 
     Data is a dict where key is the model's name and value is a list
     with first item the translated field names and second item list of instances
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0051_auto_20170509_0758'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningHours',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('opens', models.DateTimeField(blank=True, null=True, verbose_name='Time when opens')),
+                ('closes', models.DateTimeField(blank=True, null=True, verbose_name='Time when closes')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_opening_hours', to='resources.Resource', verbose_name='Resource')),
+            ],
+            options={
+                'verbose_name': 'opening hours',
+                'verbose_name_plural': 'opening hours',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='openinghours',
+            unique_together=set([('resource', 'date')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0052_openinghours'),
+    ]
+
+    operations = [
+        # Keyset pagination of reservation listings walks (begin, id)
+        migrations.RunSQL(
+            "CREATE INDEX resources_reservation_begin_id ON resources_reservation (\"begin\", id);",
+            "DROP INDEX resources_reservation_begin_id;"
+        ),
+    ]
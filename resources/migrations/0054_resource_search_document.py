@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0053_reservation_begin_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX resources_resource_search_document ON resources_resource USING gin (search_document);",
+            "DROP INDEX resources_resource_search_document;"
+        ),
+        # The search document as resources.models.search builds it at the time of this migration
+        migrations.RunSQL(
+            "UPDATE resources_resource SET search_document = "
+            "setweight(to_tsvector('finnish', coalesce(name_fi, '')), 'A') || "
+            "setweight(to_tsvector('finnish', coalesce((SELECT u.name_fi FROM resources_unit u WHERE u.id = resources_resource.unit_id), '')), 'B') || "
+            "setweight(to_tsvector('finnish', coalesce(description_fi, '')), 'C') || "
+            "setweight(to_tsvector('swedish', coalesce(name_sv, '')), 'A') || "
+            "setweight(to_tsvector('swedish', coalesce((SELECT u.name_sv FROM resources_unit u WHERE u.id = resources_resource.unit_id), '')), 'B') || "
+            "setweight(to_tsvector('swedish', coalesce(description_sv, '')), 'C') || "
+            "setweight(to_tsvector('english', coalesce(name_en, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce((SELECT u.name_en FROM resources_unit u WHERE u.id = resources_resource.unit_id), '')), 'B') || "
+            "setweight(to_tsvector('english', coalesce(description_en, '')), 'C');",
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -1,5 +1,8 @@
-from .availability import Day, Period, get_opening_hours  # noqa
+from .availability import Day, OpeningHours, Period, get_opening_hours, get_opening_hours_for_resources  # noqa
 from .reservation import ReservationMetadataField, ReservationMetadataSet, Reservation, RESERVATION_EXTRA_FIELDS  # noqa
-from .resource import Purpose, Resource, ResourceType, ResourceImage, ResourceEquipment, ResourceGroup, TermsOfUse  # noqa
+from .resource import Purpose, Resource, ResourceType, ResourceImage, ResourceEquipment, ResourceGroup, TermsOfUse, get_available_hours_for_resources  # noqa
 from .equipment import Equipment, EquipmentAlias, EquipmentCategory  # noqa
 from .unit import Unit, UnitIdentifier  # noqa
+from . import resource_cache  # noqa
+from . import search  # noqa
+from . import typeahead  # noqa
@@ -1,12 +1,20 @@
+import bisect
 import datetime
+import threading
+from contextlib import contextmanager
 
 import arrow
 import pytz
 import django.contrib.postgres.fields as pgfields
 import django.db.models as dbm
-from django.db.models import Q
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.gis.db import models
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.dateformat import time_format
 from django.utils.translation import ugettext_lazy as _
 from psycopg2.extras import DateRange, NumericRange
@@ -14,6 +22,11 @@ from psycopg2.extras import DateRange, NumericRange
 
 STATE_BOOLS = {False: _('open'), True: _('closed')}
 
+# Number of days ahead the daily opening hours of resources are kept in OpeningHours
+OPENING_HOURS_HORIZON = 400
+
+_opening_hours_refresh = threading.local()
+
 
 def combine_datetime(date, time, tz):
     return tz.localize(datetime.datetime.combine(date, time))
@@ -27,21 +40,7 @@ def datetime_to_date(dt, tz):
     return dt.date()
 
 
-def get_opening_hours(time_zone, periods, begin, end=None):
-    """
-    Returns opening and closing times for a given date range
-
-    Return value is a dict where keys are days on the range
-        and values are a list of Day objects for that day's active period
-        containing opening and closing hours
-
-    :rtype : dict[str, list[dict[str, datetime.datetime]]]
-    :type periods: list[Period]
-    :type begin: datetime.date | datetime.datetime
-    :type end: datetime.date | None
-    """
-
-    tz = pytz.timezone(time_zone)
+def _get_date_range(tz, begin, end):
     if begin is not None:
         if isinstance(begin, datetime.datetime):
             begin = datetime_to_date(begin, tz)
@@ -58,22 +57,14 @@ def get_opening_hours(time_zone, periods, begin, end=None):
         end = begin
 
     assert begin <= end
+    return begin, end
 
-    if begin == end:
-        d_range = DateRange(begin, end, '[]')
-    else:
-        d_range = DateRange(begin, end)
-
-    # Periods are taken into account the shortest first.
-    periods = periods.filter(duration__overlap=d_range)\
-        .annotate(length=dbm.F('end')-dbm.F('start'))\
-        .order_by('length')
-    days = Day.objects.filter(period__in=periods)
-
-    periods = list(periods)
-    for period in periods:
-        period.range_days = {day.weekday: day for day in days if day.period == period}
 
+def _get_dates(tz, periods, begin, end):
+    """
+    Resolve the opening hours of each date from periods sorted shortest first.
+    Every period must have its days as a weekday -> Day dict in `range_days`.
+    """
     date = begin
     dates = {}
     while date <= end:
@@ -99,6 +90,428 @@ def get_opening_hours(time_zone, periods, begin, end=None):
     return dates
 
 
+def get_opening_hours(time_zone, periods, begin, end=None):
+    """
+    Returns opening and closing times for a given date range
+
+    Return value is a dict where keys are days on the range
+        and values are a list of Day objects for that day's active period
+        containing opening and closing hours
+
+    :rtype : dict[str, list[dict[str, datetime.datetime]]]
+    :type periods: list[Period]
+    :type begin: datetime.date | datetime.datetime
+    :type end: datetime.date | None
+    """
+
+    tz = pytz.timezone(time_zone)
+    begin, end = _get_date_range(tz, begin, end)
+
+    if begin == end:
+        d_range = DateRange(begin, end, '[]')
+    else:
+        d_range = DateRange(begin, end)
+
+    # Periods are taken into account the shortest first.
+    periods = periods.filter(duration__overlap=d_range)\
+        .annotate(length=dbm.F('end')-dbm.F('start'))\
+        .order_by('length')
+    days = Day.objects.filter(period__in=periods)
+
+    periods = list(periods)
+    for period in periods:
+        period.range_days = {day.weekday: day for day in days if day.period == period}
+
+    return _get_dates(tz, periods, begin, end)
+
+
+def _select_periods(periods, begin, end):
+    """
+    Periods overlapping the date range, the shortest first.
+    """
+    # Match the overlap semantics of get_opening_hours: the range end is exclusive
+    # unless the range is a single day.
+    if begin == end:
+        periods = [period for period in periods if period.start <= end and period.end >= begin]
+    else:
+        periods = [period for period in periods if period.start < end and period.end >= begin]
+
+    # Periods are taken into account the shortest first.
+    periods.sort(key=lambda period: period.end - period.start)
+    return periods
+
+
+def resolve_opening_hours(time_zone, periods, begin, end=None):
+    """
+    Same as get_opening_hours, but resolved in memory from already fetched
+    periods that have their days prefetched. Doesn't run any queries.
+
+    :rtype : dict[str, list[dict[str, datetime.datetime]]]
+    :type periods: list[Period]
+    :type begin: datetime.date | datetime.datetime
+    :type end: datetime.date | None
+    """
+
+    tz = pytz.timezone(time_zone)
+    begin, end = _get_date_range(tz, begin, end)
+
+    periods = _select_periods(periods, begin, end)
+    for period in periods:
+        period.range_days = {day.weekday: day for day in period.days.all()}
+
+    return _get_dates(tz, periods, begin, end)
+
+
+def get_opening_hours_for_resources(resources, begin=None, end=None):
+    """
+    Batch version of Resource.get_opening_hours for many resources.
+
+    Opening hours are read from OpeningHours when the range is within its
+    horizon. The rest of the resources have the periods of the resources and
+    their units and the days of the periods loaded in two queries, and their
+    opening hours resolved in memory with the same shortest-period-wins rule.
+
+    Return value is a dict where keys are resource ids and values are
+    what Resource.get_opening_hours returns for that resource.
+
+    :rtype : dict[str, dict[datetime.date, list[dict[str, datetime.datetime]]]]
+    :type resources: list[resources.models.Resource]
+    :type begin: datetime.date | datetime.datetime
+    :type end: datetime.date | None
+    """
+    resources = list(resources)
+    opening_hours = get_materialized_opening_hours(resources, begin, end)
+    missing = [resource for resource in resources if resource.pk not in opening_hours]
+    if missing:
+        opening_hours.update(resolve_opening_hours_for_resources(missing, begin, end))
+    return opening_hours
+
+
+def resolve_opening_hours_for_resources(resources, begin=None, end=None):
+    """
+    Resolve the opening hours of the resources from their periods in two queries.
+    """
+    resources = list(resources)
+    if not resources:
+        return {}
+
+    date_ranges = {}
+    for resource in resources:
+        tz = pytz.timezone(resource.unit.time_zone)
+        date_ranges[resource.pk] = (tz,) + _get_date_range(tz, begin, end)
+    range_begin = min(date_range[1] for date_range in date_ranges.values())
+    range_end = max(date_range[2] for date_range in date_ranges.values())
+
+    # A resource uses its own periods if it has any at all, so all of them are needed
+    # to tell whether it has periods. Unit periods are only needed for the range.
+    resource_ids = [resource.pk for resource in resources]
+    unit_ids = {resource.unit_id for resource in resources}
+    periods = Period.objects.filter(
+        Q(resource__in=resource_ids) |
+        Q(unit__in=unit_ids, start__lte=range_end, end__gte=range_begin)
+    )
+
+    resource_periods = {}
+    unit_periods = {}
+    range_periods = []
+    for period in periods:
+        if period.resource_id:
+            resource_periods.setdefault(period.resource_id, []).append(period)
+        else:
+            unit_periods.setdefault(period.unit_id, []).append(period)
+        if period.start <= range_end and period.end >= range_begin:
+            range_periods.append(period)
+
+    days = {}
+    for day in Day.objects.filter(period__in=[period.pk for period in range_periods]):
+        days.setdefault(day.period_id, {})[day.weekday] = day
+    for period in range_periods:
+        period.range_days = days.get(period.pk, {})
+
+    opening_hours = {}
+    for resource in resources:
+        tz, resource_begin, resource_end = date_ranges[resource.pk]
+        periods = resource_periods.get(resource.pk) or unit_periods.get(resource.unit_id, [])
+        periods = _select_periods(periods, resource_begin, resource_end)
+        opening_hours[resource.pk] = _get_dates(tz, periods, resource_begin, resource_end)
+    return opening_hours
+
+
+def get_opening_hours_window():
+    """
+    First and last date of the daily opening hours kept in OpeningHours.
+    """
+    # A day of slack keeps today covered in every time zone
+    today = timezone.now().date()
+    return today - datetime.timedelta(days=1), today + datetime.timedelta(days=OPENING_HOURS_HORIZON)
+
+
+def get_materialized_opening_hours(resources, begin=None, end=None):
+    """
+    Opening hours of the resources read from OpeningHours in one query.
+
+    Only resources that have every date of the range stored are returned,
+    the rest have to be resolved from their periods.
+
+    :rtype : dict[str, dict[datetime.date, list[dict[str, datetime.datetime]]]]
+    :type resources: list[resources.models.Resource]
+    :type begin: datetime.date | datetime.datetime
+    :type end: datetime.date | None
+    """
+    window_begin, window_end = get_opening_hours_window()
+    date_ranges = {}
+    for resource in resources:
+        if not resource.unit_id:
+            continue
+        tz = pytz.timezone(resource.unit.time_zone)
+        resource_begin, resource_end = _get_date_range(tz, begin, end)
+        if resource_begin >= window_begin and resource_end <= window_end:
+            date_ranges[resource.pk] = (tz, resource_begin, resource_end)
+    if not date_ranges:
+        return {}
+
+    rows = OpeningHours.objects.filter(
+        resource__in=list(date_ranges.keys()),
+        date__gte=min(date_range[1] for date_range in date_ranges.values()),
+        date__lte=max(date_range[2] for date_range in date_ranges.values()),
+    )
+    dates = {resource_id: {} for resource_id in date_ranges}
+    for row in rows:
+        tz, resource_begin, resource_end = date_ranges[row.resource_id]
+        if resource_begin <= row.date <= resource_end:
+            dates[row.resource_id][row.date] = [{
+                'opens': row.opens.astimezone(tz) if row.opens else None,
+                'closes': row.closes.astimezone(tz) if row.closes else None,
+            }]
+
+    opening_hours = {}
+    for resource_id, (tz, resource_begin, resource_end) in date_ranges.items():
+        if len(dates[resource_id]) == (resource_end - resource_begin).days + 1:
+            opening_hours[resource_id] = dates[resource_id]
+    return opening_hours
+
+
+def filter_open_resources(queryset, start, end):
+    """
+    Leave out the resources whose stored opening hours show them closed for the
+    whole time between start and end. Resources that don't have every date of the
+    range stored are kept, as their opening hours are resolved from their periods.
+
+    :type start: datetime.datetime
+    :type end: datetime.datetime
+    """
+    # A day of slack covers the dates of the range in every time zone
+    first = start.date() - datetime.timedelta(days=1)
+    last = end.date() + datetime.timedelta(days=1)
+    rows = OpeningHours.objects.filter(date__gte=first, date__lte=last)
+    open_ids = rows.filter(opens__lt=end, closes__gt=start).values('resource')
+    stored_ids = rows.values('resource').annotate(days=Count('id')).filter(days=(last - first).days + 1).values('resource')
+    return queryset.filter(Q(pk__in=open_ids) | ~Q(pk__in=stored_ids))
+
+
+def refresh_opening_hours(resources, begin=None, end=None):
+    """
+    Recompute the stored daily opening hours of the resources between begin
+    and end, or all of them if no range is given.
+
+    Stored days of the range outside the horizon are dropped, so a range
+    always either reads the current periods or up to date OpeningHours.
+
+    :type resources: list[resources.models.Resource]
+    :type begin: datetime.date | None
+    :type end: datetime.date | None
+    :return: number of days stored
+    :rtype: int
+    """
+    resources = list(resources)
+    rows = OpeningHours.objects.filter(resource__in=[resource.pk for resource in resources])
+    if begin is not None:
+        rows = rows.filter(date__gte=begin)
+    if end is not None:
+        rows = rows.filter(date__lte=end)
+
+    window_begin, window_end = get_opening_hours_window()
+    begin = max(begin, window_begin) if begin is not None else window_begin
+    end = min(end, window_end) if end is not None else window_end
+    resources = [resource for resource in resources if resource.unit_id]
+
+    new_rows = []
+    if resources and begin <= end:
+        opening_hours = resolve_opening_hours_for_resources(resources, begin, end)
+        for resource_id, dates in opening_hours.items():
+            for date, hours in dates.items():
+                new_rows.append(OpeningHours(resource_id=resource_id, date=date,
+                                             opens=hours[0]['opens'], closes=hours[0]['closes']))
+
+    with transaction.atomic():
+        rows.delete()
+        OpeningHours.objects.bulk_create(new_rows, batch_size=1000)
+    return len(new_rows)
+
+
+def _refresh_opening_hours_of(target, date_range):
+    Resource = apps.get_model('resources', 'Resource')
+    kind, pk = target
+    resources = Resource.objects.select_related('unit')
+    if kind == 'unit':
+        resources = resources.filter(unit=pk)
+    else:
+        resources = resources.filter(pk=pk)
+    refresh_opening_hours(resources, *(date_range or (None, None)))
+
+
+def _merge_opening_hours_refresh(pending, target, date_range):
+    if target in pending:
+        previous = pending[target]
+        if previous is None or date_range is None:
+            date_range = None
+        else:
+            date_range = (min(previous[0], date_range[0]), max(previous[1], date_range[1]))
+    pending[target] = date_range
+
+
+def _run_committed_opening_hours_refreshes():
+    pending = getattr(_opening_hours_refresh, 'committed', None)
+    _opening_hours_refresh.committed = None
+    # Every refresh of the transaction registered this, the first call runs them all
+    for target, date_range in (pending or {}).items():
+        _refresh_opening_hours_of(target, date_range)
+
+
+def schedule_opening_hours_refresh(resource_id=None, unit_id=None, begin=None, end=None):
+    """
+    Refresh the stored opening hours of a resource or all resources of a unit.
+
+    Inside deferred_opening_hours_refresh() the refresh is postponed to the
+    end of the block, and inside a transaction to its commit, and merged with
+    the other refreshes of the same target. Saving the days of a period one by
+    one in a request thus refreshes the period once.
+    """
+    if resource_id:
+        target = ('resource', resource_id)
+    elif unit_id:
+        target = ('unit', unit_id)
+    else:
+        return
+    date_range = (begin, end) if begin is not None and end is not None else None
+
+    pending = getattr(_opening_hours_refresh, 'pending', None)
+    if pending is not None:
+        _merge_opening_hours_refresh(pending, target, date_range)
+        return
+    if not transaction.get_connection().in_atomic_block:
+        _refresh_opening_hours_of(target, date_range)
+        return
+
+    committed = getattr(_opening_hours_refresh, 'committed', None)
+    if committed is None:
+        committed = _opening_hours_refresh.committed = {}
+    _merge_opening_hours_refresh(committed, target, date_range)
+    transaction.on_commit(_run_committed_opening_hours_refreshes)
+
+
+@contextmanager
+def deferred_opening_hours_refresh():
+    """
+    Run the opening hours refreshes requested inside the block once at its end,
+    e.g. when a period and all of its days are saved together.
+    """
+    if getattr(_opening_hours_refresh, 'pending', None) is not None:
+        yield
+        return
+
+    _opening_hours_refresh.pending = pending = {}
+    try:
+        yield
+    finally:
+        _opening_hours_refresh.pending = None
+    for target, date_range in pending.items():
+        _refresh_opening_hours_of(target, date_range)
+
+
+def get_available_hours_range(start=None, end=None):
+    """
+    Defaults and localization of the range of Resource.get_available_hours.
+    """
+    today = arrow.get(timezone.now())
+    if start is None:
+        start = today.floor('day').naive
+    if end is None:
+        end = today.replace(days=+1).floor('day').naive
+    if not start.tzinfo and not end.tzinfo:
+        # Only try to localize naive dates
+        tz = timezone.get_current_timezone()
+        start = tz.localize(start)
+        end = tz.localize(end)
+    return start, end
+
+
+def get_free_hours(start, end, reservations, begins, duration=None, reservation=None):
+    """
+    Sweep the reservations of a resource to find its free hours between start and end.
+
+    Reservations must be sorted by begin and `begins` must be the list of their
+    begin times. The reservations that start after `end` are cut off with a
+    binary search, so one sorted list can serve every opening period of a range.
+
+    :rtype: list[dict[str, datetime.datetime]]
+    :type reservations: list[Reservation]
+    :type begins: list[datetime.datetime]
+    :type duration: datetime.timedelta
+    :type reservation: Reservation
+    """
+    hours_list = [({'starts': start})]
+    first_checked = False
+    for res in reservations[:bisect.bisect_right(begins, end)]:
+        if res.end < start:
+            continue
+        # skip the reservation that is being edited
+        if res == reservation:
+            continue
+        # check if the reservation spans the beginning
+        if not first_checked:
+            first_checked = True
+            if res.begin < start:
+                if res.end > end:
+                    return []
+                hours_list[0]['starts'] = res.end
+                # proceed to the next reservation
+                continue
+        if duration:
+            if res.begin - hours_list[-1]['starts'] < duration:
+                # the free period is too short, discard this period
+                hours_list[-1]['starts'] = res.end
+                continue
+        hours_list[-1]['ends'] = timezone.localtime(res.begin)
+        # check if the reservation spans the end
+        if res.end > end:
+            return hours_list
+        hours_list.append({'starts': timezone.localtime(res.end)})
+    # after the last reservation, we must check if the remaining free period is too short
+    if duration:
+        if end - hours_list[-1]['starts'] < duration:
+            hours_list.pop()
+            return hours_list
+    # otherwise add the remaining free period
+    hours_list[-1]['ends'] = end
+    return hours_list
+
+
+def get_open_free_hours(opening_hours, start, end, reservations, begins, duration=None, reservation=None):
+    """
+    Free hours within the opening hours returned by get_opening_hours.
+    """
+    hours_list = []
+    for date, open_during_date in opening_hours.items():
+        for period in open_during_date:
+            if period['opens']:
+                # if the start or end straddle opening hours
+                opens = period['opens'] if period['opens'] > start else start
+                closes = period['closes'] if period['closes'] < end else end
+                hours_list.extend(get_free_hours(opens, closes, reservations, begins, duration, reservation))
+    return hours_list
+
+
 class Period(models.Model):
     """
     A period of time to express state of open or closed
@@ -119,10 +532,19 @@ class Period(models.Model):
                                    blank=True, max_length=500)
     closed = models.BooleanField(verbose_name=_('Closed'), default=False, editable=False)
 
+    # Resource and unit ids as they were loaded from the database, see refresh_period_opening_hours
+    _loaded_owner = None
+
     class Meta:
         verbose_name = _("period")
         verbose_name_plural = _("periods")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Period, cls).from_db(db, field_names, values)
+        instance._loaded_owner = (instance.__dict__.get('resource_id'), instance.__dict__.get('unit_id'))
+        return instance
+
     def __str__(self):
         # FIXME: output date in locale-specific format
         return "{0}, {3}: {1:%d.%m.%Y} - {2:%d.%m.%Y}".format(self.name, self.start, self.end, STATE_BOOLS[self.closed])
@@ -159,6 +581,11 @@ class Period(models.Model):
 
         return super(Period, self).save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        # Deleting the days of the period refreshes the opening hours too, once is enough
+        with deferred_opening_hours_refresh():
+            return super(Period, self).delete(*args, **kwargs)
+
     def save_closedness(self):
         """
         Recalculate and save the `closed`ness state for the day.
@@ -217,3 +644,54 @@ class Day(models.Model):
                 closes = int(self.closes.replace(":", ""))
             self.length = NumericRange(opens, closes)
         return super(Day, self).save(*args, **kwargs)
+
+
+class OpeningHours(models.Model):
+    """
+    Effective opening hours of a resource on a date, resolved from its or its unit's periods
+
+    Kept up to date by saving periods and days for OPENING_HOURS_HORIZON days ahead,
+    so reading opening hours is a lookup instead of resolving the periods every time.
+    Dates with no row are resolved from the periods.
+    """
+    resource = models.ForeignKey('Resource', verbose_name=_('Resource'), related_name='daily_opening_hours',
+                                 on_delete=models.CASCADE)
+    date = models.DateField(verbose_name=_('Date'))
+    opens = models.DateTimeField(verbose_name=_('Time when opens'), null=True, blank=True)
+    closes = models.DateTimeField(verbose_name=_('Time when closes'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("opening hours")
+        verbose_name_plural = _("opening hours")
+        unique_together = (('resource', 'date'),)
+
+    def __str__(self):
+        return "{0}: {1}".format(self.resource_id, self.date)
+
+
+@receiver(post_save, sender=Period)
+def refresh_period_opening_hours(sender, instance, update_fields=None, **kwargs):
+    loaded_owner = instance._loaded_owner
+    instance._loaded_owner = (instance.resource_id, instance.unit_id)
+    # The closed flag doesn't affect opening hours
+    if update_fields and set(update_fields) <= {'closed'}:
+        return
+    # Adding or removing the periods of a resource switches it between its own and its unit's
+    # periods for every date, so the whole horizon is refreshed. A period moved to another
+    # resource or unit is removed from the old one.
+    if loaded_owner is not None and loaded_owner != instance._loaded_owner:
+        schedule_opening_hours_refresh(*loaded_owner)
+    schedule_opening_hours_refresh(instance.resource_id, instance.unit_id)
+
+
+@receiver(post_delete, sender=Period)
+def refresh_deleted_period_opening_hours(sender, instance, **kwargs):
+    schedule_opening_hours_refresh(instance.resource_id, instance.unit_id)
+
+
+@receiver(post_save, sender=Day)
+@receiver(post_delete, sender=Day)
+def refresh_day_opening_hours(sender, instance, **kwargs):
+    period = Period.objects.filter(pk=instance.period_id).first()
+    if period:
+        schedule_opening_hours_refresh(period.resource_id, period.unit_id, period.start, period.end)
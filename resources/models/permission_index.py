@@ -0,0 +1,145 @@
+"""
+Index of the unit level object permissions of users
+
+Answers the same questions as user.has_perm(perm, unit) with django-guardian,
+but loads all unit permissions of a user at once instead of querying them for
+every object. The index lives on the user instance, so with a user loaded per
+request it's built once per request. The loaded permissions are also kept in
+the Django cache, so that clients making many requests with the same token
+don't load them again on every request. Permission changes bump a version
+number in the cache, so the cache must be shared by all processes. The version
+is bumped again after the commit, as another process may have cached the old
+permissions in between.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from .unit import Unit
+
+UNIT_PERMISSION_CACHE_VERSION_KEY = 'resources:unit_permission_version'
+UNIT_PERMISSION_CACHE_TIMEOUT = 5 * 60
+
+# Bumped on every permission change in this process, so that indexes built before it are reloaded
+_generation = [0]
+
+
+def get_unit_permission_cache_version():
+    version = cache.get(UNIT_PERMISSION_CACHE_VERSION_KEY)
+    if version is None:
+        cache.add(UNIT_PERMISSION_CACHE_VERSION_KEY, int(time.time()), None)
+        version = cache.get(UNIT_PERMISSION_CACHE_VERSION_KEY, int(time.time()))
+    return version
+
+
+def bump_unit_permission_cache_version():
+    try:
+        cache.incr(UNIT_PERMISSION_CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(UNIT_PERMISSION_CACHE_VERSION_KEY, int(time.time()), None)
+
+
+def load_unit_perms(user):
+    """
+    Unit permission codenames of the user and the groups of the user, by unit id.
+
+    :rtype: dict[str, set[str]]
+    """
+    key = 'resources:unit_permissions:%s:%s' % (get_unit_permission_cache_version(), user.pk)
+    perms = cache.get(key)
+    if perms is not None:
+        return perms
+
+    content_type = ContentType.objects.get_for_model(Unit)
+    user_perms = UserObjectPermission.objects.filter(user=user, content_type=content_type)
+    group_perms = GroupObjectPermission.objects.filter(group__user=user, content_type=content_type)
+    perms = {}
+    for queryset in (user_perms, group_perms):
+        for unit_id, codename in queryset.values_list('object_pk', 'permission__codename'):
+            perms.setdefault(unit_id, set()).add(codename)
+
+    cache.set(key, perms, UNIT_PERMISSION_CACHE_TIMEOUT)
+    return perms
+
+
+class UnitPermissionIndex(object):
+    def __init__(self, user):
+        self.user = user
+        self.generation = _generation[0]
+        self._perms = None
+
+    def get_perms(self):
+        if self._perms is None:
+            self._perms = load_unit_perms(self.user)
+        return self._perms
+
+    def has_perm(self, perm, unit_id):
+        """
+        Same as user.has_perm(perm, unit) for a unit with the given id.
+        """
+        if not self.user.is_active:
+            return False
+        if self.user.is_superuser:
+            return True
+        return perm.split('.')[-1] in self.get_perms().get(unit_id, ())
+
+    def get_unit_ids(self, perm):
+        """
+        Ids of the units the user has the permission for, or None for all units.
+        Like guardian's get_objects_for_user, a global permission applies to all units.
+
+        :rtype: set[str] | None
+        """
+        codename = perm.split('.')[-1]
+        if not self.user.is_active:
+            return set()
+        if self.user.is_superuser or self.user.has_perm('resources.%s' % codename):
+            return None
+        return {unit_id for unit_id, codenames in self.get_perms().items() if codename in codenames}
+
+
+def get_unit_permission_index(user):
+    """
+    :rtype: UnitPermissionIndex
+    """
+    index = getattr(user, '_unit_permission_index', None)
+    if index is None or index.generation != _generation[0]:
+        index = user._unit_permission_index = UnitPermissionIndex(user)
+    return index
+
+
+def get_users_with_unit_perm(unit, perm):
+    """
+    Active users who have the permission for the unit either directly or through a group.
+    """
+    codename = perm.split('.')[-1]
+    content_type = ContentType.objects.get_for_model(Unit)
+    user_ids = UserObjectPermission.objects.filter(
+        content_type=content_type, object_pk=unit.pk, permission__codename=codename).values('user_id')
+    group_ids = GroupObjectPermission.objects.filter(
+        content_type=content_type, object_pk=unit.pk, permission__codename=codename).values('group_id')
+    return get_user_model().objects.filter(Q(id__in=user_ids) | Q(groups__in=group_ids), is_active=True).distinct()
+
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def invalidate_unit_permissions(sender, **kwargs):
+    _generation[0] += 1
+    bump_unit_permission_cache_version()
+    transaction.on_commit(bump_unit_permission_cache_version)
+
+
+@receiver(m2m_changed)
+def invalidate_group_permissions(sender, **kwargs):
+    # The user model may not be loaded yet when this module is, so groups are checked here
+    if sender is get_user_model().groups.through:
+        invalidate_unit_permissions(sender)
@@ -7,9 +7,9 @@ from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 from psycopg2.extras import DateTimeTZRange
 
-from guardian.shortcuts import get_users_with_perms
 
 from .base import ModifiableModel
+from .permission_index import get_users_with_unit_perm
 from .resource import Resource, generate_access_code, validate_access_code
 from .utils import get_dt, save_dt, is_valid_time_slot, humanize_duration, send_respa_mail, DEFAULT_LANG
 
@@ -213,10 +213,8 @@ class Reservation(ModifiableModel):
         self.send_reservation_mail(_("You've made a preliminary reservation"), 'reservation_requested')
 
     def send_reservation_requested_mail_to_officials(self):
-        unit = self.resource.unit
-        for user in get_users_with_perms(unit):
-            if user.has_perm('can_approve_reservation', unit):
-                self.send_reservation_mail(_('Reservation requested'), 'reservation_requested_official', user=user)
+        for user in get_users_with_unit_perm(self.resource.unit, 'can_approve_reservation'):
+            self.send_reservation_mail(_('Reservation requested'), 'reservation_requested_official', user=user)
 
     def send_reservation_denied_mail(self):
         self.send_reservation_mail(_('Reservation denied'), 'reservation_denied')
@@ -233,6 +231,11 @@ class Reservation(ModifiableModel):
     def save(self, *args, **kwargs):
         self.duration = DateTimeTZRange(self.begin, self.end, '[)')
 
+        # The iCal feeds of users are validated with this
+        self.modified_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'modified_at'}
+
         access_code_type = self.resource.access_code_type
         if not self.resource.is_access_code_enabled():
             self.access_code = ''
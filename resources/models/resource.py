@@ -3,7 +3,6 @@ import os
 import re
 from decimal import Decimal
 
-import arrow
 import django.db.models as dbm
 from django.apps import apps
 from django.conf import settings
@@ -17,6 +16,8 @@ from django.utils.six import BytesIO
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import pgettext_lazy
 from django.contrib.postgres.fields import HStoreField
+from django.contrib.postgres.search import SearchVectorField
+from easy_thumbnails.files import get_thumbnailer
 from image_cropping import ImageRatioField
 from PIL import Image
 from autoslug import AutoSlugField
@@ -26,7 +27,10 @@ from resources.errors import InvalidImage
 from .base import AutoIdentifiedModel, NameIdentifiedModel, ModifiableModel
 from .utils import create_reservable_before_datetime, get_translated, get_translated_name, humanize_duration
 from .equipment import Equipment
-from .availability import get_opening_hours
+from .permission_index import get_unit_permission_index
+from .availability import (get_opening_hours, get_opening_hours_for_resources, resolve_opening_hours,
+                           get_available_hours_range, get_free_hours, get_open_free_hours,
+                           get_materialized_opening_hours, schedule_opening_hours_refresh)
 
 
 def generate_access_code(access_code_type):
@@ -149,6 +153,9 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
                                                                   null=True, blank=True)
     reservation_metadata_set = models.ForeignKey('resources.ReservationMetadataSet', null=True, blank=True)
 
+    # Maintained in the database by resources.models.search
+    search_document = SearchVectorField(null=True, editable=False)
+
     class Meta:
         verbose_name = _("resource")
         verbose_name_plural = _("resources")
@@ -156,6 +163,27 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
     def __str__(self):
         return "%s (%s)/%s" % (get_translated(self, 'name'), self.id, self.unit)
 
+    # Unit id as it was loaded from the database, see save()
+    _loaded_unit_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Resource, cls).from_db(db, field_names, values)
+        instance._loaded_unit_id = instance.__dict__.get('unit_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Stored opening hours of a resource follow its unit's periods
+        unit_changed = not self._state.adding and self._loaded_unit_id != self.unit_id
+        # The iCal feeds of users are validated with this
+        self.modified_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'modified_at'}
+        super(Resource, self).save(*args, **kwargs)
+        self._loaded_unit_id = self.unit_id
+        if unit_changed:
+            schedule_opening_hours_refresh(resource_id=self.pk)
+
     def validate_reservation_period(self, reservation, user, data=None):
         """
         Check that given reservation if valid for given user.
@@ -253,74 +281,18 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         :type reservation: Reservation
         :type during_closing: bool
         """
-        today = arrow.get(timezone.now())
-        if start is None:
-            start = today.floor('day').naive
-        if end is None:
-            end = today.replace(days=+1).floor('day').naive
-        if not start.tzinfo and not end.tzinfo:
-            """
-            Only try to localize naive dates
-            """
-            tz = timezone.get_current_timezone()
-            start = tz.localize(start)
-            end = tz.localize(end)
-
+        start, end = get_available_hours_range(start, end)
+        opening_hours = None
         if not during_closing:
-            """
-            Check open hours only
-            """
-            open_hours = self.get_opening_hours(start, end)
-            hours_list = []
-            for date, open_during_date in open_hours.items():
-                for period in open_during_date:
-                    if period['opens']:
-                        # if the start or end straddle opening hours
-                        opens = period['opens'] if period['opens'] > start else start
-                        closes = period['closes'] if period['closes'] < end else end
-                        # include_closed to prevent recursion, opening hours need not be rechecked
-                        hours_list.extend(self.get_available_hours(start=opens,
-                                                                   end=closes,
-                                                                   duration=duration,
-                                                                   reservation=reservation,
-                                                                   during_closing=True))
-            return hours_list
-
-        reservations = self.reservations.filter(
-            end__gte=start, begin__lte=end).order_by('begin')
-        hours_list = [({'starts': start})]
-        first_checked = False
-        for res in reservations:
-            # skip the reservation that is being edited
-            if res == reservation:
-                continue
-            # check if the reservation spans the beginning
-            if not first_checked:
-                first_checked = True
-                if res.begin < start:
-                    if res.end > end:
-                        return []
-                    hours_list[0]['starts'] = res.end
-                    # proceed to the next reservation
-                    continue
-            if duration:
-                if res.begin - hours_list[-1]['starts'] < duration:
-                    # the free period is too short, discard this period
-                    hours_list[-1]['starts'] = res.end
-                    continue
-            hours_list[-1]['ends'] = timezone.localtime(res.begin)
-            # check if the reservation spans the end
-            if res.end > end:
-                return hours_list
-            hours_list.append({'starts': timezone.localtime(res.end)})
-        # after the last reservation, we must check if the remaining free period is too short
-        if duration:
-            if end - hours_list[-1]['starts'] < duration:
-                hours_list.pop()
-                return hours_list
-        # otherwise add the remaining free period
-        hours_list[-1]['ends'] = end
-        return hours_list
+            opening_hours = self.get_opening_hours(start, end)
+
+        reservations = list(self.reservations.filter(end__gte=start, begin__lte=end).order_by('begin'))
+        begins = [res.begin for res in reservations]
+
+        if during_closing:
+            return get_free_hours(start, end, reservations, begins, duration, reservation)
+        # Check open hours only
+        return get_open_free_hours(opening_hours, start, end, reservations, begins, duration, reservation)
 
     def get_opening_hours(self, begin=None, end=None):
         """
@@ -328,6 +300,15 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         :type begin: datetime.date
         :type end: datetime.date
         """
+        if 'periods' in getattr(self, '_prefetched_objects_cache', {}):
+            # Periods and their days have been prefetched, so there's no need to query them again
+            periods = list(self.periods.all()) or list(self.unit.periods.all())
+            return resolve_opening_hours(self.unit.time_zone, periods, begin, end)
+
+        opening_hours = get_materialized_opening_hours([self], begin, end).get(self.pk)
+        if opening_hours is not None:
+            return opening_hours
+
         if self.periods.exists():
             periods = self.periods
         else:
@@ -341,7 +322,7 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         and ends on closing time
 
         If no periods and days that contain given datetime are not found,
-        returns none both
+        or the day is closed, returns none both
 
         :rtype : dict[str, datetime.datetime]
         :type dt: datetime.datetime
@@ -349,6 +330,13 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
 
         date, weekday, moment = dt.date(), dt.weekday(), dt.time()
 
+        opening_hours = get_materialized_opening_hours([self], date, date).get(self.pk)
+        if opening_hours is not None:
+            hours = opening_hours[date][0]
+            if hours['opens'] and hours['opens'].time() <= moment <= hours['closes'].time():
+                return {'opens': moment, 'closes': dt.combine(dt, hours['closes'].time())}
+            return {'opens': None, 'closes': None}
+
         if self.periods.exists():
             periods = self.periods
         else:
@@ -360,7 +348,7 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         ).order_by('length').first()
 
         if res:
-            day = res.days.filter(weekday=weekday, opens__lte=moment, closes__gte=moment).first()
+            day = res.days.filter(weekday=weekday, opens__lte=moment, closes__gte=moment).exclude(closed=True).first()
             if day:
                 closes = dt.combine(dt, day.closes)
                 return {'opens': moment, 'closes': closes}
@@ -371,21 +359,23 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         # Currently all staff members are allowed to administrate
         # all resources. Will be more finegrained in the future.
         #
-        # UserFilterBackend in resources.api.reservation assumes the same behaviour,
-        # so if this is changed that needs to be changed as well.
+        # UserFilterBackend and the reservation export in resources.api.reservation
+        # assume the same behaviour, so if this is changed they need to be changed as well.
         return user.is_staff
 
     def can_make_reservations(self, user):
         return self.is_admin(user) or self.reservable
 
     def can_approve_reservations(self, user):
-        return self.is_admin(user) and user.has_perm('can_approve_reservation', self.unit)
+        return self.is_admin(user) and \
+            get_unit_permission_index(user).has_perm('can_approve_reservation', self.unit_id)
 
     def is_access_code_enabled(self):
         return self.access_code_type != Resource.ACCESS_CODE_TYPE_NONE
 
     def can_view_access_codes(self, user):
-        return self.is_admin(user) or user.has_perm('can_view_reservation_access_code', self.unit)
+        return self.is_admin(user) or \
+            get_unit_permission_index(user).has_perm('can_view_reservation_access_code', self.unit_id)
 
     def get_reservable_days_in_advance(self):
         return self.reservable_days_in_advance or self.unit.reservable_days_in_advance
@@ -396,12 +386,12 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
     def get_supported_reservation_extra_field_names(self):
         if not self.reservation_metadata_set:
             return []
-        return self.reservation_metadata_set.supported_fields.values_list('field_name', flat=True)
+        return [field.field_name for field in self.reservation_metadata_set.supported_fields.all()]
 
     def get_required_reservation_extra_field_names(self):
         if not self.reservation_metadata_set:
             return []
-        return self.reservation_metadata_set.required_fields.values_list('field_name', flat=True)
+        return [field.field_name for field in self.reservation_metadata_set.required_fields.all()]
 
     def clean(self):
         if self.min_price_per_hour is not None and self.max_price_per_hour is not None:
@@ -411,6 +401,56 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
                 )
 
 
+def get_available_hours_for_resources(resources, start=None, end=None, duration=None, reservation=None,
+                                      during_closing=False, opening_hours=None):
+    """
+    Batch version of Resource.get_available_hours for many resources.
+
+    The reservations of all the resources are fetched in one ordered query and
+    swept per resource, and opening hours are resolved in one batch unless they
+    are given in `opening_hours`. Returns a dict of resource id -> the list
+    Resource.get_available_hours returns for that resource.
+
+    :rtype: dict[str, list[dict[str, datetime.datetime]]]
+    :type resources: list[Resource]
+    :type opening_hours: dict[str, dict] | None
+    """
+    resources = list(resources)
+    start, end = get_available_hours_range(start, end)
+    if not during_closing and opening_hours is None:
+        opening_hours = get_opening_hours_for_resources(resources, start, end)
+
+    reservations = {resource.pk: [] for resource in resources}
+    Reservation = apps.get_model('resources', 'Reservation')
+    queryset = Reservation.objects.filter(resource__in=list(reservations.keys()), end__gte=start, begin__lte=end)
+    for res in queryset.order_by('begin'):
+        reservations[res.resource_id].append(res)
+
+    available_hours = {}
+    for resource in resources:
+        resource_reservations = reservations[resource.pk]
+        begins = [res.begin for res in resource_reservations]
+        if during_closing:
+            available_hours[resource.pk] = get_free_hours(start, end, resource_reservations, begins,
+                                                          duration, reservation)
+        else:
+            available_hours[resource.pk] = get_open_free_hours(opening_hours[resource.pk], start, end,
+                                                               resource_reservations, begins, duration, reservation)
+    return available_hours
+
+
+# Sizes images are served in, requested sizes are snapped to one of these
+DEFAULT_IMAGE_RENDITION_SIZES = ((60, 60), (120, 120), (240, 240), (480, 480), (800, 800))
+
+
+def get_image_rendition_sizes():
+    """
+    :rtype: list[tuple[int, int]]
+    """
+    return sorted(tuple(size) for size in getattr(settings, 'RESPA_IMAGE_RENDITION_SIZES',
+                                                  DEFAULT_IMAGE_RENDITION_SIZES))
+
+
 class ResourceImage(ModifiableModel):
     TYPES = (
         ('main', _('Main photo')),
@@ -428,6 +468,26 @@ class ResourceImage(ModifiableModel):
     cropping = ImageRatioField('image', '800x800', verbose_name=_('Cropping'))
     sort_order = models.PositiveSmallIntegerField(verbose_name=_('Sort order'))
 
+    # Image and cropping as they were loaded from the database, None for a new image
+    _rendition_source = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ResourceImage, cls).from_db(db, field_names, values)
+        if 'image' in field_names and 'cropping' in field_names:
+            instance._rendition_source = instance.get_rendition_source()
+        return instance
+
+    def get_rendition_source(self):
+        return (self.image.name, self.cropping)
+
+    def are_renditions_outdated(self):
+        """
+        Whether the image or its cropping has changed since the image was loaded.
+        The post_save receivers still see the state from before the save.
+        """
+        return self._rendition_source != self.get_rendition_source()
+
     def save(self, *args, **kwargs):
         self._process_image()
         if self.sort_order is None:
@@ -444,13 +504,33 @@ class ResourceImage(ModifiableModel):
                 # lead to a more awkward API experience (having to first patch other
                 # images for the resource, then fix the last one).
                 other_main_images.update(type="other")
-        return super(ResourceImage, self).save(*args, **kwargs)
+        super(ResourceImage, self).save(*args, **kwargs)
+        self._rendition_source = self.get_rendition_source()
 
     def full_clean(self, exclude=(), validate_unique=True):
         if "image" not in exclude:
             self._process_image()
         return super(ResourceImage, self).full_clean(exclude, validate_unique)
 
+    def get_rendition(self, size, generate=True):
+        """
+        Thumbnail of the cropped image in the given size. Renditions are stored
+        by easy-thumbnails, so they are generated only once.
+
+        :param generate: Generate the rendition if it doesn't exist, otherwise return None
+        :rtype: easy_thumbnails.files.ThumbnailFile | None
+        """
+        return get_thumbnailer(self.image).get_thumbnail({
+            'size': size,
+            'box': self.cropping,
+            'crop': True,
+            'detail': True,
+        }, generate=generate)
+
+    def generate_renditions(self):
+        for size in get_image_rendition_sizes():
+            self.get_rendition(size)
+
     def _process_image(self):
         """
         Preprocess the uploaded image file, if required.
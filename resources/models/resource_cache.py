@@ -0,0 +1,85 @@
+"""
+Versioned cache for data derived from resources and the models they refer to
+
+Every key carries a version number. Saving a resource drops its own key, and
+saving any of the shared models bumps the version, which invalidates all keys
+at once without having to know which resources refer to the saved object.
+The version lives in the cache, so the cache must be shared by all processes.
+
+Keys are dropped both right away, for the rest of the saving transaction, and
+again after the commit, as another process may have cached the old data in
+between.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .equipment import Equipment, EquipmentAlias, EquipmentCategory
+from .reservation import ReservationMetadataField, ReservationMetadataSet
+from .resource import Resource, ResourceEquipment
+
+RESOURCE_CACHE_VERSION_KEY = 'resources:resource_cache_version'
+RESOURCE_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def get_resource_cache_version():
+    version = cache.get(RESOURCE_CACHE_VERSION_KEY)
+    if version is None:
+        # Start from the current time so that an evicted version never brings back old keys
+        cache.add(RESOURCE_CACHE_VERSION_KEY, int(time.time()), None)
+        version = cache.get(RESOURCE_CACHE_VERSION_KEY, int(time.time()))
+    return version
+
+
+def get_resource_cache_keys(resource_ids):
+    """
+    :rtype: dict[str, str]
+    """
+    version = get_resource_cache_version()
+    return {resource_id: 'resources:resource:%s:%s' % (version, resource_id) for resource_id in resource_ids}
+
+
+def drop_resource_cache(resource_id=None):
+    if resource_id is not None:
+        cache.delete_many(list(get_resource_cache_keys([resource_id]).values()))
+        return
+    try:
+        cache.incr(RESOURCE_CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(RESOURCE_CACHE_VERSION_KEY, int(time.time()), None)
+
+
+def invalidate_resource_cache(resource_id=None):
+    """
+    Drop the cached data of a resource, or of all resources if none is given.
+    """
+    drop_resource_cache(resource_id)
+    transaction.on_commit(lambda: drop_resource_cache(resource_id))
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def invalidate_resource(sender, instance, **kwargs):
+    invalidate_resource_cache(instance.pk)
+
+
+# Equipment can also be moved from one resource to another
+@receiver(post_save, sender=ResourceEquipment)
+@receiver(post_delete, sender=ResourceEquipment)
+@receiver(post_save, sender=Equipment)
+@receiver(post_delete, sender=Equipment)
+@receiver(post_save, sender=EquipmentAlias)
+@receiver(post_delete, sender=EquipmentAlias)
+@receiver(post_save, sender=EquipmentCategory)
+@receiver(post_delete, sender=EquipmentCategory)
+@receiver(post_save, sender=ReservationMetadataField)
+@receiver(post_delete, sender=ReservationMetadataField)
+@receiver(post_save, sender=ReservationMetadataSet)
+@receiver(post_delete, sender=ReservationMetadataSet)
+@receiver(m2m_changed, sender=ReservationMetadataSet.supported_fields.through)
+@receiver(m2m_changed, sender=ReservationMetadataSet.required_fields.through)
+def invalidate_all_resources(sender, **kwargs):
+    invalidate_resource_cache()
@@ -0,0 +1,72 @@
+"""
+Full text search documents of resources
+
+Resource.search_document holds the names and descriptions of a resource and
+the name of its unit in every language, each stemmed with the text search
+configuration of its language. Names weigh the most and descriptions the
+least. The documents are updated in the database whenever a resource or a
+unit is saved.
+"""
+from django.db import connection
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .resource import Resource
+from .unit import Unit
+
+SEARCH_CONFIGS = (
+    ('fi', 'finnish'),
+    ('sv', 'swedish'),
+    ('en', 'english'),
+)
+
+# Fields of the resource and its unit included in the search document
+RESOURCE_SEARCH_FIELDS = {'name', 'description', 'unit'} | {
+    '%s_%s' % (field, lang) for field in ('name', 'description') for lang, config in SEARCH_CONFIGS}
+UNIT_SEARCH_FIELDS = {'name'} | {'name_%s' % lang for lang, config in SEARCH_CONFIGS}
+
+
+SEARCH_DOCUMENT_PARTS = (
+    "setweight(to_tsvector('{config}', coalesce(name_{lang}, '')), 'A')",
+    "setweight(to_tsvector('{config}', coalesce("
+    "(SELECT u.name_{lang} FROM resources_unit u WHERE u.id = resources_resource.unit_id), '')), 'B')",
+    "setweight(to_tsvector('{config}', coalesce(description_{lang}, '')), 'C')",
+)
+
+
+def get_search_document_sql():
+    return ' || '.join(
+        part.format(lang=lang, config=config) for lang, config in SEARCH_CONFIGS for part in SEARCH_DOCUMENT_PARTS)
+
+
+def update_search_documents(resource_ids=None, unit_ids=None):
+    """
+    Update the search documents of the given resources and the resources of the
+    given units, or of all resources if neither is given.
+    """
+    sql = 'UPDATE resources_resource SET search_document = %s' % get_search_document_sql()
+    params = []
+    if resource_ids is not None:
+        sql += ' WHERE id = ANY(%s)'
+        params.append(list(resource_ids))
+    elif unit_ids is not None:
+        sql += ' WHERE unit_id = ANY(%s)'
+        params.append(list(unit_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _search_fields_changed(update_fields, search_fields):
+    return update_fields is None or bool(search_fields & set(update_fields))
+
+
+@receiver(post_save, sender=Resource)
+def update_resource_search_document(sender, instance, update_fields=None, **kwargs):
+    if _search_fields_changed(update_fields, RESOURCE_SEARCH_FIELDS):
+        update_search_documents(resource_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Unit)
+def update_unit_search_documents(sender, instance, update_fields=None, **kwargs):
+    if _search_fields_changed(update_fields, UNIT_SEARCH_FIELDS):
+        update_search_documents(unit_ids=[instance.pk])
@@ -0,0 +1,116 @@
+"""
+Prefix index for typeahead suggestions of resource and unit names
+
+Names of every object are kept sorted in memory, so the objects whose name
+starts with the typed text are found with a binary search instead of a
+database query. Saving or deleting an object bumps a version number in the
+Django cache and the indexes of every process are rebuilt on their next use.
+The version is bumped again after the commit, as another process may have
+rebuilt its index from the old names in between, and an index is rebuilt
+anyway once it's TYPEAHEAD_INDEX_MAX_AGE seconds old.
+"""
+import bisect
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from modeltranslation.utils import build_localized_fieldname, get_language, resolution_order
+
+from .resource import Resource
+from .unit import Unit
+
+TYPEAHEAD_VERSION_KEY = 'resources:typeahead_version'
+TYPEAHEAD_INDEX_MAX_AGE = 5 * 60
+
+TYPEAHEAD_MODELS = {
+    'resource': Resource,
+    'unit': Unit,
+}
+
+# Indexes built in this process, by object type and language
+_indexes = {}
+
+
+def get_typeahead_version():
+    version = cache.get(TYPEAHEAD_VERSION_KEY)
+    if version is None:
+        cache.add(TYPEAHEAD_VERSION_KEY, int(time.time()), None)
+        version = cache.get(TYPEAHEAD_VERSION_KEY, int(time.time()))
+    return version
+
+
+class PrefixIndex(object):
+    def __init__(self, version, entries):
+        self.version = version
+        self.built_at = time.time()
+        self.entries = sorted(entries)
+        self.names = [name for name, pk in self.entries]
+
+    def is_outdated(self, version):
+        return self.version != version or time.time() - self.built_at > TYPEAHEAD_INDEX_MAX_AGE
+
+    def search(self, query_parts):
+        """
+        Ids of the objects whose name starts with the first part and contains the
+        rest of them, ordered by name and id.
+
+        :type query_parts: list[str]
+        :rtype: collections.Iterator[str]
+        """
+        first, rest = query_parts[0], query_parts[1:]
+        for i in range(bisect.bisect_left(self.names, first), len(self.entries)):
+            name, pk = self.entries[i]
+            if not name.startswith(first):
+                break
+            if all(part in name for part in rest):
+                yield pk
+
+
+def build_prefix_index(obj_name, language, version):
+    # Objects without a name in the language are found with the name shown in its place
+    fields = [build_localized_fieldname('name', lang) for lang in resolution_order(language)]
+    entries = []
+    for row in TYPEAHEAD_MODELS[obj_name].objects.values_list('pk', *fields):
+        name = next((name for name in row[1:] if name), None)
+        if name:
+            entries.append((name.lower(), row[0]))
+    return PrefixIndex(version, entries)
+
+
+def get_prefix_index(obj_name, language):
+    """
+    :rtype: PrefixIndex
+    """
+    version = get_typeahead_version()
+    index = _indexes.get((obj_name, language))
+    if index is None or index.is_outdated(version):
+        index = _indexes[(obj_name, language)] = build_prefix_index(obj_name, language, version)
+    return index
+
+
+def search_typeahead(obj_name, query_parts):
+    """
+    Ids of the objects of the type matching the lowercased query parts in the current
+    language. The matches are produced lazily, so callers can stop at any point.
+
+    :rtype: collections.Iterator[str]
+    """
+    return get_prefix_index(obj_name, get_language()).search(query_parts)
+
+
+def bump_typeahead_version():
+    try:
+        cache.incr(TYPEAHEAD_VERSION_KEY)
+    except ValueError:
+        cache.set(TYPEAHEAD_VERSION_KEY, int(time.time()), None)
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def invalidate_typeahead(sender, **kwargs):
+    bump_typeahead_version()
+    transaction.on_commit(bump_typeahead_version)
@@ -7,7 +7,7 @@ from autoslug import AutoSlugField
 
 from .base import AutoIdentifiedModel, ModifiableModel
 from .utils import create_reservable_before_datetime, get_translated, get_translated_name
-from .availability import get_opening_hours
+from .availability import get_opening_hours, schedule_opening_hours_refresh
 
 from munigeo.models import Municipality
 
@@ -53,6 +53,23 @@ class Unit(ModifiableModel, AutoIdentifiedModel):
     def __str__(self):
         return "%s (%s)" % (get_translated(self, 'name'), self.id)
 
+    # Time zone as it was loaded from the database, see save()
+    _loaded_time_zone = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Unit, cls).from_db(db, field_names, values)
+        instance._loaded_time_zone = instance.__dict__.get('time_zone')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Stored opening hours of the resources are in the unit's time zone
+        time_zone_changed = not self._state.adding and self._loaded_time_zone != self.time_zone
+        super(Unit, self).save(*args, **kwargs)
+        self._loaded_time_zone = self.time_zone
+        if time_zone_changed:
+            schedule_opening_hours_refresh(unit_id=self.pk)
+
     def get_opening_hours(self, begin=None, end=None):
         """
         :rtype : dict[str, list[dict[str, datetime.datetime]]]
@@ -1,8 +1,9 @@
 import base64
+import csv
 import datetime
 import struct
+import tempfile
 import time
-import io
 
 import arrow
 from django.conf import settings
@@ -121,51 +122,92 @@ def send_respa_mail(email_address, subject, template_name, context, language=DEF
         send_mail(str(subject), final_message, from_address, [email_address])
 
 
-def generate_reservation_xlsx(reservations):
-    """
-    Return reservations in Excel xlsx format
+RESERVATION_EXPORT_HEADERS = (
+    ('Unit', 30),
+    ('Resource', 30),
+    ('Begin time', 15),
+    ('End time', 15),
+    ('Created at', 15),
+    ('User', 30),
+    ('Comments', 30)
+)
+RESERVATION_EXPORT_CHUNK_SIZE = 64 * 1024
 
-    The parameter is expected to be a list of dicts with fields:
-      * unit: unit name str
-      * resource: resource name str
-      * begin: begin time datetime
-      * end: end time datetime
-      * user: user email str (optional)
-      * comments: comments str (optional)
 
-    :rtype: bytes
-    """
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output)
+def _write_reservation_workbook(workbook, headers, rows):
     worksheet = workbook.add_worksheet()
 
-    headers = (
-        ('Unit', 30),
-        ('Resource', 30),
-        ('Begin time', 15),
-        ('End time', 15),
-        ('Created at', 15),
-        ('User', 30),
-        ('Comments', 30)
-    )
     header_format = workbook.add_format({'bold': True})
     for column, header in enumerate(headers):
-        worksheet.write(0, column, str(_(header[0])), header_format)
-        worksheet.set_column(column, column, header[1])
+        worksheet.write(0, column, header, header_format)
+        worksheet.set_column(column, column, RESERVATION_EXPORT_HEADERS[column][1])
 
     date_format = workbook.add_format({'num_format': 'dd.mm.yyyy hh:mm', 'align': 'left'})
-    for row, reservation in enumerate(reservations, 1):
-        worksheet.write(row, 0, reservation['unit'])
-        worksheet.write(row, 1, reservation['resource'])
-        worksheet.write(row, 2, localtime(reservation['begin']).replace(tzinfo=None), date_format)
-        worksheet.write(row, 3, localtime(reservation['end']).replace(tzinfo=None), date_format)
-        worksheet.write(row, 4, localtime(reservation['created_at']).replace(tzinfo=None), date_format)
-        if 'user' in reservation:
-            worksheet.write(row, 5, reservation['user'])
-        if 'comments' in reservation:
-            worksheet.write(row, 6, reservation['comments'])
+    for row_number, row in enumerate(rows, 1):
+        for column, value in enumerate(row):
+            if value is None:
+                continue
+            if isinstance(value, datetime.datetime):
+                worksheet.write(row_number, column, localtime(value).replace(tzinfo=None), date_format)
+            else:
+                worksheet.write(row_number, column, value)
     workbook.close()
-    return output.getvalue()
+
+
+def _get_reservation_export_headers():
+    return [str(_(header)) for header, width in RESERVATION_EXPORT_HEADERS]
+
+
+def _stream_reservation_xlsx(headers, rows):
+    with tempfile.TemporaryFile() as output:
+        # In constant memory mode each row is flushed to disk once the next one is started
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        _write_reservation_workbook(workbook, headers, rows)
+        output.seek(0)
+        for chunk in iter(lambda: output.read(RESERVATION_EXPORT_CHUNK_SIZE), b''):
+            yield chunk
+
+
+def stream_reservation_xlsx(rows):
+    """
+    Return an iterator over the bytes of an xlsx file of reservations
+
+    Rows are tuples in the order of RESERVATION_EXPORT_HEADERS and are consumed
+    one at a time, so the rows can come straight from a queryset iterator.
+    Datetimes are converted to local time and None is left blank.
+    """
+    # Headers are translated now, the iterator may be consumed after the request
+    return _stream_reservation_xlsx(_get_reservation_export_headers(), rows)
+
+
+class _EchoBuffer(object):
+    def write(self, value):
+        return value
+
+
+def _format_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return localtime(value).strftime('%d.%m.%Y %H:%M')
+    return value
+
+
+def _stream_reservation_csv(headers, rows):
+    writer = csv.writer(_EchoBuffer())
+    # Byte order mark makes Excel read the file as UTF-8
+    yield '\ufeff' + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow([_format_csv_value(value) for value in row])
+
+
+def stream_reservation_csv(rows):
+    """
+    Return an iterator over the lines of a CSV file of reservations
+
+    Takes the same rows as stream_reservation_xlsx.
+    """
+    return _stream_reservation_csv(_get_reservation_export_headers(), rows)
 
 
 def get_object_or_none(cls, **kwargs):
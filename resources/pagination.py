@@ -1,4 +1,105 @@
-from rest_framework.pagination import PageNumberPagination, _positive_int
+import base64
+import datetime
+import json
+from collections import OrderedDict
+from functools import reduce
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPaginationMixin(object):
+    """
+    Opt-in keyset pagination for page number paginators.
+
+    When the request has a `cursor` parameter (empty for the first page), the
+    results are ordered by `keyset_ordering` and each page continues after the
+    last row of the previous one instead of using OFFSET, and nothing is counted.
+    Ordering by the first keyset field descending (e.g. `ordering=-begin`)
+    lists the results from the end. Only the next page can be followed.
+    """
+    cursor_query_param = 'cursor'
+    keyset_ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    keyset = False
+    next_cursor = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super(KeysetPaginationMixin, self).paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request) or self.page_size
+        ordering = self.get_keyset_ordering(request)
+        queryset = queryset.order_by(*ordering)
+
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = self.filter_after(queryset, ordering, self.decode_cursor(cursor, len(ordering)))
+
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        self.next_cursor = self.encode_cursor(page[-1], ordering) if len(rows) > page_size else None
+        return page
+
+    def get_keyset_ordering(self, request):
+        ordering = request.query_params.get('ordering', '').split(',')[0].strip()
+        if ordering == '-%s' % self.keyset_ordering[0]:
+            return ['-%s' % field for field in self.keyset_ordering]
+        return list(self.keyset_ordering)
+
+    def filter_after(self, queryset, ordering, values):
+        # (a, b) > (x, y) is a > x OR (a = x AND b > y), the leading a >= x lets the index do the work
+        conditions = []
+        for i, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = dict((f.lstrip('-'), value) for f, value in zip(ordering[:i], values[:i]))
+            equal['%s__%s' % (field.lstrip('-'), lookup)] = values[i]
+            conditions.append(Q(**equal))
+        first = ordering[0]
+        bound = {'%s__%s' % (first.lstrip('-'), 'lte' if first.startswith('-') else 'gte'): values[0]}
+        return queryset.filter(**bound).filter(reduce(lambda a, b: a | b, conditions))
+
+    def encode_cursor(self, obj, ordering):
+        values = []
+        for field in ordering:
+            value = reduce(getattr, field.lstrip('-').split('__'), obj)
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor, length):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != length:
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super(KeysetPaginationMixin, self).get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super(KeysetPaginationMixin, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data)
+        ]))
 
 
 class DefaultPagination(PageNumberPagination):
@@ -11,18 +112,5 @@ class PurposePagination(DefaultPagination):
     page_size = 40
 
 
-class ReservationPagination(DefaultPagination):
-    def get_page_size(self, request):
-        if self.page_size_query_param:
-            cutoff = self.max_page_size
-            if request.query_params.get('format', '').lower() == 'xlsx':
-                cutoff = 50000
-            try:
-                return _positive_int(
-                    request.query_params[self.page_size_query_param],
-                    strict=True, cutoff=cutoff
-                )
-            except (KeyError, ValueError):
-                pass
-
-        return self.page_size
+class ReservationPagination(KeysetPaginationMixin, DefaultPagination):
+    keyset_ordering = ('begin', 'id')
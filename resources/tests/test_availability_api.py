@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import datetime
+import pytest
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from resources.models import Day, Period, Reservation, Resource
+
+
+@pytest.fixture
+def list_url():
+    return reverse('availability-list')
+
+
+@pytest.fixture
+def unit_period(test_unit):
+    period = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31),
+                                   unit=test_unit, name='regular hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(16, 0))
+    return period
+
+
+def get_availability(api_client, list_url):
+    return api_client.get(list_url, {'start': '2115-01-05T00:00:00+02:00', 'end': '2115-01-12T00:00:00+02:00'})
+
+
+@pytest.mark.django_db
+def test_availability_requires_range(api_client, list_url):
+    response = api_client.get(list_url)
+    assert response.status_code == 400
+
+    response = api_client.get(list_url, {'start': '2115-01-05T00:00:00+02:00', 'end': 'foo'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_availability_range_limit(api_client, list_url, resource_in_unit):
+    response = api_client.get(list_url, {'start': '2115-01-01T00:00:00+02:00', 'end': '2115-02-01T00:00:00+02:00'})
+    assert response.status_code == 200
+
+    response = api_client.get(list_url, {'start': '2115-01-01T00:00:00+02:00', 'end': '2115-02-01T00:00:01+02:00'})
+    assert response.status_code == 400
+    assert 'at most 31 days' in response.data['detail']
+
+
+@pytest.mark.django_db
+def test_availability(api_client, list_url, resource_in_unit, unit_period):
+    tz = timezone.get_current_timezone()
+    Reservation.objects.create(resource=resource_in_unit,
+                               begin=tz.localize(datetime.datetime(2115, 1, 5, 8)),
+                               end=tz.localize(datetime.datetime(2115, 1, 5, 12)))
+
+    response = api_client.get(list_url, {'start': '2115-01-05T00:00:00+02:00', 'end': '2115-01-06T00:00:00+02:00',
+                                         'resource': resource_in_unit.pk})
+    assert response.status_code == 200
+    assert response.data['count'] == 1
+    data = response.data['results'][0]
+    assert data['id'] == resource_in_unit.pk
+    assert data['opening_hours'][0] == {
+        'date': '2115-01-05',
+        'opens': '2115-01-05T08:00:00+02:00',
+        'closes': '2115-01-05T16:00:00+02:00',
+    }
+    assert data['available_hours'] == [{
+        'starts': '2115-01-05T12:00:00+02:00',
+        'ends': '2115-01-05T16:00:00+02:00',
+    }]
+
+
+@pytest.mark.django_db
+def test_availability_query_count(api_client, list_url, resource_in_unit, unit_period):
+    with CaptureQueriesContext(connection) as single_resource:
+        response = get_availability(api_client, list_url)
+    assert response.status_code == 200
+
+    for i in range(5):
+        resource = Resource.objects.create(name='resource %d' % i, unit=resource_in_unit.unit,
+                                           type=resource_in_unit.type)
+        Reservation.objects.create(resource=resource, begin=datetime.datetime(2115, 1, 6, 8, tzinfo=timezone.utc),
+                                   end=datetime.datetime(2115, 1, 6, 10, tzinfo=timezone.utc))
+
+    with CaptureQueriesContext(connection) as many_resources:
+        response = get_availability(api_client, list_url)
+    assert response.status_code == 200
+    assert response.data['count'] == 6
+    assert len(many_resources) == len(single_resource)
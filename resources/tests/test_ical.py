@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pytest
+from django.contrib.gis.geos import Point
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from resources.models import Reservation
+
+
+@pytest.fixture
+def feed_url(user):
+    return reverse('ical-feed', kwargs={'ical_token': user.get_or_create_ical_token()})
+
+
+def create_reservation(resource, user, day):
+    begin = timezone.now().replace(microsecond=0) + datetime.timedelta(days=day)
+    return Reservation.objects.create(resource=resource, user=user, begin=begin,
+                                      end=begin + datetime.timedelta(hours=1))
+
+
+@pytest.mark.django_db
+def test_ical_feed_conditional_get(api_client, feed_url, resource_in_unit, user):
+    resource_in_unit.unit.location = Point(24.94, 60.17, srid=4326)
+    resource_in_unit.unit.save()
+    reservation = create_reservation(resource_in_unit, user, 1)
+
+    response = api_client.get(feed_url)
+    assert response.status_code == 200
+    assert ('respa_reservation_%d' % reservation.id).encode('utf-8') in response.content
+    etag = response['ETag']
+
+    response = api_client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    reservation.end += datetime.timedelta(hours=1)
+    reservation.save()
+    response = api_client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    # the feed shows the resource name
+    etag = response['ETag']
+    resource_in_unit.name = 'renamed resource'
+    resource_in_unit.save()
+    response = api_client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert b'renamed resource' in response.content
+
+    etag = response['ETag']
+    reservation.delete()
+    response = api_client.get(feed_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert b'respa_reservation' not in response.content
+
+
+@pytest.mark.django_db
+def test_ical_feed_query_count(api_client, feed_url, resource_in_unit, resource_in_unit2, user):
+    for resource in (resource_in_unit, resource_in_unit2):
+        resource.unit.location = Point(24.94, 60.17, srid=4326)
+        resource.unit.save()
+    create_reservation(resource_in_unit, user, 1)
+
+    with CaptureQueriesContext(connection) as one_reservation:
+        assert api_client.get(feed_url).status_code == 200
+
+    create_reservation(resource_in_unit2, user, 2)
+    create_reservation(resource_in_unit, user, 3)
+    with CaptureQueriesContext(connection) as three_reservations:
+        assert api_client.get(feed_url).status_code == 200
+    assert len(three_reservations) == len(one_reservation)
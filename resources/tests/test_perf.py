@@ -3,6 +3,8 @@ from datetime import datetime
 import arrow
 import pytest
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from resources.models import Day, Period, Reservation, Resource, ResourceType, Unit
 
@@ -57,7 +59,7 @@ def test_api_resource_scalability(api_client):
 
 @pytest.mark.skipif(not TEST_PERFORMANCE, reason="TEST_PERFORMANCE not enabled")
 @pytest.mark.django_db
-def test_avail_resource_scalability(client):
+def test_avail_resource_scalability(api_client):
     u1 = Unit.objects.create(name='Unit 1', id='unit_1', time_zone='Europe/Helsinki')
     rt = ResourceType.objects.create(name='Type 1', id='type_1', main_type='space')
     p1 = Period.objects.create(start='2015-06-01', end='2015-09-01', unit=u1, name='')
@@ -67,23 +69,24 @@ def test_avail_resource_scalability(client):
     begin_res = arrow.get('2015-06-01T08:00:00Z').datetime
     end_res = arrow.get('2015-06-01T16:00:00Z').datetime
 
-    perf_res_list = open('perf_res_list.csv', 'w')
-    perf_res_avail = open('perf_res_avail.csv', 'w')
-    perf_reservation = open('perf_reservation.csv', 'w')
-    perf_res_list.write('Resource listing\n')
-    perf_res_list.write('resources, time (s)\n')
-    perf_res_avail.write('Availability listing\n')
-    perf_res_avail.write('resources, time (s)\n')
-    perf_reservation.write('Single resource availability\n')
-    perf_reservation.write('Total reservations, time (s)\n')
+    perf_avail = open('perf_avail.csv', 'w')
+    perf_avail.write('Bulk availability for a month\n')
+    perf_avail.write('resources, time (s), queries\n')
+    query_counts = []
     for n in [1, 10, 100, 1000]:
         Resource.objects.all().delete()
         for i in range(n):
             resource = Resource.objects.create(name=('Resource ' + str(i)), id=('r' + str(i)), unit=u1, type=rt)
             Reservation.objects.create(resource=resource, begin=begin_res, end=end_res)
 
-        # Time the general availability for n resources and reservations
+        # Time the availability of a page of resources for a month (fixed number of queries ~ O(1))
         start = datetime.now()
-        response = client.get('/test/availability?start_date=2015-06-01&end_date=2015-06-30')
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get('/v1/availability/?start=2015-06-01T00:00:00Z&end=2015-06-30T00:00:00Z'
+                                      '&page_size=100')
         end = datetime.now()
-        perf_res_list.write(str(n) + ', ' + str(end - start) + '\n')
+        assert response.status_code == 200
+        query_counts.append(len(queries))
+        perf_avail.write(str(n) + ', ' + str(end - start) + ', ' + str(len(queries)) + '\n')
+
+    assert len(set(query_counts)) == 1
@@ -2,9 +2,11 @@ import pytest
 import datetime
 import re
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.core.urlresolvers import reverse
 from django.core import mail
-from django.test.utils import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import dateparse, timezone
 from guardian.shortcuts import assign_perm
 from freezegun import freeze_time
@@ -580,7 +582,7 @@ def test_reservation_excels(staff_api_client, list_url, detail_url, reservation,
     )
     assert response.status_code == 200
     assert response._headers['content-disposition'] == ('Content-Disposition', 'attachment; filename=reservations.xlsx')
-    assert len(response.content) > 0
+    assert len(b''.join(response.streaming_content)) > 0
 
     response = staff_api_client.get(
         detail_url,
@@ -590,7 +592,43 @@ def test_reservation_excels(staff_api_client, list_url, detail_url, reservation,
     assert response.status_code == 200
     assert response._headers['content-disposition'] == (
         'Content-Disposition', 'attachment; filename=reservation-{}.xlsx'.format(reservation.pk))
-    assert len(response.content) > 0
+    assert len(b''.join(response.streaming_content)) > 0
+
+
+@pytest.mark.django_db
+def test_reservation_csv_export(api_client, staff_api_client, list_url, reservation, user):
+    reservation.comments = 'secret comment'
+    reservation.save()
+
+    response = staff_api_client.get(list_url, HTTP_ACCEPT='text/csv', HTTP_ACCEPT_LANGUAGE='en')
+    assert response.status_code == 200
+    assert response._headers['content-disposition'] == ('Content-Disposition', 'attachment; filename=reservations.csv')
+    lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+    assert lines[0] == 'Unit,Resource,Begin time,End time,Created at,User,Comments'
+    assert len(lines) == 2
+    assert reservation.resource.name in lines[1]
+    assert user.email in lines[1]
+    assert 'secret comment' in lines[1]
+
+    api_client.force_authenticate(user=user)
+    response = api_client.get(list_url, {'format': 'csv'})
+    assert response.status_code == 200
+    lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+    assert len(lines) == 2
+    assert 'secret comment' not in lines[1]
+
+
+@pytest.mark.django_db
+def test_reservation_export_row_limit(monkeypatch, api_client, list_url, reservation):
+    monkeypatch.setattr('resources.api.reservation.EXPORT_MAX_ROWS', 1)
+    Reservation.objects.create(resource=reservation.resource, begin='2115-04-05T09:00:00+02:00',
+                               end='2115-04-05T10:00:00+02:00', user=reservation.user)
+
+    response = api_client.get(list_url, {'format': 'csv', 'all': 'true'})
+    assert response.status_code == 200
+    lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+    assert len(lines) == 2
+    assert '04.04.2115' in lines[1]
 
 
 @pytest.mark.parametrize('need_manual_confirmation, expected_state', [
@@ -610,6 +648,32 @@ def test_state_on_new_reservations(user_api_client, list_url, reservation_data_e
     assert reservation.state == expected_state
 
 
+@override_settings(RESPA_MAILS_ENABLED=True)
+@pytest.mark.django_db
+def test_requested_reservation_notifies_approvers(user_api_client, list_url, reservation_data_extra, resource_in_unit,
+                                                 staff_user):
+    """
+    Tests that officials who can approve reservations of the unit through a group
+    are found and mailed when a reservation needing manual confirmation is made.
+    """
+    resource_in_unit.need_manual_confirmation = True
+    resource_in_unit.reservation_metadata_set = ReservationMetadataSet.objects.get(name='default')
+    resource_in_unit.save()
+    group = Group.objects.create(name='approvers')
+    assign_perm('can_approve_reservation', group, resource_in_unit.unit)
+    staff_user.groups.add(group)
+    assert resource_in_unit.can_approve_reservations(staff_user)
+
+    response = user_api_client.post(list_url, data=reservation_data_extra, format='json')
+    assert response.status_code == 201
+    assert Reservation.objects.get(id=response.data['id']).state == Reservation.REQUESTED
+    check_received_mail_exists(
+        'Reservation requested',
+        staff_user.email,
+        'A new preliminary reservation has been made'
+    )
+
+
 @pytest.mark.parametrize('state', [
     'illegal_state',
     '',
@@ -1102,6 +1166,32 @@ def test_access_code_visibility(user, user2, staff_user, api_client, resource_in
         assert 'access_code' not in response.data
 
 
+@pytest.mark.django_db
+def test_access_code_permission_queries(api_client, user, user2, resource_in_unit, reservation, list_url):
+    resource_in_unit.access_code_type = Resource.ACCESS_CODE_TYPE_PIN6
+    resource_in_unit.save()
+    reservation.access_code = '123456'
+    reservation.save()
+    assign_perm('can_view_reservation_access_code', user2, resource_in_unit.unit)
+    api_client.force_authenticate(user2)
+    api_client.get(list_url)
+
+    with CaptureQueriesContext(connection) as one_reservation:
+        response = api_client.get(list_url)
+    assert response.data['results'][0]['access_code'] == '123456'
+
+    for hour in (11, 12, 13):
+        Reservation.objects.create(resource=resource_in_unit, user=user, access_code='123456',
+                                   begin='2115-04-04T%d:00:00+02:00' % hour, end='2115-04-04T%d:30:00+02:00' % hour)
+
+    # The unit permissions of the user are loaded once, not for every reservation
+    with CaptureQueriesContext(connection) as four_reservations:
+        response = api_client.get(list_url)
+    assert len(response.data['results']) == 4
+    assert all(reservation['access_code'] == '123456' for reservation in response.data['results'])
+    assert len(four_reservations) == len(one_reservation)
+
+
 @override_settings(RESPA_MAILS_ENABLED=True)
 @pytest.mark.django_db
 def test_reservation_created_with_access_code_mail(user_api_client, user, resource_in_unit, list_url, reservation_data):
@@ -1197,3 +1287,29 @@ def test_detail_endpoint_does_not_need_all_true_filter(user_api_client, user, re
     detail_url = reverse('reservation-detail', kwargs={'pk': reservation_in_the_past.pk})
     response = user_api_client.get(detail_url)
     assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_keyset_pagination(staff_api_client, list_url, resource_in_unit, user):
+    reservations = [
+        Reservation.objects.create(resource=resource_in_unit, user=user,
+                                   begin='2115-04-0%dT09:00:00+02:00' % day, end='2115-04-0%dT10:00:00+02:00' % day)
+        for day in (3, 1, 5, 2, 4)
+    ]
+    expected_ids = [reservation.id for reservation in sorted(reservations, key=lambda reservation: reservation.begin)]
+
+    ids = []
+    url = '%s?cursor=&page_size=2' % list_url
+    while url:
+        response = staff_api_client.get(url)
+        assert response.status_code == 200
+        assert response.data['count'] is None
+        ids.extend(reservation['id'] for reservation in response.data['results'])
+        url = response.data['next']
+    assert ids == expected_ids
+
+    response = staff_api_client.get('%s?cursor=&page_size=2&ordering=-begin' % list_url)
+    assert [reservation['id'] for reservation in response.data['results']] == expected_ids[:-3:-1]
+
+    response = staff_api_client.get('%s?cursor=foo' % list_url)
+    assert response.status_code == 404
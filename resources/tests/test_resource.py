@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
+import datetime
 from decimal import Decimal
 import pytest
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.utils.translation import activate
 from PIL import Image
 
 from resources.errors import InvalidImage
-from resources.models import ResourceImage
+from resources.models import (Day, OpeningHours, Period, Reservation, Resource, ResourceImage,
+                              get_available_hours_for_resources, get_opening_hours_for_resources)
+from resources.models.availability import (filter_open_resources, refresh_opening_hours,
+                                           resolve_opening_hours_for_resources)
+from resources.models.resource_cache import get_resource_cache_keys
 from resources.tests.utils import create_resource_image, get_test_image_data, get_field_errors
 
 
@@ -81,6 +90,20 @@ def test_invalid_image(space_resource):
     assert "cannot identify" in ei.value.message
 
 
+@pytest.mark.django_db
+def test_resource_image_renditions_outdated(django_assert_num_queries, space_resource):
+    assert ResourceImage(resource=space_resource).are_renditions_outdated()
+    image = create_resource_image(space_resource)
+    assert not image.are_renditions_outdated()
+
+    image = ResourceImage.objects.get(pk=image.pk)
+    with django_assert_num_queries(0):
+        image.caption = 'new caption'
+        assert not image.are_renditions_outdated()
+        image.cropping = '0,0,16,16'
+        assert image.are_renditions_outdated()
+
+
 @pytest.mark.django_db
 def test_price_validations(resource_in_unit):
     activate('en')
@@ -101,3 +124,188 @@ def test_price_validations(resource_in_unit):
         resource_in_unit.full_clean()
     assert 'Ensure this value is greater than or equal to 0.00.' in get_field_errors(ei.value, 'min_price_per_hour')
     assert 'Ensure this value is greater than or equal to 0.00.' in get_field_errors(ei.value, 'max_price_per_hour')
+
+
+@pytest.mark.django_db
+def test_opening_hours_from_prefetched_periods(resource_in_unit):
+    regular = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31),
+                                    resource=resource_in_unit, name='regular hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=regular, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
+    exceptional = Period.objects.create(start=datetime.date(2115, 1, 10), end=datetime.date(2115, 1, 11),
+                                        resource=resource_in_unit, name='exceptional hours', exceptional=True)
+    Day.objects.create(period=exceptional, weekday=exceptional.start.weekday(), closed=True)
+
+    begin = datetime.date(2115, 1, 8)
+    end = datetime.date(2115, 1, 13)
+    expected = resource_in_unit.get_opening_hours(begin, end)
+
+    resource = Resource.objects.prefetch_related('periods__days', 'unit__periods__days').get(pk=resource_in_unit.pk)
+    assert resource.get_opening_hours(begin, end) == expected
+    assert resource.get_opening_hours(begin) == resource_in_unit.get_opening_hours(begin)
+
+
+@pytest.mark.django_db
+def test_opening_hours_for_resources(django_assert_num_queries, resource_in_unit, resource_in_unit2):
+    unit_period = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31),
+                                        unit=resource_in_unit.unit, name='unit hours')
+    for weekday in range(0, 5):
+        Day.objects.create(period=unit_period, weekday=weekday, opens=datetime.time(9, 0), closes=datetime.time(17, 0))
+    resource_period = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31),
+                                            resource=resource_in_unit2, name='resource hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=resource_period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(20, 0))
+
+    begin = datetime.date(2115, 1, 1)
+    end = datetime.date(2115, 1, 15)
+    resources = list(Resource.objects.select_related('unit').filter(pk__in=[resource_in_unit.pk, resource_in_unit2.pk]))
+    with django_assert_num_queries(2):
+        opening_hours = get_opening_hours_for_resources(resources, begin, end)
+
+    for resource in resources:
+        assert opening_hours[resource.pk] == resource.get_opening_hours(begin, end)
+
+
+# Refreshes run at commit inside transactions
+@pytest.mark.django_db(transaction=True)
+def test_stored_opening_hours(django_assert_num_queries, resource_in_unit):
+    today = timezone.now().date()
+    period = Period.objects.create(start=today, end=today + datetime.timedelta(days=30),
+                                   unit=resource_in_unit.unit, name='unit hours')
+    days = [Day.objects.create(period=period, weekday=weekday, opens=datetime.time(9, 0), closes=datetime.time(17, 0))
+            for weekday in range(0, 7)]
+
+    begin = today
+    end = today + datetime.timedelta(days=13)
+    resource = Resource.objects.select_related('unit').get(pk=resource_in_unit.pk)
+    with django_assert_num_queries(1):
+        opening_hours = resource.get_opening_hours(begin, end)
+    assert opening_hours == resolve_opening_hours_for_resources([resource], begin, end)[resource.pk]
+    assert opening_hours[begin][0]['opens'].time() == datetime.time(9, 0)
+
+    # Saving a day refreshes the stored opening hours of the period
+    day = days[begin.weekday()]
+    day.closes = datetime.time(12, 0)
+    day.save()
+    assert resource.get_opening_hours(begin, begin)[begin][0]['closes'].time() == datetime.time(12, 0)
+
+    # Days saved in one transaction refresh the period once
+    with CaptureQueriesContext(connection) as queries:
+        with transaction.atomic():
+            for day in days:
+                day.opens = datetime.time(10, 0)
+                day.save()
+    assert len([query for query in queries if query['sql'].startswith('DELETE FROM "resources_openinghours"')]) == 1
+    assert resource.get_opening_hours(begin, begin)[begin][0]['opens'].time() == datetime.time(10, 0)
+
+    period.delete()
+    assert resource.get_opening_hours(begin, end) == resolve_opening_hours_for_resources([resource], begin, end)[resource.pk]
+    assert not OpeningHours.objects.filter(resource=resource, opens__isnull=False).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_stored_opening_hours_of_moved_period(resource_in_unit, resource_in_unit2):
+    today = timezone.now().date()
+    period = Period.objects.create(start=today, end=today + datetime.timedelta(days=6),
+                                   resource=resource_in_unit, name='resource hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
+    assert OpeningHours.objects.filter(resource=resource_in_unit, opens__isnull=False).exists()
+
+    # Both the old and the new resource are refreshed
+    period = Period.objects.get(pk=period.pk)
+    period.resource = resource_in_unit2
+    period.save()
+    assert not OpeningHours.objects.filter(resource=resource_in_unit, opens__isnull=False).exists()
+    for resource in Resource.objects.select_related('unit').filter(pk__in=[resource_in_unit.pk, resource_in_unit2.pk]):
+        expected = resolve_opening_hours_for_resources([resource], today, today)[resource.pk]
+        assert resource.get_opening_hours(today, today) == expected
+    assert resource_in_unit2.get_opening_hours(today, today)[today][0]['opens'].time() == datetime.time(8, 0)
+
+
+@pytest.mark.django_db
+def test_filter_open_resources(resource_in_unit, resource_in_unit2, resource_in_unit3):
+    today = timezone.now().date()
+    for resource, closes in ((resource_in_unit, datetime.time(18, 0)), (resource_in_unit2, datetime.time(10, 0))):
+        period = Period.objects.create(start=today, end=today + datetime.timedelta(days=6),
+                                       resource=resource, name='resource hours')
+        for weekday in range(0, 7):
+            Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=closes)
+    # the opening hours of resource_in_unit3 are not stored
+    refresh_opening_hours([resource_in_unit, resource_in_unit2])
+
+    tz = resource_in_unit.unit.get_tz()
+    start = tz.localize(datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time(12, 0)))
+    end = start + datetime.timedelta(hours=2)
+    resources = Resource.objects.filter(pk__in=[resource_in_unit.pk, resource_in_unit2.pk, resource_in_unit3.pk])
+    assert set(filter_open_resources(resources, start, end).values_list('id', flat=True)) == {
+        resource_in_unit.pk, resource_in_unit3.pk}
+
+
+@pytest.mark.django_db
+def test_open_from_now_closed_day(resource_in_unit):
+    # Both stored and resolved opening hours treat a closed day as closed, even if it has hours
+    today = timezone.now().date()
+    beyond_horizon = datetime.date(2115, 1, 1)
+    for start in (today, beyond_horizon):
+        period = Period.objects.create(start=start, end=start + datetime.timedelta(days=6),
+                                       resource=resource_in_unit, name='hours')
+        for weekday in range(0, 7):
+            Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(18, 0),
+                               closed=(weekday == start.weekday()))
+    refresh_opening_hours([resource_in_unit])
+    assert OpeningHours.objects.filter(resource=resource_in_unit, date=today).exists()
+
+    for start in (today, beyond_horizon):
+        open_day = start + datetime.timedelta(days=1)
+        assert resource_in_unit.get_open_from_now(datetime.datetime.combine(open_day, datetime.time(12, 0))) == {
+            'opens': datetime.time(12, 0), 'closes': datetime.datetime.combine(open_day, datetime.time(18, 0))}
+        closed = resource_in_unit.get_open_from_now(datetime.datetime.combine(start, datetime.time(12, 0)))
+        assert closed == {'opens': None, 'closes': None}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("during_closing", (False, True))
+@pytest.mark.parametrize("duration", (None, datetime.timedelta(hours=2)))
+def test_available_hours_for_resources(resource_in_unit, resource_in_unit2, during_closing, duration):
+    tz = timezone.get_current_timezone()
+    for resource in (resource_in_unit, resource_in_unit2):
+        period = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31),
+                                       resource=resource, name='regular hours')
+        for weekday in range(0, 7):
+            Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
+    for day, begin_hour, end_hour in ((5, 7, 9), (5, 10, 11), (5, 12, 17), (6, 9, 10), (7, 0, 23)):
+        Reservation.objects.create(resource=resource_in_unit,
+                                   begin=tz.localize(datetime.datetime(2115, 1, day, begin_hour)),
+                                   end=tz.localize(datetime.datetime(2115, 1, day, end_hour)))
+
+    start = tz.localize(datetime.datetime(2115, 1, 5))
+    end = tz.localize(datetime.datetime(2115, 1, 8))
+    resources = list(Resource.objects.select_related('unit').filter(pk__in=[resource_in_unit.pk, resource_in_unit2.pk]))
+    available_hours = get_available_hours_for_resources(resources, start, end, duration=duration,
+                                                        during_closing=during_closing)
+
+    for resource in resources:
+        assert available_hours[resource.pk] == resource.get_available_hours(start, end, duration=duration,
+                                                                            during_closing=during_closing)
+
+    # Free hours of at least two hours as the per-resource implementation found them before the batch version
+    expected = {
+        False: [((6, 10), (6, 18))],
+        True: [((5, 0), (5, 7)), ((5, 17), (6, 9)), ((6, 10), (7, 0))],
+    }
+    if duration:
+        slots = sorted((hours['starts'], hours['ends']) for hours in available_hours[resource_in_unit.pk])
+        assert slots == [(tz.localize(datetime.datetime(2115, 1, begin[0], begin[1])),
+                          tz.localize(datetime.datetime(2115, 1, end[0], end[1])))
+                         for begin, end in expected[during_closing]]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_resource_cache_is_invalidated_after_commit(resource_in_unit):
+    keys = list(get_resource_cache_keys([resource_in_unit.pk]).values())
+    with transaction.atomic():
+        resource_in_unit.save()
+        # cached by a request that read the resource before the save was committed
+        cache.set_many({key: {} for key in keys})
+    assert cache.get_many(keys) == {}
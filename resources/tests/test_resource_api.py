@@ -3,10 +3,13 @@ import pytest
 from copy import deepcopy
 from django.core.urlresolvers import reverse
 from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from freezegun import freeze_time
 
-from resources.models import Equipment, ReservationMetadataSet, Resource, ResourceEquipment, ResourceType
+from resources.models import (Day, Equipment, Period, Reservation, ReservationMetadataSet, Resource, ResourceEquipment,
+                              ResourceType)
 from .utils import check_only_safe_methods_allowed
 
 
@@ -409,3 +412,87 @@ def test_resource_equipment_filter(api_client, resource_in_unit, resource_in_uni
     response = api_client.get(list_url + '?equipment=%s,%s' % (equipment_1.id, equipment_2.id))
     assert response.status_code == 200
     assert {resource['id'] for resource in response.data['results']} == {resource_in_unit.id, resource_in_unit2.id}
+
+
+@pytest.mark.django_db
+def test_resource_list_cached_data(staff_api_client, staff_user, list_url, resource_in_unit, resource_in_unit2,
+                                   resource_equipment, equipment):
+    staff_user.favorite_resources.add(resource_in_unit)
+
+    response = staff_api_client.get(list_url)
+    assert response.status_code == 200
+    results = {resource['id']: resource for resource in response.data['results']}
+    assert results[resource_in_unit.id]['is_favorite'] is True
+    assert results[resource_in_unit2.id]['is_favorite'] is False
+    assert 'test equipment' in results[resource_in_unit.id]['equipment'][0]['name'].values()
+
+    # saving the equipment invalidates the cached data of the resources
+    equipment.name = 'renamed equipment'
+    equipment.save()
+    response = staff_api_client.get(list_url)
+    results = {resource['id']: resource for resource in response.data['results']}
+    assert 'renamed equipment' in results[resource_in_unit.id]['equipment'][0]['name'].values()
+
+    with CaptureQueriesContext(connection) as two_resources:
+        staff_api_client.get(list_url)
+
+    for i in range(3):
+        resource = Resource.objects.create(name='resource %d' % i, unit=resource_in_unit.unit,
+                                           type=resource_in_unit.type)
+        ResourceEquipment.objects.create(equipment=equipment, resource=resource)
+    staff_api_client.get(list_url)
+
+    with CaptureQueriesContext(connection) as five_resources:
+        response = staff_api_client.get(list_url)
+    assert response.data['count'] == 5
+    assert len(five_resources) == len(two_resources)
+
+
+@pytest.mark.django_db
+def test_full_text_search(api_client, list_url, resource_in_unit, resource_in_unit2, test_unit):
+    resource_in_unit.name_en = 'Meeting rooms'
+    resource_in_unit.save()
+    resource_in_unit2.description_en = 'A room for meetings'
+    resource_in_unit2.save()
+
+    response = api_client.get(list_url, {'search': 'meeting room', 'search_mode': 'fulltext'})
+    assert response.status_code == 200
+    # the name weighs more than the description
+    assert [resource['id'] for resource in response.data['results']] == [resource_in_unit.id, resource_in_unit2.id]
+
+    # unit names are searched too and kept up to date
+    test_unit.name_en = 'Harbour office'
+    test_unit.save()
+    response = api_client.get(list_url, {'search': 'harbours', 'search_mode': 'fulltext'})
+    assert [resource['id'] for resource in response.data['results']] == [resource_in_unit.id]
+
+    response = api_client.get(list_url, {'search': 'room', 'search_mode': 'bogus'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_available_filter(api_client, list_url, resource_in_unit, resource_in_unit2, user):
+    period = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31),
+                                   unit=resource_in_unit.unit, name='unit hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(16, 0))
+    resources = [resource_in_unit] + [
+        Resource.objects.create(name='resource %d' % i, unit=resource_in_unit.unit, type=resource_in_unit.type)
+        for i in range(3)]
+    # fully booked for the day
+    Reservation.objects.create(resource=resources[1], begin='2115-01-05T08:00:00+02:00',
+                               end='2115-01-05T16:00:00+02:00', user=user)
+    params = {'start': '2115-01-05T08:00:00+02:00', 'end': '2115-01-05T16:00:00+02:00', 'duration': 60,
+              'page_size': 2}
+    expected_ids = {resources[0].id, resources[2].id, resources[3].id}
+
+    response = api_client.get(list_url, params)
+    assert response.status_code == 200
+    assert response.data['count'] == 3
+    assert len(response.data['results']) == 2
+    ids = {resource['id'] for resource in response.data['results']}
+    response = api_client.get(list_url, dict(params, page=2))
+    assert response.status_code == 200
+    assert len(response.data['results']) == 1
+    ids |= {resource['id'] for resource in response.data['results']}
+    assert ids == expected_ids
@@ -5,7 +5,7 @@ from django.utils.six import BytesIO
 from PIL import Image
 
 from resources.tests.utils import create_resource_image
-from resources.views.images import parse_dimension_string
+from resources.views.images import parse_dimension_string, snap_dimensions
 
 
 @pytest.mark.django_db
@@ -25,12 +25,32 @@ def test_resource_image_view_thumbing(client, space_resource):
     resp = client.get(reverse("resource-image-view", kwargs={"pk": png.pk}), data={"dim": "50x50"})
     assert resp["Content-Type"] == "image/jpeg"  # Thumbnails should be PNG even if source data isn't
     img_data = resp.getvalue()
-    assert Image.open(BytesIO(img_data)).size == (50, 50)
+    assert Image.open(BytesIO(img_data)).size == (60, 60)  # Snapped to the nearest rendition size
 
     # Rudimentary checking of invalid `dim`s -- better testing in `test_dimension_string_parsing`
     assert client.get(reverse("resource-image-view", kwargs={"pk": png.pk}), data={"dim": "-x3"}).status_code == 400
 
 
+@pytest.mark.django_db
+def test_resource_image_view_caching(client, space_resource, settings):
+    settings.RESPA_IMAGE_SENDFILE_HEADER = 'X-Accel-Redirect'
+    settings.RESPA_IMAGE_ACCEL_REDIRECT_PREFIX = '/protected/'
+    image = create_resource_image(space_resource, size=(300, 300), format="PNG")
+    image.generate_renditions()
+    assert image.get_rendition((120, 120), generate=False)
+
+    url = reverse("resource-image-view", kwargs={"pk": image.pk})
+    resp = client.get(url, data={"dim": "100x110"})
+    assert resp.status_code == 200
+    assert resp["X-Accel-Redirect"] == '/protected/' + image.get_rendition((120, 120)).name
+    assert 'max-age' in resp["Cache-Control"]
+    assert resp.content == b''
+
+    # Dimensions snapping to the same size share the ETag
+    resp = client.get(url, data={"dim": "120x120"}, HTTP_IF_NONE_MATCH=resp["ETag"])
+    assert resp.status_code == 304
+
+
 def test_dimension_string_parsing():
     with pytest.raises(ValueError):
         parse_dimension_string("3x8x2")
@@ -42,3 +62,10 @@ def test_dimension_string_parsing():
         parse_dimension_string("x")
 
     assert parse_dimension_string("100x100") == (100, 100)
+
+
+def test_dimension_snapping(settings):
+    settings.RESPA_IMAGE_RENDITION_SIZES = ((100, 100), (200, 200))
+    assert snap_dimensions(1, 1) == (100, 100)
+    assert snap_dimensions(150, 50) == (200, 200)
+    assert snap_dimensions(5000, 5000) == (200, 200)
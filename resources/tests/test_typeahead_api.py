@@ -89,3 +89,32 @@ def test_typeahead_api_full_response(rf, typeahead_test_objects, typeahead_view)
     # Check that we get more data than with the non-full mode for resources:
     assert all(key in response_data["resource"][0] for key in ("id", "type", "name", "unit"))
     assert all(key in response_data["unit"][0] for key in ("id", "time_zone", "name", "phone"))
+
+
+@pytest.mark.django_db
+def test_typeahead_api_ordering_and_updates(rf, typeahead_test_objects, typeahead_view):
+    unit = typeahead_test_objects["unit"]
+    other_unit = Unit.objects.create(name="Testiasema")
+
+    response = typeahead_view(request=rf.get("/", {"input": "testi", "types": "unit"}))
+    assert [obj["id"] for obj in response.data["unit"]] == [other_unit.id, unit.id]
+
+    # Saving an object must show up in the next suggestions
+    unit.name = "Kirjasto"
+    unit.save()
+    response = typeahead_view(request=rf.get("/", {"input": "testi", "types": "unit"}))
+    assert [obj["id"] for obj in response.data["unit"]] == [other_unit.id]
+    response = typeahead_view(request=rf.get("/", {"input": "kirj", "types": "unit"}))
+    assert [obj["id"] for obj in response.data["unit"]] == [unit.id]
+
+
+@pytest.mark.django_db
+def test_typeahead_api_skips_hidden_matches(monkeypatch, rf, typeahead_test_objects, typeahead_view, space_resource_type):
+    monkeypatch.setattr("resources.api.search.TYPEAHEAD_BATCH_SIZE", 2)
+    # hidden resources sort before the visible ones and fill more than one batch
+    for i in range(3):
+        Resource.objects.create(unit=typeahead_test_objects["unit"], type=space_resource_type,
+                                authentication="none", name="Testiaaa %d" % i, public=False)
+
+    response = typeahead_view(request=rf.get("/", {"input": "testi", "types": "resource"}))
+    assert [obj["id"] for obj in response.data["resource"]] == [typeahead_test_objects["sauna"].id]
@@ -2,8 +2,10 @@
 import pytest
 
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from guardian.shortcuts import assign_perm
 
+from resources.models.permission_index import get_unit_permission_cache_version
 from .utils import check_only_safe_methods_allowed
 
 
@@ -51,3 +53,12 @@ def test_user_perms(api_client, list_url, staff_user, user, test_unit):
     assert list(perms.keys()) == ['unit']
     perms = perms['unit']
     assert list(perms.items()) == [(test_unit.id, ['can_approve_reservation'])]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_unit_permission_cache_is_invalidated_after_commit(staff_user, test_unit):
+    with transaction.atomic():
+        assign_perm('can_approve_reservation', staff_user, test_unit)
+        # permissions cached with this version by another process before the commit are stale
+        version = get_unit_permission_cache_version()
+    assert get_unit_permission_cache_version() != version
@@ -1,16 +1,12 @@
 import datetime
 from collections import namedtuple
-from itertools import groupby
 
-import arrow
-import django.db.models as djdbm
 import pytz
-from django.db.models import Prefetch
 from django.utils import timezone
 from django.utils.dateformat import format
-from psycopg2.extras import DateRange, DateTimeTZRange
+from psycopg2.extras import DateTimeTZRange
 
-from .models import Day, Period, Reservation, Resource, ResourceType, Unit
+from .models import Resource, get_available_hours_for_resources, get_opening_hours_for_resources
 
 OpenHours = namedtuple("OpenHours", ['opens', 'closes'])
 FreeTime = namedtuple("FreeTime", ['begin', 'end', 'duration'])
@@ -218,74 +214,48 @@ class TimeWarp(object):
         return resp
 
 
+def _get_resources(resources=None):
+    if resources is None:
+        resources = Resource.objects.all()
+    if hasattr(resources, 'select_related'):
+        resources = resources.select_related('unit')
+    return [resource for resource in resources if resource.unit_id]
+
+
+def _to_open_hours(hours):
+    if not hours or not hours[0]['opens']:
+        return False
+    return OpenHours(hours[0]['opens'], hours[0]['closes'])
+
+
 def get_opening_hours(begin, end, resources=None):
     """
     :type begin:datetime.date
     :type end:datetime.date
-    :type resources: Resource | None
-    :rtype: dict[datetime, dict[Resource, list[OpenHours]]]
+    :type resources: django.db.models.QuerySet | list[Resource] | None
+    :rtype: dict[datetime.date, dict[Resource, list[OpenHours]]]
 
     Find opening hours for all resources on a given time period.
 
     If resources is None, finds opening hours for all resources.
 
-    This version goes through all regular periods and then all
-    exception periods that are found overlapping the given
-    time range. It builds a dict of days that has dict of
-    resources with their active hours.
-
-    TODO: There is couple optimization avenues worth exploring
-    with prefetch or select_related for Periods'
-    relational fields Unit, Resource and Day. This way all
-    relevant information could be requested with one or two
-    queries from the db.
+    Builds a dict of days that has dict of resources with their active hours.
+    Resources that are closed on a day are left out of it. The periods and days
+    of all resources are fetched in two queries.
     """
-    if not resources:
-        resources = Resource.objects.all()
+    resources = _get_resources(resources)
 
     if not begin < end:
         end = begin + datetime.timedelta(days=1)
 
-    d_range = DateRange(begin, end)
-
-    periods = Period.objects.filter(
-        djdbm.Q(resource__in=resources) | djdbm.Q(unit__in=resources.values("unit__pk")),
-        duration__overlap=d_range).order_by('exception')
-
-    begin_dt = datetime.datetime.combine(begin, datetime.time(0, 0))
-    end_dt = datetime.datetime.combine(end, datetime.time(0, 0))
-
-    # Generates a dict of time range's days as keys and values as active period's days
-
-    # all requested dates are assumed closed
-    dates = {r.date(): False for r in arrow.Arrow.range('day', begin_dt, end_dt)}
-
-    for period in periods:
-
-        if period.start < begin:
-            start = begin_dt
-        else:
-            start = arrow.get(period.start)
-        if period.end > end:
-            end = end_dt
-        else:
-            end = arrow.get(period.end)
-
-        if period.resource:
-            period_resources = [period.resource]
-        else:
-            period_resources = period.unit.resources.filter(pk__in=resources)
-
-        for res in period_resources:
-
-            for r in arrow.Arrow.range('day', start, end):
-                for day in period.days.all():
-                    if day.weekday is r.weekday():
-                        if not dates.get(r.date(), None):
-                            dates[r.date] = {}
-                        dates[r.date()].setdefault(
-                            res, []).append(
-                            OpenHours(day.opens, day.closes))
+    dates = {}
+    opening_hours = get_opening_hours_for_resources(resources, begin, end)
+    for res in resources:
+        for date, hours in opening_hours[res.pk].items():
+            open_hours = _to_open_hours(hours)
+            day = dates.setdefault(date, {})
+            if open_hours:
+                day.setdefault(res, []).append(open_hours)
 
     return dates
 
@@ -296,272 +266,55 @@ def get_availability(begin, end, resources=None, duration=None):
 
     This function calculates both for given time range
 
-    Given a queryset of resources (even if just one) can calculate
+    Given resources (a queryset or a list, even if just one) calculates
     applicable opening hours and free time slots between
-    begin and end of day and reservations for days that
-    have reservations
-
-    Does not currently check if resource is open shorter time
-    than duration
-
-    :param begin:
-    :type begin:
-    :param end:
-    :type end:
-    :param duration:
-    :type duration:
-    :param resources:
-    :type resources:
-    :return:
-    :rtype:
+    opening hours and reservations for every day of the range
+
+    Runs a fixed number of queries regardless of the number of
+    resources and days: two for periods and their days and one for
+    reservations
+
+    Opening hours are a dict of dates and OpenHours, or False if the
+    resource is closed. Availability is a dict of dates and a list of
+    FreeTime objects. An empty list for a date means no availability
+
+    If duration is given, free time shorter than it won't be returned
+
+    :param begin: start of the range, naive datetimes are in the current time zone
+    :type begin: datetime.datetime
+    :param end: end of the range
+    :type end: datetime.datetime
+    :param resources: resources to check, all resources if None
+    :type resources: django.db.models.QuerySet | list[Resource] | None
+    :param duration: minimum length of free time
+    :type duration: datetime.timedelta | None
+    :return: opening hours and availability by resource and date
+    :rtype: (dict[Resource, dict[datetime.date, OpenHours | bool]],
+             dict[Resource, dict[datetime.date, list[FreeTime]]])
     """
-    if not resources:
-        resources = Resource.objects.all()
-
-    dt_range = DateTimeTZRange(begin, end)
+    resources = _get_resources(resources)
 
-    if not begin < end:
-        end_d = begin + datetime.timedelta(days=1)
-        d_range = DateRange(begin.date, end_d.date())
-    else:
-        d_range = DateRange(begin.date(), end.date())
-
-    # Saved query for overlapping periods, fetching also their Day items
-    qs_periods = Period.objects.filter(
-        duration__overlap=d_range
-    ).order_by('exception').prefetch_related('days')
-
-    # Saved query for Unit's overlapping periods, fetching also their Day items
-    qs_unit_periods = Unit.objects.filter(
-        periods__duration__overlap=d_range
-    ).order_by('periods__exception').prefetch_related('periods__days')
-
-    # Saved query for overlapping reservations
-    qs_reservations = Reservation.objects.filter(duration__overlap=dt_range)
-
-    # Get all resources and prefetch to stated attributes to the items
-    # their matching Period, Unit and Reservation
-    # items according to queries defined above
-
-    resources_during_time = resources.prefetch_related(
-        Prefetch('periods', queryset=qs_periods, to_attr='overlapping_periods'),
-        Prefetch('unit', queryset=qs_unit_periods, to_attr='overlapping_unit'),
-        Prefetch('reservations', queryset=qs_reservations, to_attr='overlapping_reservations')
-    )
+    begin = TimeWarp(dt=begin).dt
+    end = TimeWarp(dt=end).dt
 
     # NOTE: Resource's Period overrides Unit's Period
+    hours_by_resource = get_opening_hours_for_resources(resources, begin, end)
+    free_hours_by_resource = get_available_hours_for_resources(resources, begin, end, duration=duration,
+                                                               opening_hours=hours_by_resource)
 
     opening_hours = {}
     availability = {}
 
-    for res in resources_during_time:
-        opening_hours[res] = periods_to_opening_hours(res, begin, end)
-
-        if duration:
-            availability[res] = calculate_availability(res, opening_hours[res], duration)
+    for res in resources:
+        zone = pytz.timezone(res.unit.time_zone)
+        opening_hours[res] = {}
+        availability[res] = {}
+        for date, hours in hours_by_resource[res.pk].items():
+            opening_hours[res][date] = _to_open_hours(hours)
+            availability[res][date] = []
+        for free_hours in free_hours_by_resource[res.pk]:
+            starts = free_hours['starts'].astimezone(zone)
+            ends = free_hours['ends'].astimezone(zone)
+            availability[res].setdefault(starts.date(), []).append(FreeTime(starts, ends, ends - starts))
 
     return opening_hours, availability
-
-
-def calculate_availability(resource, opening_hours, duration=None):
-    """
-    Goes through reservations for given resource
-
-    Calculates available time for days with reservations
-    based on reservation duration and opening hours
-
-    Availability is dictionary of dates and a list of
-    FreeTime objects with begin and end DateTime fields
-
-    If duration is given and longer than free time, it won't be returned
-
-    Empty list for a date means no availability
-
-    Reservations that occupy whole day or longer are handled
-
-    :param resource:
-    :type resource:
-    :param opening_hours:
-    :type opening_hours:
-    :param duration:
-    :type duration:
-    :return:
-    :rtype:
-    """
-    reservations_by_day = groupby(resource.overlapping_reservations,
-                                  key=lambda rsv: rsv.begin.date())
-
-    availability = {}
-
-    for day, reservations in reservations_by_day:
-        first = opening_hours[day].opens
-        last = opening_hours[day].closes
-
-        first = TimeWarp(dt=first).astimezone('UTC')
-        last = TimeWarp(dt=last).astimezone('UTC')
-
-        full_time = []
-
-        for n, rsv in enumerate(reservations):
-            if first >= rsv.begin and last <= rsv.end:
-                # Whole opening time could be reserved, thus rendering whole day unavailable
-                full_time = []
-                break
-            if first > rsv.begin:
-                # Reservation overlaps beginning of opening time
-                first = rsv.end
-            if last > rsv.begin:
-                # Reservation overlaps end of opening time
-                last = rsv.begin
-
-            # First free time between opening and first reservation
-            if n == 0:
-                # If day does not start with a reserved time
-                if first < rsv.begin:
-                    begin = first
-                    end = rsv.begin
-                    if duration and duration > (end - begin):
-                        # this free time slot is not long enough
-                        continue
-                    full_time.append(FreeTime(begin, end, end - begin))
-            else:
-                if last > rsv.end:
-                    begin = rsv.end
-                    # if there is more reservations on this day
-                    if n + 1 < len(day):
-                        end = day[n + 1].begin
-                    # otherwise free time ends with closing
-                    else:
-                        end = last
-                    if duration and duration > (end - begin):
-                        # this free time slot is not long enough
-                        continue
-                    full_time.append(FreeTime(begin, end, end - begin))
-
-        availability[day] = full_time
-
-    return availability
-
-
-def periods_to_opening_hours(resource, begin_dt, end_dt):
-    """
-    Goes through resource's unit's periods and its own
-    periods
-
-    Creates opening hours for each day
-
-    First unit's regular days are processed, then their exceptions
-    Then same order for resource itself
-
-    Resulting date dict is union of all periodical information
-    or false if given day is closed
-
-    Also, all days that don't have a period are assumed closed
-
-    :param resource:
-    :type resource:
-    :param begin:
-    :type begin:
-    :param end:
-    :type end:
-    :return:
-    :rtype:
-    """
-    #begin_dt = datetime.datetime.combine(begin, datetime.time(0, 0))
-    #end_dt = datetime.datetime.combine(end, datetime.time(0, 0))
-
-    begin_d = begin_dt.date()
-    end_d = end_dt.date()
-
-    # Generates a dict of time range's days as keys and values as active period's days
-
-    # all requested dates are assumed closed
-    dates = {r.date(): False for r in arrow.Arrow.range('day', begin_dt, end_dt)}
-
-    if resource.overlapping_unit:
-        for period in resource.overlapping_unit.periods.all():
-            if period.start < begin_d:
-                start = begin_dt
-            else:
-                start = arrow.get(period.start)
-            if period.end > end_d:
-                end = end_dt
-            else:
-                end = arrow.get(period.end)
-
-            for r in arrow.Arrow.range('day', start, end):
-                for day in period.days.all():
-                    if day.weekday is r.weekday():
-                        if day.closed:
-                            dates[r.date()] = False
-                        else:
-                            if day.closes < day.opens:
-                                # Day that closes before it opens means closing next day
-                                closes = datetime.datetime.combine(
-                                    r.date() + datetime.timedelta(days=1),
-                                    day.closes)
-                            else:
-                                closes = datetime.datetime.combine(r.date(), day.closes)
-                            opens = datetime.datetime.combine(r.date(), day.opens)
-                            dates[r.date()] = OpenHours(opens, closes)
-
-    for period in resource.overlapping_periods:
-        if period.start < begin_d:
-            start = begin_dt
-        else:
-            start = arrow.get(period.start)
-        if period.end > end_d:
-            end = end_dt
-        else:
-            end = arrow.get(period.end)
-
-        for r in arrow.Arrow.range('day', start, end):
-            for day in period.days.all():
-                if day.weekday is r.weekday():
-                    if day.closed:
-                        dates[r.date()] = False
-                    else:
-                        if day.closes < day.opens:
-                            # Day that closes before it opens means closing next day
-                            closes = datetime.datetime.combine(
-                                r.date() + datetime.timedelta(days=1),
-                                day.closes)
-                        else:
-                            closes = datetime.datetime.combine(r.date(), day.closes)
-                        opens = datetime.datetime.combine(r.date(), day.opens)
-                        dates[r.date()] = OpenHours(opens, closes)
-    return dates
-
-
-def set():
-    u1 = Unit.objects.create(name='Unit 1', id='unit_1')
-    rt = ResourceType.objects.create(name='Type 1', id='type_1', main_type='space')
-    Resource.objects.create(name='Resource 1a', id='r1a', unit=u1, type=rt)
-    Resource.objects.create(name='Resource 1b', id='r1b', unit=u1, type=rt)
-    Resource.objects.create(name='Resource 2a', id='r2a', unit=u1, type=rt)
-    Resource.objects.create(name='Resource 2b', id='r2b', unit=u1, type=rt)
-
-    # Regular hours for one week
-    p1 = Period.objects.create(start=datetime.date(2015, 8, 3), end=datetime.date(2015, 8, 9),
-                               unit=u1, name='regular hours')
-    Day.objects.create(period=p1, weekday=0, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-    Day.objects.create(period=p1, weekday=1, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-    Day.objects.create(period=p1, weekday=2, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-    Day.objects.create(period=p1, weekday=3, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-    Day.objects.create(period=p1, weekday=4, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-    Day.objects.create(period=p1, weekday=5, opens=datetime.time(12, 0), closes=datetime.time(16, 0))
-    Day.objects.create(period=p1, weekday=6, opens=datetime.time(12, 0), closes=datetime.time(14, 0))
-
-    # Two shorter days as exception
-    exp1 = Period.objects.create(start=datetime.date(2015, 8, 6), end=datetime.date(2015, 8, 7),
-                                 unit=u1, name='exceptionally short days', exception=True,
-                                 parent=p1)
-    Day.objects.create(period=exp1, weekday=3,
-                       opens=datetime.time(12, 0), closes=datetime.time(14, 0))
-    Day.objects.create(period=exp1, weekday=4,
-                       opens=datetime.time(12, 0), closes=datetime.time(14, 0))
-
-    # Weekend is closed as an exception
-    exp2 = Period.objects.create(start=datetime.date(2015, 8, 8), end=datetime.date(2015, 8, 9),
-                                 unit=u1, name='weekend is closed', closed=True, exception=True,
-                                 parent=p1)
@@ -1,9 +1,14 @@
+import hashlib
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework import renderers
+from rest_framework import permissions, renderers
 from rest_framework.reverse import reverse
 from icalendar import Calendar, Event, vDatetime, vText, vGeo
 
@@ -13,6 +18,8 @@ from resources.models import Reservation, Resource
 def build_reservations_ical_file(reservations):
     """
     Return iCalendar file containing given reservations
+
+    Units and resources of the reservations should be loaded with select_related.
     """
 
     cal = Calendar()
@@ -48,12 +55,35 @@ class ICalRenderer(renderers.BaseRenderer):
         return data.decode(self.charset)
 
 
+ICAL_FEED_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def get_ical_feed_etag(reservations):
+    """
+    ETag of a feed of the reservations. Saving a reservation updates its modified_at
+    and reservations that are removed from the feed change the count. The feed shows
+    the names of resources and the names and addresses of units, so their changes
+    count as well.
+    """
+    state = reservations.aggregate(
+        count=Count('id'), modified_at=Max('modified_at'),
+        resource_modified_at=Max('resource__modified_at'), unit_modified_at=Max('resource__unit__modified_at'))
+    key = '{count}:{modified_at}:{resource_modified_at}:{unit_modified_at}'.format(**state)
+    return '"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
 class ICalFeedView(APIView):
     """
     Fetch a user's reservations in iCalendar format
+
+    Calendar clients poll the feed, so it's answered with 304 when it hasn't
+    changed since the ETag the client has, and otherwise rendered from the
+    cache unless a reservation of the user has changed.
     """
 
     renderer_classes = (ICalRenderer, )
+    # The token in the url is the authentication
+    permission_classes = (permissions.AllowAny, )
 
     def get(self, request, ical_token, format=None):
         User = get_user_model()
@@ -62,6 +92,17 @@ class ICalFeedView(APIView):
         except User.DoesNotExist:
             raise PermissionDenied
         reservations = Reservation.objects.filter(user=user).active()
-        ical_file = build_reservations_ical_file(reservations)
+
+        etag = get_ical_feed_etag(reservations)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        cache_key = 'resources:ical:%s:%s' % (user.pk, etag.strip('"'))
+        ical_file = cache.get(cache_key)
+        if ical_file is None:
+            ical_file = build_reservations_ical_file(reservations.select_related('resource', 'resource__unit'))
+            cache.set(cache_key, ical_file, ICAL_FEED_CACHE_TIMEOUT)
         response = Response(ical_file)
+        response['ETag'] = etag
         return response
@@ -1,11 +1,16 @@
+import hashlib
 import os
 from mimetypes import guess_type
 
-from django.http.response import FileResponse, HttpResponseBadRequest
+from django.conf import settings
+from django.http.response import FileResponse, HttpResponse, HttpResponseBadRequest
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.generic import DetailView
-from easy_thumbnails.files import get_thumbnailer
 
 from resources.models import ResourceImage
+from resources.models.resource import get_image_rendition_sizes
+
+IMAGE_CACHE_MAX_AGE = 7 * 24 * 60 * 60
 
 
 def parse_dimension_string(dim):
@@ -28,11 +33,36 @@ def parse_dimension_string(dim):
         width = height = 0
     if not (width > 0 and height > 0):
         raise ValueError("width and height must be positive integers")
-    # FIXME: Check allowed image dimensions better
     return (width, height)
 
 
+def snap_dimensions(width, height):
+    """
+    The smallest rendition size covering the given dimensions, or the largest size.
+
+    :rtype: tuple[int, int]
+    """
+    sizes = get_image_rendition_sizes()
+    for size in sizes:
+        if size[0] >= width and size[1] >= height:
+            return size
+    return sizes[-1]
+
+
+def get_image_etag(image, size):
+    key = '%s:%s:%s' % (image.image.name, image.cropping, size)
+    return '"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
 class ResourceImageView(DetailView):
+    """
+    Serve a resource image, or a rendition of it with `dim=<width>x<height>`.
+
+    Dimensions are snapped to the nearest rendition size. Renditions are generated
+    when an image is saved, so normally they are only looked up here. With the
+    RESPA_IMAGE_SENDFILE_HEADER setting ("X-Accel-Redirect" or "X-Sendfile") the
+    file is left for the web server to send.
+    """
     model = ResourceImage
 
     def get(self, request, *args, **kwargs):
@@ -41,26 +71,40 @@ class ResourceImageView(DetailView):
         dim = request.GET.get('dim', None)
         if dim:
             try:
-                width, height = parse_dimension_string(dim)
+                size = snap_dimensions(*parse_dimension_string(dim))
             except ValueError as verr:
                 return HttpResponseBadRequest(str(verr))
         else:
-            width = height = None
+            size = None
+
+        etag = get_image_etag(image, size)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is None:
+            if not size:
+                out_image = image.image
+                filename = image.image.name
+            else:
+                out_image = image.get_rendition(size)
+                filename = "%s-%dx%d%s" % (image.image.name, size[0], size[1], os.path.splitext(out_image.name)[1])
+            resp = self.get_file_response(out_image, guess_type(filename, False)[0])
+            resp["Content-Disposition"] = "attachment; filename=%s" % os.path.basename(filename)
+        else:
+            resp = not_modified
+
+        resp["ETag"] = etag
+        patch_cache_control(resp, public=True, max_age=IMAGE_CACHE_MAX_AGE)
+        return resp
 
-        if not width:
-            out_image = image.image
-            filename = image.image.name
+    def get_file_response(self, image_file, content_type):
+        header = getattr(settings, 'RESPA_IMAGE_SENDFILE_HEADER', None)
+        if header == 'X-Accel-Redirect':
+            resp = HttpResponse(content_type=content_type)
+            prefix = getattr(settings, 'RESPA_IMAGE_ACCEL_REDIRECT_PREFIX', settings.MEDIA_URL)
+            resp[header] = prefix.rstrip('/') + '/' + image_file.name
+        elif header == 'X-Sendfile':
+            resp = HttpResponse(content_type=content_type)
+            resp[header] = image_file.path
         else:
-            out_image = get_thumbnailer(image.image).get_thumbnail({
-                'size': (width, height),
-                'box': image.cropping,
-                'crop': True,
-                'detail': True,
-            })
-            filename = "%s-%dx%d%s" % (image.image.name, width, height, os.path.splitext(out_image.name)[1])
-
-        # FIXME: Use SendFile headers instead of Django output when not in debug mode
-        out_image.seek(0)
-        resp = FileResponse(out_image, content_type=guess_type(filename, False)[0])
-        resp["Content-Disposition"] = "attachment; filename=%s" % os.path.basename(filename)
+            image_file.seek(0)
+            resp = FileResponse(image_file, content_type=content_type)
         return resp
@@ -23,7 +23,7 @@ def testing_view(request):
     duration = request.GET.get('duration', 2)
     begin = datetime.datetime.strptime(start_date, '%Y-%m-%d')
     end = datetime.datetime.strptime(end_date, '%Y-%m-%d')
-    duration = datetime.timedelta(hours=duration)
+    duration = datetime.timedelta(hours=int(duration))
     openings, avail = resources.timetools.get_availability(begin, end, duration=duration)
 
     return HttpResponse('<html><body>opens<br><pre>' + pprint.pformat(openings.values()) + '</pre> avail<br>' +
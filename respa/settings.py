@@ -122,6 +122,22 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+#
+# Cached resource data, permissions and typeahead indexes are invalidated by
+# bumping a version number in the cache, so every process must use the same
+# cache. Create the table of the database cache with
+# `python manage.py createcachetable`, or override this with another shared
+# backend such as memcached in local_settings.py.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'respa_cache',
+    }
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/